@@ -0,0 +1,67 @@
+"""
+Lookups per second of the telephone directory server (see clientserver.py) for sequential GET
+requests, pipelined GET requests and batched MGET requests:
+
+    python benchmark.py [--mode sequential|selectors|threads] [--lookups N] [--window W] [--batch B]
+"""
+
+import argparse
+import logging
+import threading
+import time
+
+import clientserver
+
+
+def sequential(client, names, args):
+    """ One GET round trip after the other """
+    return [client.get(name) for name in names]
+
+
+def pipelined(client, names, args):
+    """ GET requests with at most args.window unanswered requests """
+    return client.get_many(names, args.window)
+
+
+def batched(client, names, args):
+    """ MGET requests of args.batch names """
+    return [number for i in range(0, len(names), args.batch) for number in client.mget(names[i:i + args.batch])]
+
+
+ACCESS = {'sequential': sequential, 'pipelined': pipelined, 'batched': batched}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark lookups of the telephone directory server')
+    parser.add_argument('--mode', default='selectors', choices=clientserver.MODES, help='server mode')
+    parser.add_argument('--lookups', type=int, default=10000, help='lookups per access pattern')
+    parser.add_argument('--window', type=int, default=64, help='unanswered requests when pipelining')
+    parser.add_argument('--batch', type=int, default=100, help='names per MGET request')
+    args = parser.parse_args()
+    logging.getLogger("vs2lab").setLevel(logging.WARNING)  # no per request logs
+
+    server = clientserver.Server(mode=args.mode)
+    server_thread = threading.Thread(target=server.serve)
+    server_thread.start()
+    server.ready.wait()
+    names = list(server.data_store)
+    names = [names[i % len(names)] for i in range(args.lookups)]
+    expected = [server.data_store[name] for name in names]
+
+    print("{:>12} {:>10} {:>12}".format('access', 'time[s]', 'lookups/s'))
+    try:
+        for label, access in ACCESS.items():
+            client = clientserver.Client(framed=True)
+            start = time.perf_counter()
+            numbers = access(client, names, args)
+            elapsed = time.perf_counter() - start
+            client.close()
+            assert numbers == expected, 'wrong results of ' + label
+            print("{:>12} {:>10.3f} {:>12.0f}".format(label, elapsed, len(names) / elapsed))
+    finally:
+        server._serving = False  # pylint: disable=protected-access
+        server_thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,78 @@
 Client and server using classes
 """
 
+import collections
+import concurrent.futures
 import logging
+import selectors
 import socket
+import struct
+import threading
 
 import const_cs
+import phonebook
 from context import lab_logging
 
 lab_logging.setup(stream_level=logging.INFO)  # init loging channels for the lab
 
 # pylint: disable=logging-not-lazy, line-too-long
 
+MODES = ("sequential", "selectors", "threads")
+
+FRAMED = "PROTO 2"  # request switching a connection to the framed protocol
+CHUNK_SIZE = 16384  # bytes of entries per GETALL frame
+MAX_FRAME = 1 << 20  # bytes of a request frame at most (larger requests close the connection)
+_LENGTH = struct.Struct("!I")  # frame header: payload length
+
+
+def frame(payload: str) -> bytes:
+    """ Length-prefixed frame of a request or response """
+    data = payload.encode('utf-8')
+    return _LENGTH.pack(len(data)) + data
+
+
+class Session:
+    """ Protocol state of a server connection: splits received data into requests, produces response data """
+
+    def __init__(self, server):
+        self.server = server
+        self.framed = False
+        self.buffer = bytearray()
+        self.responses = collections.deque()  # iterators of response data, in request order
+
+    def feed(self, data: bytes):
+        """ Take received data and queue the responses of all complete requests """
+        if not self.framed:  # every received block is a request
+            msg = data.decode('utf-8')
+            if msg == FRAMED:
+                self.framed = True
+                self.responses.append(iter([b"OK"]))
+            else:
+                self.responses.append(iter([self.server.handle(msg).encode('utf-8')]))
+            return
+        self.buffer += data
+        while len(self.buffer) >= _LENGTH.size:
+            (length,) = _LENGTH.unpack_from(self.buffer)
+            if length > MAX_FRAME:
+                raise ValueError(f"request frame of {length} bytes exceeds {MAX_FRAME} bytes")
+            if len(self.buffer) < _LENGTH.size + length:
+                break  # request incomplete
+            msg = self.buffer[_LENGTH.size:_LENGTH.size + length].decode('utf-8')
+            del self.buffer[:_LENGTH.size + length]
+            self.responses.append(frame(payload) for payload in self.server.respond(msg))
+
+    def output(self, limit=CHUNK_SIZE) -> bytes:
+        """ Next response data (about limit bytes, streamed responses are produced on demand) """
+        data = bytearray()
+        while self.responses and len(data) < limit:
+            chunk = next(self.responses[0], None)
+            if chunk is None:
+                self.responses.popleft()
+            else:
+                data += chunk
+        return bytes(data)
+
+
 class Server:
 
     #  The server.
@@ -19,12 +81,29 @@ class Server:
     # Protocol (text-based):
     #   - "GET name"    -> server returns number or "NOTFOUND"
     #   - "GETALL"      -> server returns all entries as lines "name:number"
+    #   - "MGET names"  -> names separated by newlines, server returns their numbers (or "NOTFOUND") as lines
+    #   - "IGET name"   -> like GET, ignoring case
+    #   - "PREFIX str"  -> server returns the entries whose name starts with str (ignoring case) as lines "name:number"
     #   - anything else  -> echo (original behaviour) -> returns data + '*'
+    # Requests and responses are utf-8 text, every received block is taken as one request. After
+    # "PROTO 2" (answered by "OK"), requests and responses are frames (4 byte length, utf-8 payload), several requests may be sent at once,
+    # request frames longer than MAX_FRAME close the connection and
+    # GETALL and PREFIX stream the entries in frames of about CHUNK_SIZE bytes, ended by an empty frame.
+    # The entries are the dict below or, with store, a phonebook file (see phonebook.py) of any size.
+
+    # Modes:
+    #   - "sequential"  -> one client at a time (original behaviour)
+    #   - "selectors"   -> all clients in one thread, requests of many persistent connections interleaved
+    #   - "threads"     -> every client in a thread of a pool (at most workers clients at a time)
 
     _logger = logging.getLogger("vs2lab.lab1.clientserver.Server")
     _serving = True
 
-    def __init__(self):
+    def __init__(self, mode="sequential", workers=32, store=None):
+        assert mode in MODES, 'unknown mode ' + str(mode)
+        self.mode = mode
+        self.workers = workers
+        self.ready = threading.Event()  # set as soon as the server accepts connections
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # prevents errors due to "addresses in use"
         self.sock.bind((const_cs.HOST, const_cs.PORT))
@@ -52,53 +131,242 @@ class Server:
         "Tim Braun": "+49 158 2345678",
         "Viktor Schroeder": "+49 156 3456789"
         }
+        if store is not None:
+            self.data_store = phonebook.PhoneBook(store)
+            self._logger.info(f"Server serving {len(self.data_store)} entries of {store}")
 
     def serve(self):
-        """ Serve echo """
+        """ Serve requests (one client at a time, see mode for concurrent serving) """
+        if self.mode == 'selectors':
+            self._serve_selectors()
+        elif self.mode == 'threads':
+            self._serve_threads()
+        else:
+            self._serve_sequential()
+        self.sock.close()
+        if isinstance(self.data_store, phonebook.PhoneBook):
+            self.data_store.close()
+        self._logger.info("Server down.")
+
+    def handle(self, msg: str) -> str:
+        """ Answer a single request (see protocol) """
+        if msg.startswith("GETALL"):
+            self._logger.info("Server processing GETALL request")
+            return "\n".join(f"{name}:{number}" for name, number in self.data_store.items())
+        if msg.startswith("GET "):
+            self._logger.info("Server processing GET request")
+            name = msg[4:]
+            self._logger.info(f"Server looking up name: {name}")
+            return self.data_store.get(name, "NOTFOUND")
+        if msg.startswith("MGET "):
+            self._logger.info("Server processing MGET request")
+            return "\n".join(self.data_store.get(name, "NOTFOUND") for name in msg[5:].split("\n"))
+        if msg.startswith("IGET "):
+            self._logger.info("Server processing IGET request")
+            return self.find(msg[5:])
+        if msg.startswith("PREFIX "):
+            self._logger.info("Server processing PREFIX request")
+            return "\n".join(f"{name}:{number}" for name, number in self.prefix(msg[7:]))
+        return msg + "*"  # echo
+
+    def find(self, name: str) -> str:
+        """ Number of name ignoring case or "NOTFOUND" """
+        if isinstance(self.data_store, phonebook.PhoneBook):
+            return self.data_store.find(name, "NOTFOUND")
+        key = name.casefold()
+        return next((number for other, number in self.data_store.items() if other.casefold() == key), "NOTFOUND")
+
+    def prefix(self, prefix: str):
+        """ Entries (name, number) whose name starts with prefix ignoring case """
+        if isinstance(self.data_store, phonebook.PhoneBook):
+            return self.data_store.prefix(prefix)
+        key = prefix.casefold()
+        return sorted((entry for entry in self.data_store.items() if entry[0].casefold().startswith(key)),
+                      key=lambda entry: phonebook.sort_key(entry[0]))
+
+    def respond(self, msg: str):
+        """ Answer a request of the framed protocol (generator of response frame payloads) """
+        if msg.startswith("GETALL"):
+            entries = self.data_store.items()
+        elif msg.startswith("PREFIX "):
+            entries = self.prefix(msg[7:])
+        else:
+            yield self.handle(msg)
+            return
+        self._logger.info("Server streaming entries")
+        chunk, size = [], 0
+        for name, number in entries:
+            line = f"{name}:{number}"
+            chunk.append(line)
+            size += len(line) + 1
+            if size >= CHUNK_SIZE:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield "\n".join(chunk)
+        yield ""  # end of entries
+
+    def _serve_connection(self, connection):
+        """ Answer the requests of a client until it closes the connection """
+        session = Session(self)
+        with connection:
+            while self._serving:  # forever (checked after requests or connection timeouts)
+                self._logger.info("Server waiting for data...")
+                try:
+                    data = connection.recv(1024)  # receive data from client
+                except socket.timeout:
+                    continue  # client idle
+                except ConnectionError:
+                    break  # client gone
+                if not data:
+                    break  # stop if client stopped
+                self._logger.info("Server received data: " + str(data))
+                try:
+                    session.feed(data)
+                    response = session.output()
+                    while response:
+                        self._send(connection, response)
+                        response = session.output()
+                except (ValueError, ConnectionError) as error:  # malformed request or client gone
+                    self._logger.warning(f"Server closing connection: {error!r}")
+                    break
+
+    def _send(self, connection, data: bytes):
+        """ Send all data, waiting for a slow client as long as the server is serving (threads mode
+        connections time out after a second, but only idle clients may be skipped, see _serve_threads) """
+        view = memoryview(data)
+        while view:
+            try:
+                sent = connection.send(view)
+            except socket.timeout:
+                if not self._serving:
+                    raise ConnectionAbortedError("server shutting down") from None
+                continue  # client not reading yet
+            view = view[sent:]
+
+    def _worker_done(self, future):
+        """ Log the failure of a worker (threads mode) """
+        error = future.exception()
+        if error is not None:
+            self._logger.error("Server worker failed", exc_info=error)
+
+    def _serve_sequential(self):
+        """ Serve one client after the other """
         self.sock.listen(1)
+        self.ready.set()
         while self._serving:  # as long as _serving (checked after connections or socket timeouts)
             try:
                 # pylint: disable=unused-variable
                 (connection, address) = self.sock.accept()  # returns new socket and address of client
-                while True:  # forever
-                    self._logger.info("Server waiting for data...")
-                    data = connection.recv(1024)  # receive data from client
-                    if not data:
-                        break  # stop if client stopped
-                    # connection.send(data + "*".encode('ascii'))  # return sent data plus an "*"
-                    self._logger.info("Server received data: " + str(data))
-                    msg = data.decode('ascii')
-                    if msg.startswith("GETALL"):
-                        self._logger.info("Server processing GETALL request")
-                        response = "\n".join(f"{name}:{number}" for name, number in self.data_store.items())
-                        connection.send(response.encode('ascii'))
-                    elif msg.startswith("GET "):
-                        self._logger.info("Server processing GET request")
-                        name = msg[4:]
-                        self._logger.info(f"Server looking up name: {name}")
-                        response = self.data_store.get(name, "NOTFOUND")
-                        connection.send(response.encode('ascii'))
-                connection.close()  # close the connection
+                self._serve_connection(connection)
             except socket.timeout:
                 pass  # ignore timeouts
-        self.sock.close()
-        self._logger.info("Server down.")
+
+    def _serve_threads(self):
+        """ Serve every client in a worker thread (at most workers clients at a time) """
+        self.sock.listen(socket.SOMAXCONN)
+        self.ready.set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while self._serving:
+                try:
+                    (connection, address) = self.sock.accept()  # pylint: disable=unused-variable
+                except socket.timeout:
+                    continue
+                connection.settimeout(1)  # workers notice the end of serving
+                pool.submit(self._serve_connection, connection).add_done_callback(self._worker_done)
+
+    def _service(self, connection, events, session, outbox) -> bool:
+        """ Read requests of a ready connection and send what it can take, False if the client stopped """
+        if events & selectors.EVENT_READ:
+            try:
+                data = connection.recv(CHUNK_SIZE)
+            except BlockingIOError:
+                return True
+            if not data:  # client stopped
+                return False
+            self._logger.info("Server received data: " + str(data))
+            session.feed(data)
+        if not outbox[connection]:
+            outbox[connection] = session.output()  # streamed responses are produced as they are sent
+        if outbox[connection]:
+            try:
+                sent = connection.send(outbox[connection])
+            except BlockingIOError:
+                sent = 0
+            outbox[connection] = outbox[connection][sent:]
+        return True
+
+    def _serve_selectors(self):
+        """ Serve all clients in a single thread, reading from whichever connection has data """
+        self.sock.listen(socket.SOMAXCONN)
+        self.sock.setblocking(False)
+        self.ready.set()
+        sel = selectors.DefaultSelector()
+        sel.register(self.sock, selectors.EVENT_READ)
+        sessions = {}  # connection -> session
+        outbox = {}  # connection -> response data not yet sent
+        while self._serving:
+            for key, events in sel.select(timeout=1):
+                connection = key.fileobj
+                if connection is self.sock:
+                    try:
+                        (connection, address) = self.sock.accept()  # pylint: disable=unused-variable
+                    except BlockingIOError:
+                        continue
+                    connection.setblocking(False)
+                    sel.register(connection, selectors.EVENT_READ)
+                    sessions[connection] = Session(self)
+                    outbox[connection] = b''
+                    continue
+                try:
+                    open_connection = self._service(connection, events, sessions[connection], outbox)
+                except (ValueError, ConnectionError) as error:  # malformed request or client gone
+                    self._logger.warning(f"Server closing connection: {error!r}")
+                    open_connection = False
+                if open_connection:
+                    writing = bool(outbox[connection] or sessions[connection].responses)
+                    sel.modify(connection, selectors.EVENT_READ | selectors.EVENT_WRITE if writing else selectors.EVENT_READ)
+                else:  # only this client is dropped
+                    sel.unregister(connection)
+                    del sessions[connection], outbox[connection]
+                    connection.close()
+        for connection in sessions:
+            connection.close()
+        sel.close()
 
 
 class Client:
     """ The client """
     logger = logging.getLogger("vs2lab.a1_layers.clientserver.Client")
 
-    def __init__(self):
+    def __init__(self, framed=False):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((const_cs.HOST, const_cs.PORT))
         self.logger.info("Client connected to socket " + str(self.sock))
+        self.framed = framed
+        self.reader = None  # buffered reading of frames (framed mode)
+        if framed:  # switch to the framed protocol (see Server)
+            self.sock.send(FRAMED.encode('utf-8'))
+            self.reader = self.sock.makefile('rb')
+            assert self._recv_exactly(2) == b"OK", 'server does not support the framed protocol'
+
+    def _recv_exactly(self, size: int) -> bytes:
+        """ Receive exactly size bytes """
+        data = self.reader.read(size)
+        if len(data) < size:
+            raise ConnectionError("server closed the connection")
+        return data
+
+    def _recv_frame(self) -> str:
+        """ Receive a frame of the framed protocol """
+        (length,) = _LENGTH.unpack(self._recv_exactly(_LENGTH.size))
+        return self._recv_exactly(length).decode('utf-8')
 
     def call(self, msg_in="Hello, world"):
         """ Call server """
-        self.sock.send(msg_in.encode('ascii'))  # send encoded string as data
+        self.sock.send(msg_in.encode('utf-8'))  # send encoded string as data
         data = self.sock.recv(1024)  # receive the response
-        msg_out = data.decode('ascii')
+        msg_out = data.decode('utf-8')
         print(msg_out)  # print the result
         self.sock.close()  # close the connection
         self.logger.info("Client down.")
@@ -107,21 +375,99 @@ class Client:
     def get(self, name: str) -> str:
         """ Get entry from server """
         self.logger.info(f"Client sending GET request for name: {name}")
-        self.sock.send(f"GET {name}".encode('ascii'))
+        if self.framed:
+            self.sock.sendall(frame(f"GET {name}"))
+            return self._recv_frame()
+        self.sock.send(f"GET {name}".encode('utf-8'))
         self.logger.info(f"Client sent GET request for name: {name}")
         data = self.sock.recv(1024)
         self.logger.info(f"Client received data: {data}")
-        return data.decode('ascii')
+        return data.decode('utf-8')
     
     def get_all(self) -> str:
-        """ Get all entries from server """
+        """ Get all entries from server (complete only in framed mode, see iter_all) """
+        if self.framed:
+            return "\n".join(f"{name}:{number}" for name, number in self.iter_all())
         self.logger.info("Client sending GETALL request")
-        self.sock.send("GETALL".encode('ascii'))
+        self.sock.send("GETALL".encode('utf-8'))
         self.logger.info("Client sent GETALL request")
         data = self.sock.recv(4096)
         self.logger.info(f"Client received data: {data}")
-        return data.decode('ascii')
+        return data.decode('utf-8')
+
+    def find(self, name: str) -> str:
+        """ Get entry from server ignoring case """
+        self.logger.info(f"Client sending IGET request for name: {name}")
+        if self.framed:
+            self.sock.sendall(frame(f"IGET {name}"))
+            return self._recv_frame()
+        self.sock.send(f"IGET {name}".encode('utf-8'))
+        return self.sock.recv(1024).decode('utf-8')
+
+    def iter_prefix(self, prefix: str):
+        """ Iterate over the entries (name, number) whose name starts with prefix ignoring case (framed mode).
+        Iterate to the end before sending the next request. """
+        assert self.framed, 'streaming needs the framed protocol'
+        self.logger.info(f"Client sending PREFIX request for: {prefix}")
+        self.sock.sendall(frame(f"PREFIX {prefix}"))
+        yield from self._iter_entries()
+
+    def iter_all(self):
+        """ Iterate over all entries (name, number) of the server, streamed in frames (framed mode).
+        Iterate to the end before sending the next request. """
+        assert self.framed, 'streaming needs the framed protocol'
+        self.logger.info("Client sending GETALL request")
+        self.sock.sendall(frame("GETALL"))
+        yield from self._iter_entries()
+
+    def _iter_entries(self):
+        """ Entries of a streamed response """
+        chunk = self._recv_frame()
+        while chunk:  # until the empty frame
+            for line in chunk.split("\n"):
+                name, _, number = line.rpartition(":")
+                yield name, number
+            chunk = self._recv_frame()
     
+    def pipeline(self, requests, window=64):
+        """ Send requests without waiting for each response (framed mode, no GETALL or PREFIX).
+        At most window requests are unanswered at a time. Yields the responses in request order. """
+        assert self.framed, 'pipelining needs the framed protocol'
+        assert window > 0, 'window must be positive'
+        pending = bytearray()  # requests not yet sent
+        in_flight = 0
+        for request in requests:
+            if in_flight == window:
+                if pending:
+                    self.sock.sendall(pending)
+                    pending.clear()
+                yield self._recv_frame()
+                in_flight -= 1
+            pending += frame(request)
+            in_flight += 1
+        if pending:
+            self.sock.sendall(pending)
+        for _ in range(in_flight):
+            yield self._recv_frame()
+
+    def get_many(self, names, window=64) -> list:
+        """ Get the numbers of many names with pipelined GET requests (framed mode) """
+        self.logger.info("Client sending pipelined GET requests")
+        return list(self.pipeline((f"GET {name}" for name in names), window))
+
+    def mget(self, names) -> list:
+        """ Get the numbers of many names with a single MGET request (complete only in framed mode) """
+        names = list(names)
+        self.logger.info(f"Client sending MGET request for {len(names)} names")
+        request = "MGET " + "\n".join(names)
+        if self.framed:
+            self.sock.sendall(frame(request))
+            return self._recv_frame().split("\n")
+        self.sock.send(request.encode('utf-8'))
+        return self.sock.recv(4096).decode('utf-8').split("\n")
+
     def close(self):
         """ Close socket """
+        if self.reader is not None:
+            self.reader.close()
         self.sock.close()
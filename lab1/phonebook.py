@@ -0,0 +1,147 @@
+"""
+Telephone directory stored in files, for directories with millions of entries.
+
+The data file holds lines "name:number" (utf-8) sorted by the case-folded name, the index file
+(data file name + ".idx") the offset of every line as 8 byte integers. Both are memory-mapped, so
+opening a directory is fast and only the pages touched by queries are read. Lookups, case-insensitive
+lookups and prefix searches are binary searches over the index (O(log n)).
+
+Build a directory from a file of "name:number" lines, or generate one for tests and benchmarks:
+
+    python phonebook.py SOURCE TARGET
+    python phonebook.py --generate N TARGET
+"""
+
+import argparse
+import mmap
+import struct
+
+_OFFSET = struct.Struct("<Q")
+
+
+def sort_key(name: str):
+    """ Order of the entries: case-insensitive, then exact name """
+    return name.casefold(), name
+
+
+def write(path: str, entries):
+    """ Write a directory file and its index from (name, number) pairs (sorted in memory) """
+    offset = 0
+    with open(path, 'wb') as data, open(path + ".idx", 'wb') as index:
+        for name, number in sorted(entries, key=lambda entry: sort_key(entry[0])):
+            assert "\n" not in name + number, 'entries must not contain newlines'
+            line = f"{name}:{number}\n".encode('utf-8')
+            index.write(_OFFSET.pack(offset))
+            data.write(line)
+            offset += len(line)
+
+
+def generate(n: int):
+    """ Synthetic entries (name, number) """
+    for i in range(n):
+        yield f"Name {i:08d}", f"+49 {150 + i % 30} {i % 10000000:07d}"
+
+
+def _map(path: str):
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+
+class PhoneBook:
+    """ Read-only directory of a file written by write (used like the dict of Server) """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = _map(path)
+        self.index = _map(path + ".idx")
+        self.size = len(self.index) // _OFFSET.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return (name for name, _ in self.items())
+
+    def __contains__(self, name) -> bool:
+        return self.get(name) is not None
+
+    def __getitem__(self, name: str) -> str:
+        number = self.get(name)
+        if number is None:
+            raise KeyError(name)
+        return number
+
+    def _entry(self, i: int):
+        """ (name, number) of the i-th line """
+        (start,) = _OFFSET.unpack_from(self.index, i * _OFFSET.size)
+        end = self.data.find(b"\n", start)
+        name, _, number = self.data[start:end].decode('utf-8').rpartition(":")
+        return name, number
+
+    def _lower_bound(self, key: str) -> int:
+        """ First line whose case-folded name is not less than key """
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0].casefold() < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _casefold_matches(self, key: str):
+        """ Entries whose case-folded name equals key """
+        for i in range(self._lower_bound(key), self.size):
+            name, number = self._entry(i)
+            if name.casefold() != key:
+                return
+            yield name, number
+
+    def get(self, name: str, default=None):
+        """ Number of name or default """
+        for other, number in self._casefold_matches(name.casefold()):
+            if other == name:
+                return number
+        return default
+
+    def find(self, name: str, default=None):
+        """ Number of name ignoring case or default """
+        return next((number for _, number in self._casefold_matches(name.casefold())), default)
+
+    def prefix(self, prefix: str):
+        """ Entries (name, number) whose name starts with prefix ignoring case, in directory order """
+        key = prefix.casefold()
+        for i in range(self._lower_bound(key), self.size):
+            name, number = self._entry(i)
+            if not name.casefold().startswith(key):
+                return
+            yield name, number
+
+    def items(self):
+        """ All entries (name, number) in directory order """
+        return (self._entry(i) for i in range(self.size))
+
+    def close(self):
+        """ Unmap the files """
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='build a telephone directory file')
+    parser.add_argument('source', nargs='?', help='file of "name:number" lines')
+    parser.add_argument('target', help='directory file to write (and its .idx index)')
+    parser.add_argument('--generate', type=int, help='write this many synthetic entries instead')
+    args = parser.parse_args()
+    if args.generate is not None:
+        write(args.target, generate(args.generate))
+        return
+    assert args.source, 'source file or --generate needed'
+    with open(args.source, encoding='utf-8') as f:
+        write(args.target, (line.rstrip("\n").rpartition(":")[::2] for line in f if line.strip()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,43 @@
 """
 Simple tcp server
+
+Without arguments, the server echoes the data of a single client. With --mode, it runs the
+telephone directory server of clientserver.py instead, which serves many clients concurrently
+in the selectors and threads modes:
+
+    python server.py [--mode sequential|selectors|threads] [--workers N] [--store FILE]
 """
 
+import argparse
 import socket
 import const_cs
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.bind((const_cs.HOST, const_cs.PORT))
-s.listen(1)
+parser = argparse.ArgumentParser(description='simple tcp server')
+parser.add_argument('--mode', choices=['sequential', 'selectors', 'threads'],
+                    help='run the clientserver.Server in this mode')
+parser.add_argument('--workers', type=int, default=32, help='worker threads of the threads mode')
+parser.add_argument('--store', help='serve the entries of this phonebook file (see phonebook.py)')
+args = parser.parse_args()
+
+if args.mode is not None:
+    import clientserver
+
+    server = clientserver.Server(mode=args.mode, workers=args.workers, store=args.store)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+else:
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((const_cs.HOST, const_cs.PORT))
+    s.listen(1)
 
-(connection, address) = s.accept()  # returns new socket and address of client
+    (connection, address) = s.accept()  # returns new socket and address of client
 
-while True:  # forever
-    data = connection.recv(1024)  # receive data from client
-    if not data:
-        break  # stop if client stopped
-    connection.send(data + "*".encode('utf-8'))  # return sent data plus an "*"
+    while True:  # forever
+        data = connection.recv(1024)  # receive data from client
+        if not data:
+            break  # stop if client stopped
+        connection.send(data + "*".encode('utf-8'))  # return sent data plus an "*"
 
-connection.close()  # close the connection
+    connection.close()  # close the connection
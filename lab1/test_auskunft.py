@@ -3,9 +3,14 @@ Simple client server unit test
 """
 
 import logging
+import os
+import struct
+import tempfile
 import threading
+import time
 import unittest
 import clientserver
+import phonebook
 from context import lab_logging
 
 lab_logging.setup(stream_level=logging.INFO)
@@ -19,6 +24,7 @@ class TestEchoService(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls._server_thread.start()
+        cls._server.ready.wait()
 
     def setUp(self):
         super().setUp()
@@ -39,6 +45,14 @@ class TestEchoService(unittest.TestCase):
         result = self.client.get("Max Mustermann")
         self.assertEqual(result, "NOTFOUND")
 
+    def test_srv_framed(self):
+        """Testet GET und GETALL im Protokoll mit Längenpräfix"""
+        self.client.close()  # der Server bedient nur einen Client gleichzeitig
+        client = clientserver.Client(framed=True)
+        self.assertEqual(client.get("Anna Mueller"), "+49 151 2345678")
+        self.assertEqual(dict(client.iter_all())["Viktor Schroeder"], "+49 156 3456789")
+        client.close()
+
     def test_srv_getall(self):
         """Testet GETALL – alle Einträge"""
         result = self.client.get_all()
@@ -56,5 +70,209 @@ class TestEchoService(unittest.TestCase):
         cls._server_thread.join()
 
 
+class TestConcurrentService(unittest.TestCase):
+    """Testet viele gleichzeitig verbundene Clients (Modus selectors)"""
+    mode = "selectors"
+    n_clients = 50
+
+    @classmethod
+    def setUpClass(cls):
+        cls._server = clientserver.Server(mode=cls.mode)
+        cls._server_thread = threading.Thread(target=cls._server.serve)
+        cls._server_thread.start()
+        cls._server.ready.wait()
+
+    def setUp(self):
+        super().setUp()
+        self.clients = [clientserver.Client() for _ in range(self.n_clients)]
+
+    def test_srv_interleaved(self):
+        """Testet abwechselnde GET und GETALL Anfragen über bestehende Verbindungen"""
+        for _ in range(2):
+            for i, client in enumerate(self.clients):
+                if i % 2:
+                    self.assertEqual(client.get("Tim Braun"), "+49 158 2345678")
+                else:
+                    self.assertEqual(len(client.get_all().splitlines()), 20)
+
+    def test_srv_parallel(self):
+        """Testet gleichzeitige Anfragen aus mehreren Threads"""
+        results = []
+
+        def ask(client):
+            results.append(client.get("Anna Mueller"))
+
+        threads = [threading.Thread(target=ask, args=(client,)) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["+49 151 2345678"] * self.n_clients)
+
+    def test_srv_bad_request(self):
+        """Testet, dass eine fehlerhafte Anfrage nur die Verbindung dieses Clients beendet"""
+        bad = clientserver.Client()
+        bad.sock.send(b"GET \xff\xfe")
+        self.assertEqual(bad.sock.recv(1024), b"")  # Verbindung geschlossen
+        bad.close()
+        for client in self.clients:
+            self.assertEqual(client.get("Tim Braun"), "+49 158 2345678")
+
+    def test_srv_frame_limit(self):
+        """Testet, dass eine zu lange Anfrage die Verbindung beendet, bevor sie gepuffert wird"""
+        bad = clientserver.Client(framed=True)
+        bad.sock.sendall(struct.pack("!I", clientserver.MAX_FRAME + 1) + b"GET ")
+        self.assertEqual(bad.sock.recv(1024), b"")  # Verbindung geschlossen
+        bad.close()
+        client = clientserver.Client(framed=True)
+        self.assertEqual(client.mget(["Tim Braun"] * 1000), ["+49 158 2345678"] * 1000)
+        client.close()
+
+    def test_srv_framed(self):
+        """Testet das Protokoll mit Längenpräfix: GET, Echo und gestreamtes GETALL"""
+        client = clientserver.Client(framed=True)
+        self.assertEqual(client.get("Anna Mueller"), "+49 151 2345678")
+        self.assertEqual(client.get("Max Mustermann"), "NOTFOUND")
+        self.assertEqual(len(client.get_all().splitlines()), 20)
+        # mehrere Anfragen in einem Segment
+        client.sock.sendall(clientserver.frame("GET Tim Braun") + clientserver.frame("Hallo"))
+        self.assertEqual(client._recv_frame(), "+49 158 2345678")  # pylint: disable=protected-access
+        self.assertEqual(client._recv_frame(), "Hallo*")  # pylint: disable=protected-access
+        client.close()
+
+    def test_srv_prefix(self):
+        """Testet PREFIX und IGET mit dem eingebauten Verzeichnis"""
+        client = clientserver.Client(framed=True)
+        self.assertEqual(dict(client.iter_prefix("an")), {"Anna Mueller": "+49 151 2345678"})
+        self.assertEqual(client.find("tim braun"), "+49 158 2345678")
+        client.close()
+
+    def test_srv_mget(self):
+        """Testet MGET und Pipelining mit begrenztem Fenster"""
+        client = clientserver.Client(framed=True)
+        names = ["Anna Mueller", "Max Mustermann", "Tim Braun"] * 100
+        expected = ["+49 151 2345678", "NOTFOUND", "+49 158 2345678"] * 100
+        self.assertEqual(client.mget(names), expected)
+        self.assertEqual(client.get_many(names, window=7), expected)
+        self.assertEqual(client.get_many(names[:2], window=10), expected[:2])
+        self.assertEqual(client.get("Anna Mueller"), "+49 151 2345678")
+        client.close()
+
+    def test_srv_stream_large(self):
+        """Testet GETALL mit einem Verzeichnis, das viel größer als ein Empfangspuffer ist"""
+        entries = {f"Name {i:06d}": f"+49 100 {i:07d}" for i in range(50000)}
+        self._server.data_store.update(entries)
+        try:
+            client = clientserver.Client(framed=True)
+            result = dict(client.iter_all())
+            self.assertEqual(len(result), 50020)
+            self.assertEqual(result["Name 049999"], "+49 100 0049999")
+            self.assertEqual(client.get("Name 012345"), "+49 100 0012345")
+            client.close()
+        finally:
+            for name in entries:
+                del self._server.data_store[name]
+
+    def test_srv_slow_consumer(self):
+        """Testet einen Client, der ein gestreamtes GETALL länger als das Timeout der Worker nicht liest"""
+        entries = {f"Name {i:06d}": f"+49 100 {i:07d}" for i in range(300000)}
+        self._server.data_store.update(entries)
+        try:
+            client = clientserver.Client(framed=True)
+            stream = client.iter_all()
+            for _ in range(10):
+                next(stream)
+            time.sleep(2.5)  # Sende- und Empfangspuffer laufen voll
+            self.assertEqual(sum(1 for _ in stream), 300010)
+            self.assertEqual(client.get("Name 012345"), "+49 100 0012345")
+            client.close()
+        finally:
+            for name in entries:
+                del self._server.data_store[name]
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._server._serving = False
+        cls._server_thread.join()
+
+
+class TestThreadPoolService(TestConcurrentService):
+    """Testet viele gleichzeitig verbundene Clients (Modus threads)"""
+    mode = "threads"
+    n_clients = 20  # höchstens so viele Clients wie Worker
+
+
+class TestFileStore(unittest.TestCase):
+    """Testet den Server mit einem Telefonbuch aus einer Datei"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = tempfile.TemporaryDirectory()
+        cls._path = os.path.join(cls._dir.name, "phonebook")
+        entries = list(phonebook.generate(20000)) + [("anna Mueller", "+49 1"), ("Anna Mueller", "+49 2"),
+                                                     ("Jürgen Müller", "+49 3")]
+        phonebook.write(cls._path, entries)
+        cls._server = clientserver.Server(mode="selectors", store=cls._path)
+        cls._server_thread = threading.Thread(target=cls._server.serve)
+        cls._server_thread.start()
+        cls._server.ready.wait()
+
+    def setUp(self):
+        super().setUp()
+        self.client = clientserver.Client(framed=True)
+
+    def test_store_get(self):
+        """Testet GET, MGET und IGET"""
+        self.assertEqual(self.client.get("Name 00012345"), "+49 165 0012345")
+        self.assertEqual(self.client.get("Anna Mueller"), "+49 2")
+        self.assertEqual(self.client.get("anna Mueller"), "+49 1")
+        self.assertEqual(self.client.get("ANNA MUELLER"), "NOTFOUND")
+        self.assertIn(self.client.find("ANNA MUELLER"), ("+49 1", "+49 2"))
+        self.assertEqual(self.client.find("name 00000007"), "+49 157 0000007")
+        self.assertEqual(self.client.find("Max Mustermann"), "NOTFOUND")
+        self.assertEqual(self.client.mget(["Name 00000000", "Name 99999999"]), ["+49 150 0000000", "NOTFOUND"])
+
+    def test_store_non_ascii(self):
+        """Testet Einträge mit Umlauten, auch ohne Längenpräfix"""
+        self.assertEqual(self.client.get("Jürgen Müller"), "+49 3")
+        self.assertEqual(dict(self.client.iter_prefix("jür")), {"Jürgen Müller": "+49 3"})
+        self.assertIn("Jürgen Müller:+49 3", self.client.get_all())
+        plain = clientserver.Client()
+        self.assertEqual(plain.get("Jürgen Müller"), "+49 3")
+        self.assertEqual(plain.find("JÜRGEN MÜLLER"), "+49 3")
+        self.assertEqual(plain.get("Anna Mueller"), "+49 2")  # Server läuft weiter
+        plain.close()
+
+    def test_store_prefix(self):
+        """Testet PREFIX und GETALL"""
+        names = [name for name, _ in self.client.iter_prefix("name 0001")]
+        self.assertEqual(names, [f"Name {i:08d}" for i in range(10000, 20000)])
+        self.assertEqual(list(self.client.iter_prefix("Max")), [])
+        self.assertEqual(len(list(self.client.iter_all())), 20003)
+
+    def test_phonebook(self):
+        """Testet das Telefonbuch direkt"""
+        book = phonebook.PhoneBook(self._path)
+        self.assertEqual(len(book), 20003)
+        self.assertEqual(book["Name 00019999"], "+49 169 0019999")
+        self.assertNotIn("Name 00020000", book)
+        self.assertEqual(len(list(book.prefix("ANNA"))), 2)
+        self.assertEqual(len(list(book.prefix(""))), 20003)
+        book.close()
+
+    def tearDown(self):
+        self.client.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._server._serving = False
+        cls._server_thread.join()
+        cls._dir.cleanup()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -20,6 +20,7 @@ class TestEchoService(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls._server_thread.start()  # start server loop in a thread (called only once)
+        cls._server.ready.wait()  # wait until the server accepts connections
 
     def setUp(self):
         super().setUp()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+
+import constRPC
+from rpc import DBList
+logger = logging.getLogger('vs2lab.lab2.rpc.rpc_async')
+
+
+class Client:
+    """
+    asyncio version of rpc.Client. Many clients can share one AsyncChannel and run as tasks in one process.
+    """
+
+    def __init__(self, chan):
+        self.chan = chan
+        self.client = None
+        self.server = None
+
+    async def run(self):
+        self.client = await self.chan.join('client')
+        self.chan.bind(self.client)  # bind the member to the current task
+        self.server = await self.chan.subgroup('server')
+
+    async def stop(self):
+        await self.chan.leave('client')
+
+    async def append(self, data, db_list):
+        assert isinstance(db_list, DBList)
+        msglst = (constRPC.APPEND, data, db_list)  # message payload
+        await self.chan.send_to(self.server, msglst)  # send msg to server
+        msgrcv = await self.chan.receive_from(self.server, 10)
+        if msgrcv is None:
+            raise TimeoutError
+        if msgrcv[1] != constRPC.OK:
+            raise RuntimeError("Expected: OK recieved: {}".format(msgrcv[1]))
+        logger.debug("OK recieved")
+        msgrcv = await self.chan.receive_from(self.server)  # wait for response
+        return msgrcv[1]  # pass it to caller
+
+
+class Server:
+    """
+    asyncio version of rpc.Server. Every request is served by its own task, so long running calls
+    of many clients overlap instead of being executed one after the other.
+    """
+
+    def __init__(self, chan):
+        self.chan = chan
+        self.server = None
+        self.timeout = 3
+        self.tasks = set()
+
+    @staticmethod
+    def append(data, db_list):
+        assert isinstance(db_list, DBList)  # - Make sure we have a list
+        return db_list.append(data)
+
+    async def serve(self, client, msgrpc):
+        if constRPC.APPEND == msgrpc[0]:  # check what is being requested
+            await self.chan.send_to({client}, constRPC.OK)  # send Acknowledgment
+            # Simulate long execution time with 10 second pause
+            await asyncio.sleep(10)
+            result = self.append(msgrpc[1], msgrpc[2])  # do local call
+            await self.chan.send_to({client}, result)  # return response
+        # unsupported requests are simply ignored
+
+    async def run(self):
+        self.server = await self.chan.join('server')
+        self.chan.bind(self.server)  # request tasks inherit the binding
+        while True:
+            msgreq = await self.chan.receive_from_any(self.timeout)  # wait for any request
+            if msgreq is not None:
+                task = asyncio.create_task(self.serve(msgreq[0], msgreq[1]))
+                self.tasks.add(task)  # keep a reference until the task is done
+                task.add_done_callback(self.tasks.discard)
@@ -0,0 +1,38 @@
+import asyncio
+import sys
+import time
+
+import rpc
+import rpc_async
+from context import lab_channel
+
+# Number of logical clients in this process. Each client waiting for a reply holds a redis connection,
+# so n is limited by the open file limit and the redis maxclients setting (see lab_channel.AsyncChannel).
+n = 1000
+
+# Check for command line parameter n.
+if len(sys.argv) > 1:
+    n = int(sys.argv[1])
+
+
+async def run_client(chan, i):
+    cl = rpc_async.Client(chan)
+    await cl.run()
+    try:
+        result_list = await cl.append('bar' + str(i), rpc.DBList({'foo'}))
+        return result_list.value
+    finally:
+        await cl.stop()
+
+
+async def main():
+    chan = lab_channel.AsyncChannel(n_bits=16, queue_mode='inbox')
+    start_time = time.time()
+    # every client runs as a task of its own with its own channel member
+    results = await asyncio.gather(*(run_client(chan, i) for i in range(n)))
+    elapsed_time = time.time() - start_time
+    rpc_async.logger.info("{} asynchronous appends done after {:.2f} seconds, e.g. {}"
+                          .format(len(results), elapsed_time, results[0]))
+    await chan.close()
+
+asyncio.run(main())
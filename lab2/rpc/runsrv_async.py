@@ -0,0 +1,18 @@
+import asyncio
+import logging
+
+import rpc_async
+from context import lab_channel
+
+logger = logging.getLogger('vs2lab.lab2.rpc.runsrv_async')
+
+
+async def main():
+    chan = lab_channel.AsyncChannel(n_bits=16, queue_mode='inbox')
+    await chan.channel.flushall()
+    logger.debug('Flushed all redis keys.')
+
+    srv = rpc_async.Server(chan)
+    await srv.run()
+
+asyncio.run(main())
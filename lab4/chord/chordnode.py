@@ -142,8 +142,7 @@ class ChordNode:
                 self.add_node(sender)  # remember sender node
 
             if request[0] == constChord.STOP:  # this node is requested to shutdown
-                self.logger.debug("Node {:04n} received STOP from {:04n}."
-                                  .format(self.node_id, int(sender)))
+                self.logger.debug("Node %04d received STOP from %04d.", self.node_id, int(sender))
                 break
 
             if request[0] == constChord.LOOKUP_REQ:  # A lookup request
@@ -151,21 +150,19 @@ class ChordNode:
                 # Extract original sender (for recursive forwarding, request[2] is the original sender)
                 original_sender = str(request[2]) if len(request) > 2 else sender
                 
-                self.logger.info("Node {:04n} received LOOKUP {:04n} from {:04n}."
-                                 .format(self.node_id, key, int(sender)))
+                self.logger.info("Node %04d received LOOKUP %04d from %04d.", self.node_id, key, int(sender))
 
                 # Recursive LOOKUP: Find the next hop locally
                 next_id: int = self.local_successor_node(key)
                 
                 if next_id == self.node_id:
                     # This node is responsible for the key, send result directly to original sender
-                    self.logger.info("Node {:04n} is responsible for key {:04n}, replying to {:04n}."
-                                     .format(self.node_id, key, int(original_sender)))
+                    self.logger.info("Node %04d is responsible for key %04d, replying to %04d.",
+                                     self.node_id, key, int(original_sender))
                     self.channel.send_to([original_sender], (constChord.LOOKUP_REP, self.node_id))
                 else:
                     # Recursively forward to the next hop, preserving original sender info
-                    self.logger.info("Node {:04n} forwarding LOOKUP {:04n} to {:04n}."
-                                     .format(self.node_id, key, next_id))
+                    self.logger.info("Node %04d forwarding LOOKUP %04d to %04d.", self.node_id, key, next_id)
                     # Send recursive lookup request to next hop with original sender
                     self.channel.send_to([str(next_id)], (constChord.LOOKUP_REQ, key, original_sender))
 
@@ -175,13 +172,11 @@ class ChordNode:
 
             elif request[0] == constChord.JOIN:
                 # Join request (the node was already registered above)
-                self.logger.debug("Node {:04n} received JOIN from {:04n}."
-                                  .format(self.node_id, int(sender)))
+                self.logger.debug("Node %04d received JOIN from %04d.", self.node_id, int(sender))
                 # we don't care for storage re-location in this example
                 continue
             elif request[0] == constChord.LEAVE:  # Leave request
-                self.logger.info("Node {:04n} received LEAVE from {:04n}."
-                                 .format(self.node_id, int(sender)))
+                self.logger.info("Node %04d received LEAVE from %04d.", self.node_id, int(sender))
                 self.delete_node(sender)  # update known nodes
 
             self.recompute_finger_table()  # adjust finger-table based on updated node set
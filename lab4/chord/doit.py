@@ -68,7 +68,7 @@ class DummyChordClient:
         
         # Send STOP signal to all nodes
         self.logger.info("[CLIENT] Sending STOP signal to all nodes")
-        self.channel.send_to(nodes, constChord.STOP)
+        self.channel.send_to_all(constChord.STOP, subgroup='node')
 
 
 def create_and_run(num_bits, node_class, enter_bar, run_bar):
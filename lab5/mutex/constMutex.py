@@ -8,3 +8,5 @@ WORKING = 'WORKING'
 ACTIVE = 'ACTIVE'
 PASSIVE = 'PASSIVE'
 BEHAVIOR_TYPES = [ACTIVE, PASSIVE]
+# Message encoding (clock, process id, request type), see lab_serializer.StructSerializer
+MESSAGE_FORMAT = '!q10s10s'
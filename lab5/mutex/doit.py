@@ -15,8 +15,8 @@ import multiprocessing as mp
 
 from process import Process
 
-from context import lab_channel, lab_logging
-from constMutex import BEHAVIOR_TYPES
+from context import lab_channel, lab_logging, lab_serializer
+from constMutex import BEHAVIOR_TYPES, MESSAGE_FORMAT
 
 lab_logging.setup(stream_level=logging.INFO, file_level=logging.DEBUG)
 
@@ -33,7 +33,9 @@ def create_and_run(num_bits, peer_name, peer_type, proc_class, enter_bar, run_ba
     :param enter_bar: barrier syncing channel population 
     :param run_bar: barrier syncing bootstrap
     """
-    chan = lab_channel.Channel(n_bits=num_bits)
+    # mutex messages are small fixed tuples, so use the compact struct encoding
+    chan = lab_channel.Channel(n_bits=num_bits,
+                               serializer=lab_serializer.StructSerializer(MESSAGE_FORMAT))
     proc = proc_class(chan)
     enter_bar.wait()  # wait for all peers to join the channel
     proc.init(peer_name, peer_type)  # do some bootstrapping
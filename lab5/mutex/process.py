@@ -190,13 +190,14 @@ class Process:
             self.clock = max(self.clock, msg[0])  # Adjust clock value...
             self.clock = self.clock + 1  # ...and increment
 
-            self.logger.debug("{} received {} from {}.".format(
+            self.logger.debug(
+                "%s received %s from %s.",
                 self.__mapid(),
                 "ENTER" if msg[2] == ENTER
                 else "ALLOW" if msg[2] == ALLOW
                 else "RELEASE" if msg[2] == RELEASE
                 else "HEARTBEAT" if msg[2] == HEARTBEAT
-                else "WORKING", self.__mapid(msg[1])))
+                else "WORKING", self.__mapid(msg[1]))
 
             if msg[2] == ENTER:
                 self.queue.append(msg)  # Append an ENTER request
@@ -266,8 +267,7 @@ class Process:
             if len(self.all_processes) > 1 and \
                     self.peer_type == ACTIVE and \
                     random.choice([True, False]):
-                self.logger.debug("{} wants to ENTER CS at CLOCK {}."
-                                  .format(self.__mapid(), self.clock))
+                self.logger.debug("%s wants to ENTER CS at CLOCK %s.", self.__mapid(), self.clock)
 
                 self.__request_to_enter()
                 while not self.__allowed_to_enter():
@@ -280,8 +280,7 @@ class Process:
 
                 # Stay in CS for some time ...
                 sleep_time = random.randint(0, 2000)
-                self.logger.debug("{} enters CS for {} milliseconds."
-                                  .format(self.__mapid(), sleep_time))
+                self.logger.debug("%s enters CS for %s milliseconds.", self.__mapid(), sleep_time)
                 print(" CS <- {}".format(self.__mapid()))
                 ###
                 self.clock = self.clock + 1  # Increment clock value
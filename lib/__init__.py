@@ -1 +1 @@
-__all__ = ['lab_channel.py', 'lab_logging.py']
+__all__ = ['lab_broker.py', 'lab_channel.py', 'lab_logging.py', 'lab_metrics.py', 'lab_serializer.py', 'lab_trace.py']
@@ -0,0 +1,414 @@
+"""
+Channel benchmarks
+
+transport
+    Measures the round trip latency of messages between two channel members (ping-pong, one member per
+    process) for different transport options: TCP vs. unix domain socket and hiredis vs. pure python parsing.
+    The blocked variant repeats the TCP run while a thread of the pinging process blocks in a receive on
+    the same channel (receives use their own connection, so the round trips must not wait for it).
+    Results can be saved as JSON (--output).
+suite
+    Spawns groups of K members (one process each) and measures unicast (ring), multicast (to all others)
+    and broadcast (send_to_all) throughput and p50/p99 latency, as well as the cost of join/leave,
+    for growing numbers of members and payload sizes. Results can be saved as JSON and compared
+    against a saved baseline (exit code 1 on regressions).
+shards
+    Runs the unicast scenario of the suite with the channel queues spread over a growing number of
+    servers (the main server plus 0..N of the given shards) and reports how throughput scales.
+logging
+    Runs the unicast scenario of the suite with DEBUG logging of all members to a file
+    (vs2lab-bench.log): off, synchronous, asynchronous and asynchronous with sampled channel
+    debug records (see lab_logging.setup), and reports messages per second of each mode.
+
+Run from the repository root with a running redis server (started with a unixsocket for the unix variants)
+or with the local broker (--backend local, see lab_broker):
+
+    python -m lib.channel_bench transport [--rounds N] [--payload BYTES] [--unix-socket PATH] [--output FILE]
+    python -m lib.channel_bench suite [--members 2,4,8] [--payloads 64,1024,16384] [--messages N]
+                                      [--scenarios unicast,multicast,broadcast,join_leave]
+                                      [--backend redis|local] [--output FILE] [--compare BASELINE]
+    python -m lib.channel_bench shards --shards localhost:6380,localhost:6381 [--members 2,4,8]
+                                       [--payload BYTES] [--messages N] [--backend redis|local]
+    python -m lib.channel_bench logging [--members 2,4,8] [--payload BYTES] [--messages N]
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import platform
+import statistics
+import sys
+import threading
+import time
+
+from redis.utils import HIREDIS_AVAILABLE
+
+from lib import channel_top, lab_broker, lab_channel, lab_logging
+
+SCENARIOS = ('unicast', 'multicast', 'broadcast', 'join_leave')
+
+# lab_logging.setup arguments of the logging benchmark (None: logging off)
+LOG_MODES = {'off': None,
+             'sync': {},
+             'async': {'async_mode': True},
+             'sampled': {'async_mode': True, 'sample': {'vs2lab.channel': 0.01}}}
+
+
+def _echo(options: dict, rounds: int) -> None:
+    """
+    Echo member: send every message back to its sender.
+    :param options: Channel constructor arguments
+    :param rounds: number of messages to echo
+    """
+    chan = lab_channel.Channel(**options)
+    chan.bind(chan.join('echo'))
+    for _ in range(rounds):
+        sender, message = chan.receive_from_any()
+        chan.send_to({sender}, message)
+    chan.leave('echo')
+
+
+def ping_pong(options: dict, rounds: int, payload: int, blocked: bool = False) -> list:
+    """
+    Measure round trip times between this process and an echo member process.
+    :param options: Channel constructor arguments
+    :param rounds: number of round trips
+    :param payload: message size in bytes
+    :param blocked: keep another member of this process blocked in a receive meanwhile
+    :return: list of round trip times in seconds
+    """
+    chan = lab_channel.Channel(**options)
+    chan.channel.flushall()
+    me = chan.join('ping')
+    chan.bind(me)
+    waiter = None
+    if blocked:
+        idle: lab_channel.Member = chan.member(chan.join('idle'))
+        waiter = threading.Thread(target=idle.receive_from_any)
+        waiter.start()
+    echo = mp.Process(target=_echo, args=(options, rounds))
+    echo.start()
+    while not chan.subgroup('echo'):
+        time.sleep(0.01)  # wait for echo member to join
+    peer: set = chan.subgroup('echo')
+
+    message = b'x' * payload
+    rtts: list = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        chan.send_to(peer, message)
+        chan.receive_from(peer)
+        rtts.append(time.perf_counter() - start)
+    echo.join()
+    if waiter is not None:
+        chan.send_to({idle.pid}, b'')  # wake up the blocked receiver
+        waiter.join()
+        idle.leave('idle')
+    chan.leave('ping')
+    return rtts
+
+
+def summarize(samples: list) -> dict:
+    """
+    Compute latency statistics.
+    :param samples: latencies in seconds
+    :return: dict with mean, p50 and p99 in microseconds
+    """
+    if len(samples) == 0:
+        return {'mean': 0.0, 'p50': 0.0, 'p99': 0.0}
+    ordered: list = sorted(samples)
+    return {'mean': statistics.mean(ordered) * 1e6,
+            'p50': ordered[len(ordered) // 2] * 1e6,
+            'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6}
+
+
+def transport(args) -> None:
+    """ Compare round trip latency of transport and parser options """
+    variants: list = [('tcp', {'hiredis': False}, False), ('tcp+blocked', {'hiredis': False}, True)]
+    if HIREDIS_AVAILABLE:
+        variants.append(('tcp+hiredis', {'hiredis': True}, False))
+    if args.unix_socket:
+        variants.append(('unix', {'unix_socket_path': args.unix_socket, 'hiredis': False}, False))
+        if HIREDIS_AVAILABLE:
+            variants.append(('unix+hiredis', {'unix_socket_path': args.unix_socket, 'hiredis': True}, False))
+
+    results: list = []
+    print("{:<14} {:>10} {:>10} {:>10}".format('transport', 'mean[us]', 'p50[us]', 'p99[us]'))
+    for name, options, blocked in variants:
+        options.update(host_ip=args.host, port_no=args.port)
+        stats: dict = summarize(ping_pong(options, args.rounds, args.payload, blocked))
+        results.append(dict(stats, transport=name))
+        print("{:<14} {:>10.1f} {:>10.1f} {:>10.1f}".format(name, stats['mean'], stats['p50'], stats['p99']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'python': platform.python_version(), 'time': time.time(),
+                       'results': results}, f, indent=2)
+
+
+def _join_leave(chan: lab_channel.Channel, n_cycles: int, barrier, results) -> None:
+    """
+    Member process of the join_leave scenario: join and leave the channel n_cycles times.
+    """
+    joins: list = []
+    leaves: list = []
+    barrier.wait()  # start all members at once
+    start: float = time.perf_counter()
+    for _ in range(n_cycles):
+        t0: float = time.perf_counter()
+        chan.bind(chan.join('bench'))
+        t1: float = time.perf_counter()
+        chan.leave('bench')
+        joins.append(t1 - t0)
+        leaves.append(time.perf_counter() - t1)
+    results.put({'elapsed': time.perf_counter() - start, 'count': 2 * n_cycles, 'latency': joins + leaves,
+                 'join': summarize(joins), 'leave': summarize(leaves)})
+
+
+def _member(options: dict, scenario: str, n_messages: int, payload: int, barrier, results,
+            log_mode: str = 'off') -> None:
+    """
+    Member process of a benchmark scenario.
+    Every member sends n_messages messages (from a separate thread) while receiving all messages addressed
+    to it. Messages carry their send time, so the receiver measures the latency of each message.
+    :param options: Channel constructor arguments
+    :param scenario: one of SCENARIOS
+    :param n_messages: number of messages sent per member (join/leave cycles for join_leave)
+    :param payload: message size in bytes
+    :param barrier: barrier of all member processes
+    :param results: queue receiving the measurements of the member
+    :param log_mode: logging configuration of the member process (see LOG_MODES)
+    """
+    if LOG_MODES[log_mode] is not None:
+        lab_logging.setup(stream_level=logging.ERROR, file_postfix='-bench', **LOG_MODES[log_mode])
+    chan = lab_channel.Channel(**options)
+    if scenario == 'join_leave':
+        _join_leave(chan, n_messages, barrier, results)
+        lab_logging.shutdown()
+        return
+
+    me: str = chan.join('bench')
+    chan.bind(me)
+    barrier.wait()  # wait for all members to join
+    members: list = sorted(chan.subgroup('bench'))
+    others: set = set(members) - {me}
+    if scenario == 'unicast':
+        # members form a ring, everybody sends to its successor
+        destinations: set = {members[(members.index(me) + 1) % len(members)]}
+        expected: int = n_messages
+    else:
+        destinations: set = others
+        expected: int = n_messages * len(others)
+    data: bytes = b'x' * payload
+
+    def send() -> None:
+        for _ in range(n_messages):
+            message: tuple = (time.time(), data)
+            if scenario == 'broadcast':
+                chan.send_to_all(message, exclude_self=True)
+            else:
+                chan.send_to(destinations, message)
+
+    sender = threading.Thread(target=send)
+    latency: list = []
+    barrier.wait()  # start all members at once
+    start: float = time.perf_counter()
+    sender.start()
+    while len(latency) < expected:
+        for _, (sent, _) in chan.receive_many(expected - len(latency)):
+            latency.append(time.time() - sent)
+    sender.join()
+    elapsed: float = time.perf_counter() - start
+    barrier.wait()  # keep all members until every message is received
+    chan.leave('bench')
+    results.put({'elapsed': elapsed, 'count': expected, 'latency': latency})
+    lab_logging.shutdown()  # write all queued log records
+
+
+def _flush(options: dict) -> None:
+    """
+    Remove all data from the main server and the queue shards of a channel.
+    :param options: Channel constructor arguments
+    """
+    lab_channel.Channel(**dict(options, shards=None)).channel.flushall()
+    for shard in options.get('shards') or []:
+        address: dict = {'unix_socket_path': shard} if isinstance(shard, str) \
+            else {'host_ip': shard[0], 'port_no': shard[1], 'unix_socket_path': None}
+        lab_channel.Channel(**dict(options, shards=None, **address)).channel.flushall()
+
+
+def run_scenario(options: dict, scenario: str, n_members: int, n_messages: int, payload: int,
+                 log_mode: str = 'off') -> dict:
+    """
+    Run one scenario with n_members member processes (logging as configured by log_mode, see LOG_MODES).
+    :return: dict with throughput (messages or join/leave operations per second) and latency statistics (us)
+    """
+    _flush(options)
+    barrier = mp.Barrier(n_members)
+    results = mp.Queue()
+    members: list = [mp.Process(target=_member, args=(options, scenario, n_messages, payload, barrier, results,
+                                                                   log_mode))
+                     for _ in range(n_members)]
+    for member in members:
+        member.start()
+    measurements: list = [results.get() for _ in members]
+    for member in members:
+        member.join()
+
+    latency: list = [value for m in measurements for value in m['latency']]
+    result: dict = {'scenario': scenario, 'members': n_members, 'payload': payload,
+                    'throughput': sum(m['count'] for m in measurements) / max(m['elapsed'] for m in measurements)}
+    result.update(summarize(latency))
+    if scenario == 'join_leave':
+        result['join'] = {key: statistics.mean(m['join'][key] for m in measurements) for key in ('p50', 'p99')}
+        result['leave'] = {key: statistics.mean(m['leave'][key] for m in measurements) for key in ('p50', 'p99')}
+    return result
+
+
+def compare(results: list, baseline: list, threshold: float) -> int:
+    """
+    Print the change of each result against the baseline.
+    A result regresses if its throughput drops or its p99 latency grows by more than threshold percent.
+    :param results: current results
+    :param baseline: baseline results
+    :param threshold: tolerated change in percent
+    :return: number of regressions
+    """
+    def change(new: float, old: float) -> float:
+        return (new - old) / old * 100 if old else 0.0
+
+    saved: dict = {(r['scenario'], r['members'], r['payload']): r for r in baseline}
+    regressions: int = 0
+    print("{:<11} {:>7} {:>8} {:>12} {:>10}".format('scenario', 'members', 'payload', 'throughput', 'p99'))
+    for result in results:
+        old = saved.get((result['scenario'], result['members'], result['payload']))
+        if old is None:
+            continue
+        throughput: float = change(result['throughput'], old['throughput'])
+        p99: float = change(result['p99'], old['p99'])
+        regressed: bool = throughput < -threshold or p99 > threshold
+        regressions += regressed
+        print("{:<11} {:>7} {:>8} {:>+11.1f}% {:>+9.1f}% {}".format(
+            result['scenario'], result['members'], result['payload'], throughput, p99,
+            'REGRESSION' if regressed else ''))
+    return regressions
+
+
+def suite(args) -> None:
+    """ Measure throughput and latency of all scenarios for all member counts and payload sizes """
+    options: dict = {'host_ip': args.host, 'port_no': args.port, 'unix_socket_path': args.unix_socket,
+                     'backend': args.backend, 'n_bits': 10}
+    broker = None
+    if args.backend == 'local':
+        broker = lab_broker.start(args.host, args.port, args.unix_socket)
+
+    results: list = []
+    print("{:<11} {:>7} {:>8} {:>12} {:>10} {:>10} {:>10}".format(
+        'scenario', 'members', 'payload', 'ops/s', 'mean[us]', 'p50[us]', 'p99[us]'))
+    try:
+        for scenario in args.scenarios.split(','):
+            assert scenario in SCENARIOS, 'unknown scenario'
+            for n_members in [int(k) for k in args.members.split(',')]:
+                # the payload size does not matter for join/leave
+                payloads: list = [0] if scenario == 'join_leave' else [int(p) for p in args.payloads.split(',')]
+                for payload in payloads:
+                    result: dict = run_scenario(options, scenario, n_members, args.messages, payload)
+                    results.append(result)
+                    print("{:<11} {:>7} {:>8} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                        scenario, n_members, payload, result['throughput'],
+                        result['mean'], result['p50'], result['p99']))
+    finally:
+        if broker is not None:
+            broker.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'python': platform.python_version(), 'time': time.time(),
+                       'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline: list = json.load(f)['results']
+        if compare(results, baseline, args.threshold) > 0:
+            sys.exit(1)
+
+
+def shards(args) -> None:
+    """ Measure unicast throughput for growing numbers of queue shards """
+    addresses: list = channel_top.parse_shards(args.shards)
+    assert len(addresses) > 0, 'no shards given'
+    # senders validate members on the main server, the membership cache saves that round trip (redis only)
+    options: dict = {'host_ip': args.host, 'port_no': args.port, 'unix_socket_path': args.unix_socket,
+                     'backend': args.backend, 'n_bits': 10, 'cache_members': args.backend == 'redis'}
+    brokers: list = []
+    if args.backend == 'local':
+        brokers.append(lab_broker.start(args.host, args.port, args.unix_socket))
+        for shard in addresses:
+            brokers.append(lab_broker.start(unix_socket_path=shard) if isinstance(shard, str)
+                           else lab_broker.start(shard[0], shard[1]))
+
+    print("{:>7} {:>7} {:>12} {:>8} {:>10} {:>10}".format(
+        'servers', 'members', 'ops/s', 'speedup', 'p50[us]', 'p99[us]'))
+    try:
+        for n_members in [int(k) for k in args.members.split(',')]:
+            single: float = 0.0
+            for n_shards in range(len(addresses) + 1):
+                options['shards'] = addresses[:n_shards]
+                result: dict = run_scenario(options, 'unicast', n_members, args.messages, args.payload)
+                single = single or result['throughput']
+                print("{:>7} {:>7} {:>12.0f} {:>7.2f}x {:>10.1f} {:>10.1f}".format(
+                    n_shards + 1, n_members, result['throughput'], result['throughput'] / single,
+                    result['p50'], result['p99']))
+    finally:
+        for broker in brokers:
+            broker.shutdown()
+
+
+def logging_modes(args) -> None:
+    """ Measure unicast throughput with DEBUG logging off, synchronous, asynchronous and sampled """
+    options: dict = {'host_ip': args.host, 'port_no': args.port, 'unix_socket_path': args.unix_socket,
+                     'backend': args.backend, 'n_bits': 10}
+    broker = None
+    if args.backend == 'local':
+        broker = lab_broker.start(args.host, args.port, args.unix_socket)
+
+    print("{:<8} {:>7} {:>12} {:>8} {:>10} {:>10}".format(
+        'logging', 'members', 'ops/s', 'vs sync', 'p50[us]', 'p99[us]'))
+    try:
+        for n_members in [int(k) for k in args.members.split(',')]:
+            results: dict = {mode: run_scenario(options, 'unicast', n_members, args.messages, args.payload, mode)
+                             for mode in LOG_MODES}
+            for mode, result in results.items():
+                print("{:<8} {:>7} {:>12.0f} {:>7.2f}x {:>10.1f} {:>10.1f}".format(
+                    mode, n_members, result['throughput'], result['throughput'] / results['sync']['throughput'],
+                    result['p50'], result['p99']))
+    finally:
+        if broker is not None:
+            broker.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='lab_channel benchmarks')
+    parser.add_argument('benchmark', choices=['transport', 'suite', 'shards', 'logging'])
+    parser.add_argument('--host', default='localhost', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port')
+    parser.add_argument('--unix-socket', help='redis unix socket path')
+    parser.add_argument('--rounds', type=int, default=2000, help='number of round trips (transport)')
+    parser.add_argument('--payload', type=int, default=64, help='message size in bytes (transport, shards, logging)')
+    parser.add_argument('--backend', default='redis', choices=['redis', 'local'],
+                        help='channel backend (suite, shards, logging)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenarios (suite)')
+    parser.add_argument('--members', default='2,4,8', help='comma separated member counts (suite, shards, logging)')
+    parser.add_argument('--payloads', default='64,1024,16384', help='comma separated message sizes (suite)')
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='messages (join/leave cycles) per member (suite, shards, logging)')
+    parser.add_argument('--output', help='save results as JSON (transport, suite)')
+    parser.add_argument('--compare', help='compare results with a saved JSON baseline (suite)')
+    parser.add_argument('--threshold', type=float, default=10.0, help='tolerated change in percent (suite)')
+    parser.add_argument('--shards', help='comma separated queue shards, host:port or unix socket path (shards)')
+    args = parser.parse_args()
+    {'transport': transport, 'suite': suite, 'shards': shards, 'logging': logging_modes}[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    mp.set_start_method('spawn')
+    main()
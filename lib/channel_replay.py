@@ -0,0 +1,179 @@
+"""
+Replay recorded channel traffic (see lab_channel.Channel, record, and lab_trace).
+
+Every member of the trace(s) joins the channel again (in its traced subgroup) and is hosted as a member
+endpoint in this process. Sends and broadcasts are re-driven in trace order, either in real time (--speed 1),
+at a scaled rate (--speed 10) or as fast as possible (--speed 0). Replayed messages carry their send time and
+a payload sized so that the serialized message (before compression) has the traced size, or is a few bytes
+smaller where the length encoding of the payload grows. Messages traced smaller than this envelope are
+replayed larger and reported as oversized. One thread per member receives as many messages as the member
+received in the trace.
+Reports throughput and end-to-end latency, so backends, queue modes and codecs can be compared on
+realistic traffic. Run from the repository root:
+
+    python -m lib.channel_replay TRACE [TRACE ...] [--speed X] [--backend redis|local] [--host H] [--port P]
+                                 [--unix-socket PATH] [--queue-mode pair|inbox|stream]
+                                 [--serializer pickle|msgpack] [--compress-threshold BYTES]
+                                 [--timeout S] [--flush] [--output FILE]
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from lib import lab_broker, lab_channel, lab_serializer, lab_trace
+from lib.channel_bench import summarize
+
+# serializers able to encode replay messages (send time, payload)
+SERIALIZERS = {'pickle': lab_serializer.PickleSerializer, 'msgpack': lab_serializer.MsgpackSerializer}
+
+
+def _receive(member: lab_channel.Member, expected: int, timeout: float, done: threading.Event,
+             latency: list) -> None:
+    """
+    Receive the expected number of messages (or until no message arrives for timeout seconds after
+    all messages are sent). Messages carry their send time, so the latency of each message is measured.
+    """
+    received: int = 0
+    while received < expected:
+        messages: list = member.receive_many(expected - received, timeout)
+        if len(messages) == 0 and done.is_set():
+            break
+        received += len(messages)
+        now: float = time.time()
+        latency.extend(now - sent for _, (sent, _) in messages)
+
+
+def payload_size(codec: lab_serializer.Codec, size: int) -> int:
+    """
+    Find the payload size whose replay message serializes to the given size (ignoring compression).
+    :param codec: codec of the replay channel
+    :param size: traced serialized size in bytes
+    :return: payload size in bytes (0 if the envelope alone is larger)
+    """
+    # same serialization, without compression
+    codec = lab_serializer.Codec(codec.serializer, timestamps=codec.timestamps, allow_pickle=codec.allow_pickle)
+    n: int = max(0, size - len(codec.dumps((0.0, b''))))
+    # the length encoding of the payload grows with its size
+    n = max(0, n - (len(codec.dumps((0.0, b'x' * n))) - size))
+    while n > 0 and len(codec.dumps((0.0, b'x' * n))) > size:
+        n -= 1
+    return n
+
+
+def replay(chan: lab_channel.Channel, records: list, speed: float, timeout: float) -> dict:
+    """
+    Re-drive the sends and broadcasts of a trace on a channel.
+    :param chan: channel to replay on
+    :param records: trace records ordered by time
+    :param speed: replay rate relative to the trace (0: as fast as possible)
+    :param timeout: time to wait for outstanding messages at the end
+    :return: dict with message counts (oversized: messages larger than traced), elapsed time,
+    throughput and latency statistics (us)
+    """
+    # join all traced members in their subgroups
+    subgroups: dict = {}
+    expected: dict = {}
+    for record in records:
+        if record.kind == lab_trace.JOIN:
+            subgroups.setdefault(record.sender, record.targets[0])
+        elif record.kind == lab_trace.RECEIVE:
+            expected[record.targets[0]] = expected.get(record.targets[0], 0) + 1
+        # members joined before the recording started
+        ids: list = record.targets if record.kind in (lab_trace.SEND, lab_trace.RECEIVE) else []
+        for pid in [record.sender] + ids:
+            subgroups.setdefault(pid, 'replay')
+    members: dict = {pid: chan.member(chan.join(subgroup)) for pid, subgroup in subgroups.items()}
+
+    latency: list = []
+    done = threading.Event()
+    receivers: list = [threading.Thread(target=_receive, args=(members[pid], n, timeout, done, latency))
+                       for pid, n in expected.items()]
+    for receiver in receivers:
+        receiver.start()
+
+    sent: int = 0
+    oversized: int = 0
+    payloads: dict = {}  # traced size -> payload size (see payload_size)
+    traffic: list = [record for record in records if record.kind in (lab_trace.SEND, lab_trace.BROADCAST)]
+    start: float = time.perf_counter()
+    for record in traffic:
+        if speed > 0:
+            delay: float = start + (record.time - traffic[0].time) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        member: lab_channel.Member = members[record.sender]
+        if record.size not in payloads:
+            payloads[record.size] = payload_size(chan.codec, record.size)
+        if payloads[record.size] == 0 and len(chan.codec.dumps((0.0, b''))) > record.size:
+            oversized += 1
+        message: tuple = (time.time(), b'x' * payloads[record.size])
+        if record.kind == lab_trace.SEND:
+            member.send_to({members[pid].pid for pid in record.targets}, message)
+        else:
+            member.send_to_all(message, subgroup=record.targets[0] if record.targets else None,
+                               exclude_self=bool(record.flags & lab_trace.EXCLUDE_SELF))
+        sent += 1
+    done.set()
+    for receiver in receivers:
+        receiver.join()
+    elapsed: float = time.perf_counter() - start
+
+    for pid, member in members.items():
+        member.leave(subgroups[pid])
+    result: dict = {'records': len(records), 'sent': sent, 'oversized': oversized, 'received': len(latency),
+                    'expected': sum(expected.values()), 'elapsed': elapsed,
+                    'throughput': len(latency) / elapsed if elapsed > 0 else 0.0}
+    result.update(summarize(latency))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='replay recorded lab_channel traffic')
+    parser.add_argument('traces', nargs='+', help='trace files (merged by time)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay rate (1: real time, 0: max speed)')
+    parser.add_argument('--host', default='localhost', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port')
+    parser.add_argument('--unix-socket', help='redis unix socket path')
+    parser.add_argument('--backend', default='redis', choices=['redis', 'local'], help='channel backend')
+    parser.add_argument('--queue-mode', default='pair', choices=['pair', 'inbox', 'stream'], help='queue mode')
+    parser.add_argument('--serializer', default='pickle', choices=sorted(SERIALIZERS), help='message serializer')
+    parser.add_argument('--compress-threshold', type=int, help='compress messages larger than this (bytes)')
+    parser.add_argument('--timeout', type=float, default=5.0, help='wait for outstanding messages (seconds)')
+    parser.add_argument('--flush', action='store_true', help='remove all channel data before replaying')
+    parser.add_argument('--output', help='save the result as JSON')
+    args = parser.parse_args()
+
+    records: list = lab_trace.read_traces(args.traces)
+    broker = None
+    if args.backend == 'local':
+        broker = lab_broker.start(args.host, args.port, args.unix_socket)
+    try:
+        chan = lab_channel.Channel(n_bits=16, host_ip=args.host, port_no=args.port,
+                                   unix_socket_path=args.unix_socket, backend=args.backend,
+                                   queue_mode=args.queue_mode, serializer=SERIALIZERS[args.serializer](),
+                                   compress_threshold=args.compress_threshold)
+        if args.flush:
+            chan.channel.flushall()
+        result: dict = replay(chan, records, args.speed, args.timeout)
+        chan.close()
+    finally:
+        if broker is not None:
+            broker.shutdown()
+
+    print("{:>8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        'sent', 'received', 'expected', 'elapsed[s]', 'msgs/s', 'p50[us]', 'p99[us]'))
+    print("{:>8} {:>8} {:>8} {:>10.2f} {:>10.0f} {:>10.1f} {:>10.1f}".format(
+        result['sent'], result['received'], result['expected'], result['elapsed'], result['throughput'],
+        result['p50'], result['p99']))
+    if result['oversized']:
+        print("{} messages were traced smaller than the replay envelope and replayed larger".format(
+            result['oversized']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'result': result}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+channel-top: watch the depth of all channel queues.
+
+Reads all queue keys registered in the global queue registry ("xchan") and their lengths in one pipelined
+round trip (per queue shard, see lab_channel.Channel.queue_depths), and prints the deepest queues,
+refreshed every interval seconds.
+Run from the repository root:
+
+    python -m lib.channel_top [--host H] [--port P] [--unix-socket PATH] [--shards H:P,PATH,...]
+                              [--interval S] [--limit N] [--once]
+"""
+
+import argparse
+import sys
+import time
+
+from lib import lab_channel
+
+
+def parse_shards(text: str) -> list:
+    """
+    Parse a comma separated list of shard addresses.
+    :param text: addresses (host:port or unix socket path)
+    :return: list of (host, port) tuples or unix socket paths (see lab_channel.Channel)
+    """
+    shards: list = []
+    for address in filter(None, (text or '').split(',')):
+        host, sep, port = address.rpartition(':')
+        shards.append((host, int(port)) if sep else address)
+    return shards
+
+
+def render(queues: list, limit: int) -> str:
+    """
+    Format queue depths as a table.
+    :param queues: list of ((sender, receiver), depth) tuples
+    :param limit: maximum number of rows
+    :return: table text
+    """
+    lines: list = ["{}  queues: {}  messages: {}".format(
+        time.strftime('%H:%M:%S'), len(queues), sum(depth for _, depth in queues)),
+        "{:>10} {:>10} {:>10}".format('SENDER', 'RECEIVER', 'DEPTH')]
+    for (sender, receiver), depth in queues[:limit]:
+        lines.append("{:>10} {:>10} {:>10}".format(sender or '*', receiver, depth))
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='watch lab_channel queue depths')
+    parser.add_argument('--host', default='localhost', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port')
+    parser.add_argument('--unix-socket', help='redis unix socket path')
+    parser.add_argument('--shards', help='comma separated queue shards (host:port or unix socket path)')
+    parser.add_argument('--backend', default='redis', choices=['redis', 'local'], help='channel backend')
+    parser.add_argument('--interval', type=float, default=1.0, help='refresh interval in seconds')
+    parser.add_argument('--limit', type=int, default=20, help='number of queues shown')
+    parser.add_argument('--once', action='store_true', help='print once and exit')
+    args = parser.parse_args()
+
+    chan = lab_channel.Channel(host_ip=args.host, port_no=args.port, unix_socket_path=args.unix_socket,
+                               backend=args.backend, shards=parse_shards(args.shards))
+    try:
+        while True:
+            table: str = render(chan.queue_depths(), args.limit)
+            if args.once:
+                print(table)
+                break
+            if sys.stdout.isatty():
+                sys.stdout.write('\033[H\033[J')  # clear screen
+            print(table, flush=True)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        chan.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+"""
+Local stand-in for the redis server used by lab_channel.
+
+The broker keeps all channel data (member sets, queues) in the memory of a separate broker process
+started with multiprocessing. Channel members connect to it via a multiprocessing manager (TCP address
+or unix socket path). The broker implements the subset of redis commands and the server-side scripts
+used by lab_channel.Channel with identical semantics, so a channel can be used without a redis server:
+
+    broker = lab_broker.start(port_no=6380)  # in the main process, keep the reference
+    chan = lab_channel.Channel(backend='local', port_no=6380)  # in every member process
+    ...
+    broker.shutdown()
+
+Pub/sub is not supported (i.e. Channel membership caches require redis): clients have no pubsub method
+and published messages reach no subscriber.
+"""
+
+import collections
+import fnmatch
+import heapq
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+AUTHKEY = b'vs2lab'
+
+
+def _encode(value) -> bytes:
+    # same encoding rules as the redis client
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
+
+
+def _key(key) -> str:
+    return key.decode() if isinstance(key, bytes) else str(key)
+
+
+class Broker:
+    """
+    In-memory data store of the broker process.
+    All commands of one execute call are applied atomically. Every blocking pop waits on a condition
+    of its own, registered with the keys it watches; pushes only wake the waiters of the pushed keys.
+    Keys with a time to live are removed lazily, before the next command is applied
+    (deadlines are kept in a heap, so only keys that are due are visited).
+    """
+
+    COMMANDS = ('sadd', 'srem', 'smembers', 'sismember', 'smismember', 'scard',
+                'rpush', 'lpush', 'lpop', 'llen', 'lrange', 'ltrim',
+                'delete', 'unlink', 'exists', 'keys', 'scan', 'pexpire', 'memory_usage', 'flushall', 'publish')
+
+    def __init__(self):
+        self.data: dict = {}
+        self.expires: dict = {}  # key -> deadline (time.time)
+        self.deadlines: list = []  # heap of (deadline, key), entries not matching expires are stale
+        self.lock = threading.Lock()
+        self.waiters: dict = {}  # key -> set of conditions of blocked pops watching the key
+        self.pushed: set = set()  # keys pushed to by the current command batch
+
+    def __expire(self) -> None:
+        # remove all keys whose time to live has passed
+        now: float = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self.deadlines)
+            if self.expires.get(key) == deadline:
+                del self.expires[key]
+                self.data.pop(key, None)
+
+    def __wake(self) -> None:
+        # wake the blocked pops watching keys that were pushed to
+        for key in self.pushed:
+            for waiter in self.waiters.get(key, ()):
+                waiter.notify()
+        self.pushed.clear()
+
+    def execute(self, commands: list) -> list:
+        """
+        Atomically apply a list of (command name, args) tuples.
+        :param commands: list of commands
+        :return: list of results
+        """
+        with self.lock:
+            self.__expire()
+            results: list = [getattr(self, '_cmd_' + name)(*args) for name, args in commands]
+            self.__wake()
+            return results
+
+    def script(self, name: str, keys: list, args: list):
+        """
+        Run one of the lab_channel server-side scripts (see _JOIN_LUA etc. in lab_channel).
+        :param name: script name
+        :param keys: key arguments
+        :param args: other arguments
+        :return: script result (same shape as returned by redis)
+        """
+        with self.lock:
+            self.__expire()
+            result = getattr(self, '_script_' + name)([_key(k) for k in keys], [_encode(a) for a in args])
+            self.__wake()
+            return result
+
+    def blpop(self, keys: list, timeout: float):
+        """
+        Pop the first element of the first non-empty list, blocking until one is available.
+        :param keys: list keys
+        :param timeout: timeout in seconds (0 blocks forever)
+        :return: tuple of key and element or None on timeout
+        """
+        keys = [_key(k) for k in keys]
+        deadline: float = time.time() + timeout
+        waiter = None
+        with self.lock:
+            try:
+                while True:
+                    self.__expire()
+                    for key in keys:
+                        queue = self.data.get(key)
+                        if queue:
+                            element: bytes = queue.popleft()
+                            if not queue:
+                                del self.data[key]
+                            return key.encode(), element
+                    if waiter is None:
+                        # register once, pushes to any of the keys wake this pop only
+                        waiter = threading.Condition(self.lock)
+                        for key in keys:
+                            self.waiters.setdefault(key, set()).add(waiter)
+                    if not timeout:
+                        waiter.wait()
+                    else:
+                        remaining: float = deadline - time.time()
+                        if remaining <= 0:
+                            return None
+                        waiter.wait(remaining)
+            finally:
+                if waiter is not None:
+                    for key in keys:
+                        self.waiters[key].discard(waiter)
+                        if not self.waiters[key]:
+                            del self.waiters[key]
+
+    def __set(self, key) -> set:
+        return self.data.get(_key(key), set())
+
+    def __list(self, key) -> collections.deque:
+        return self.data.get(_key(key), collections.deque())
+
+    def __store(self, key, value) -> None:
+        # like redis, empty collections are removed
+        if value:
+            self.data[_key(key)] = value
+        else:
+            self.data.pop(_key(key), None)
+            self.expires.pop(_key(key), None)
+
+    # set commands
+
+    def _cmd_sadd(self, key, *values) -> int:
+        members: set = self.__set(key)
+        size: int = len(members)
+        members.update(_encode(v) for v in values)
+        self.__store(key, members)
+        return len(members) - size
+
+    def _cmd_srem(self, key, *values) -> int:
+        members: set = self.__set(key)
+        size: int = len(members)
+        members.difference_update(_encode(v) for v in values)
+        self.__store(key, members)
+        return size - len(members)
+
+    def _cmd_smembers(self, key) -> set:
+        return set(self.__set(key))
+
+    def _cmd_sismember(self, key, value) -> bool:
+        return _encode(value) in self.__set(key)
+
+    def _cmd_smismember(self, key, values) -> list:
+        members: set = self.__set(key)
+        return [int(_encode(v) in members) for v in values]
+
+    def _cmd_scard(self, key) -> int:
+        return len(self.__set(key))
+
+    # list commands
+
+    def _cmd_rpush(self, key, *values) -> int:
+        queue: collections.deque = self.__list(key)
+        queue.extend(_encode(v) for v in values)
+        self.__store(key, queue)
+        self.pushed.add(_key(key))
+        return len(queue)
+
+    def _cmd_lpush(self, key, *values) -> int:
+        queue: collections.deque = self.__list(key)
+        queue.extendleft(_encode(v) for v in values)
+        self.__store(key, queue)
+        self.pushed.add(_key(key))
+        return len(queue)
+
+    def _cmd_lpop(self, key, count=None):
+        queue: collections.deque = self.__list(key)
+        if count is None:
+            element = queue.popleft() if queue else None
+        else:
+            element = [queue.popleft() for _ in range(min(count, len(queue)))] or None
+        self.__store(key, queue)
+        return element
+
+    def _cmd_llen(self, key) -> int:
+        return len(self.__list(key))
+
+    def _cmd_lrange(self, key, start: int, end: int) -> list:
+        elements: list = list(self.__list(key))
+        return elements[start:] if end == -1 else elements[start:end + 1]
+
+    def _cmd_ltrim(self, key, start: int, end: int) -> bool:
+        elements: list = self._cmd_lrange(key, start, end)
+        self.__store(key, collections.deque(elements))
+        return True
+
+    # generic commands
+
+    def _cmd_delete(self, *keys) -> int:
+        for k in keys:
+            self.expires.pop(_key(k), None)
+        return sum(self.data.pop(_key(k), None) is not None for k in keys)
+
+    def _cmd_unlink(self, *keys) -> int:
+        return self._cmd_delete(*keys)
+
+    def _cmd_exists(self, *keys) -> int:
+        return sum(_key(k) in self.data for k in keys)
+
+    def _cmd_keys(self, pattern='*') -> list:
+        return [k.encode() for k in self.data if fnmatch.fnmatchcase(k, _key(pattern))]
+
+    def _cmd_scan(self, cursor=0, match='*', count=None) -> tuple:
+        # up to count (default 10) matching keys per call. Keys are visited in the order of their utf-8
+        # encoding read as a big-endian number and the cursor is the number of the last key returned, so
+        # (unlike with positions) keys present during the whole iteration are returned exactly once, even
+        # if other keys are removed meanwhile. Cursor 0 starts and ends the iteration (keys must not start with
+        # a zero byte).
+        cursor, count = int(cursor), int(count or 10)
+        numbers = (int.from_bytes(key, 'big') for key in self._cmd_keys(match or '*'))
+        found: list = heapq.nsmallest(count, (number for number in numbers if number > cursor))
+        keys: list = [number.to_bytes((number.bit_length() + 7) // 8, 'big') for number in found]
+        return (found[-1] if len(found) == count else 0), keys
+
+    def _cmd_pexpire(self, key, milliseconds: int) -> bool:
+        if _key(key) not in self.data:
+            return False
+        deadline: float = time.time() + int(milliseconds) / 1000
+        self.expires[_key(key)] = deadline
+        heapq.heappush(self.deadlines, (deadline, _key(key)))
+        return True
+
+    def _cmd_memory_usage(self, key):
+        # payload size estimate (redis reports allocated bytes including overhead)
+        value = self.data.get(_key(key))
+        if value is None:
+            return None
+        return len(_encode(key)) + sum(len(element) for element in value)
+
+    def _cmd_flushall(self) -> bool:
+        self.data.clear()
+        self.expires.clear()
+        self.deadlines.clear()
+        return True
+
+    def _cmd_publish(self, channel, message) -> int:
+        return 0  # no subscribers (pub/sub is not supported)
+
+    # lab_channel scripts (same semantics as the lua versions)
+
+    def _script_join(self, keys: list, args: list):
+        if self._cmd_scard(keys[0]) >= int(args[0]):
+            return -1
+        for candidate in args[2:]:  # (args[1] is the stream key prefix, streams are not supported)
+            if not self._cmd_sismember(keys[0], candidate):
+                members: list = list(self.__set(keys[0]))
+                self._cmd_sadd(keys[0], candidate)
+                self._cmd_sadd(keys[1], candidate)
+                return [candidate, members]
+        return None
+
+    def __overflow(self, keys: list, capacity: int, policy: bytes) -> int:
+        # index of the first queue the keys (repetitions count) do not fit in (see _QUEUE_LUA) or 0
+        if capacity == 0 or policy != b'reject':
+            return 0
+        added: dict = {}
+        for i, key in enumerate(keys, 1):
+            added[key] = added.get(key, 0) + 1
+            if self._cmd_llen(key) + added[key] > capacity:
+                return i
+        return 0
+
+    def __push(self, key, element: bytes, capacity: int, policy: bytes, ttl: int) -> None:
+        self._cmd_rpush(key, element)
+        if capacity > 0 and policy == b'drop_oldest':
+            self._cmd_ltrim(key, -capacity, -1)
+        if ttl > 0:
+            self._cmd_pexpire(key, ttl)
+
+    def _script_send(self, keys: list, args: list) -> int:
+        sender, capacity, policy, ttl = args[0], int(args[2]), args[3], int(args[4])
+        n: int = len(keys) - 1
+        if keys[0]:
+            if not self._cmd_sismember(keys[0], sender):
+                return -1
+            for i in range(1, n + 1):
+                if not self._cmd_sismember(keys[0], args[i + 4]):
+                    return i
+        full: int = self.__overflow(keys[1:], capacity, policy)
+        if full > 0:
+            return -1 - full
+        for i in range(1, n + 1):
+            self.__push(keys[i], args[n + i + 4], capacity, policy, ttl)
+        return 0
+
+    def _script_broadcast(self, keys: list, args: list) -> int:
+        sender, mode, exclude_self, data, capacity, policy, ttl = args
+        capacity, ttl = int(capacity), int(ttl)
+        if not self._cmd_sismember(keys[0], sender):
+            return -1
+        receivers: set = self.__set(keys[0]) & self.__set(keys[1])
+        queues: list = []
+        for receiver in receivers:
+            if exclude_self == b'1' and receiver == sender:
+                continue
+            if mode == b'inbox':
+                queues.append(('inbox:' + receiver.decode(), sender + b' ' + data))
+            else:
+                queues.append((str([sender.decode(), receiver.decode()]), data))
+        if self.__overflow([key for key, _ in queues], capacity, policy) > 0:
+            return -2
+        for key, element in queues:
+            self.__push(key, element, capacity, policy, ttl)
+        return len(queues)
+
+    def _script_drain(self, keys: list, args: list) -> list:
+        n: int = int(args[0])
+        result: list = []
+        for i, key in enumerate(keys, 1):
+            if n <= 0:
+                break
+            items: list = self._cmd_lrange(key, 0, n - 1)
+            if items:
+                self._cmd_ltrim(key, len(items), -1)
+                for item in items:
+                    result += [i, item]
+                n -= len(items)
+        return result
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+class LocalRedis:
+    """
+    Client of a broker with the redis client methods used by lab_channel.
+    Commands that are not blocking are forwarded as batches of one (see LocalPipeline).
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def __getattr__(self, name: str):
+        if name not in Broker.COMMANDS:
+            raise AttributeError(name)
+        return lambda *args: self.broker.execute([(name, args)])[0]
+
+    def blpop(self, keys, timeout: float = 0):
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        return self.broker.blpop(list(keys), timeout)
+
+    def pipeline(self, transaction: bool = True):
+        return LocalPipeline(self.broker)
+
+    def script(self, name: str):
+        """
+        Lookup a server-side script of lab_channel by name (instead of redis register_script).
+        :param name: script name
+        :return: callable taking keys and args
+        """
+        return lambda keys=(), args=(): self.broker.script(name, list(keys), list(args))
+
+
+class LocalPipeline:
+    """
+    Collects commands and applies them atomically in one call to the broker.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.commands: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        if name not in Broker.COMMANDS:
+            raise AttributeError(name)
+
+        def command(*args):
+            self.commands.append((name, args))
+            return self
+        return command
+
+    def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        return self.broker.execute(commands)
+
+
+_broker = None
+
+
+def _get_broker() -> Broker:
+    global _broker
+    if _broker is None:
+        _broker = Broker()
+    return _broker
+
+
+BrokerManager.register('broker', callable=_get_broker)
+
+
+def _address(host_ip: str, port_no: int, unix_socket_path: str = None):
+    return unix_socket_path if unix_socket_path else (host_ip, port_no)
+
+
+def start(host_ip: str = 'localhost', port_no: int = 6379, unix_socket_path: str = None) -> BrokerManager:
+    """
+    Start a broker process. The caller has to keep the returned manager alive (and shut it down).
+    :param host_ip: address to listen on
+    :param port_no: port to listen on
+    :param unix_socket_path: optional unix socket path to listen on instead of TCP
+    :return: manager controlling the broker process
+    """
+    manager = BrokerManager(address=_address(host_ip, port_no, unix_socket_path), authkey=AUTHKEY)
+    manager.start()
+    return manager
+
+
+def connect(host_ip: str = 'localhost', port_no: int = 6379, unix_socket_path: str = None) -> LocalRedis:
+    """
+    Connect to a running broker.
+    :param host_ip: broker address
+    :param port_no: broker port
+    :param unix_socket_path: optional unix socket path of the broker
+    :return: redis-like client
+    """
+    manager = BrokerManager(address=_address(host_ip, port_no, unix_socket_path), authkey=AUTHKEY)
+    manager.connect()
+    return LocalRedis(manager.broker())
@@ -1,9 +1,318 @@
+import contextlib
+import contextvars
 import logging
 import os
-import pickle
 import random
+import threading
+import time
+import zlib
 
 import redis
+import redis.asyncio
+
+from . import lab_broker, lab_trace
+from .lab_metrics import ChannelMetrics
+from .lab_serializer import Codec, Serializer
+
+# Claim the first unused id out of a list of random candidates and add it to the member and subgroup sets.
+# With a stream key prefix given, a stale stream of a former member with the new id is deleted before the id
+# becomes visible, so no message sent to the new member is deleted with it (stream queue mode, unsharded).
+#   KEYS[1]: global member set, KEYS[2]: subgroup set
+#   ARGV[1]: size of the id space, ARGV[2]: stream key prefix or '', ARGV[3..]: candidate ids
+# Returns {new id, other members}, nil if all candidates are taken or -1 if the id space is exhausted.
+_JOIN_LUA = """
+if redis.call('SCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return -1
+end
+for i = 3, #ARGV do
+    if redis.call('SISMEMBER', KEYS[1], ARGV[i]) == 0 then
+        local members = redis.call('SMEMBERS', KEYS[1])
+        if ARGV[2] ~= '' then
+            redis.call('DEL', ARGV[2] .. ARGV[i])
+        end
+        redis.call('SADD', KEYS[1], ARGV[i])
+        redis.call('SADD', KEYS[2], ARGV[i])
+        redis.call('PUBLISH', 'membership', KEYS[2])
+        return {ARGV[i], members}
+    end
+end
+return false
+"""
+
+# Queue helpers shared by the send scripts. Queues are lists or, in queue_mode 'stream', streams with
+# entries {s: <sender>, m: <message>}. A queue capacity of 0 means unbounded. On overflow, queues either
+# reject (the script reports the full queue before pushing anything) or drop their oldest messages.
+# With a ttl (in milliseconds, 0: none), lists expire ttl after the last push and stream entries
+# older than ttl are trimmed (stream entry ids start with their creation time).
+_QUEUE_LUA = """
+local function depth(mode, key)
+    if mode == 'stream' then
+        return redis.call('XLEN', key)
+    end
+    return redis.call('LLEN', key)
+end
+
+local function push(mode, key, sender, element, capacity, policy, ttl)
+    local trim = capacity > 0 and policy == 'drop_oldest'
+    if mode == 'stream' then
+        if trim then
+            redis.call('XADD', key, 'MAXLEN', capacity, '*', 's', sender, 'm', element)
+        else
+            redis.call('XADD', key, '*', 's', sender, 'm', element)
+        end
+        if ttl > 0 then
+            local now = redis.call('TIME')
+            redis.call('XTRIM', key, 'MINID', string.format('%d', now[1] * 1000 + math.floor(now[2] / 1000) - ttl))
+        end
+    else
+        redis.call('RPUSH', key, element)
+        if trim then
+            redis.call('LTRIM', key, -capacity, -1)
+        end
+        if ttl > 0 then
+            redis.call('PEXPIRE', key, ttl)
+        end
+    end
+end
+
+-- check if pushing the given keys (repetitions count) exceeds the capacity, return the index of the first full one
+local function overflow(mode, keys, capacity, policy)
+    if capacity == 0 or policy ~= 'reject' then
+        return 0
+    end
+    local added = {}
+    for i, key in ipairs(keys) do
+        added[key] = (added[key] or 0) + 1
+        if depth(mode, key) + added[key] > capacity then
+            return i
+        end
+    end
+    return 0
+end
+"""
+
+# Validate sender and all receivers against the member set, check queue capacities, then push one
+# message per queue. All checks happen before the first push, so a multicast is delivered to all
+# receivers or to none. On queue shards (see Channel), members are validated by the caller beforehand.
+#   KEYS[1]: global member set ('' to skip validation), KEYS[2..n+1]: queue keys
+#   ARGV[1]: sender id, ARGV[2]: queue mode, ARGV[3]: queue capacity, ARGV[4]: overflow policy,
+#   ARGV[5]: queue ttl, ARGV[6..n+5]: receiver ids, ARGV[n+6..2n+5]: serialized messages (inbox envelopes)
+# Returns 0 on success, -1 for an unknown sender, the (1-based) index of the first unknown receiver
+# or -1 - index of the first receiver with a full queue.
+_SEND_LUA = _QUEUE_LUA + """
+local sender, mode, capacity, policy, ttl = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4], tonumber(ARGV[5])
+local n = #KEYS - 1
+if KEYS[1] ~= '' then
+    if redis.call('SISMEMBER', KEYS[1], sender) == 0 then
+        return -1
+    end
+    for i = 1, n do
+        if redis.call('SISMEMBER', KEYS[1], ARGV[i + 5]) == 0 then
+            return i
+        end
+    end
+end
+local keys = {unpack(KEYS, 2)}
+local full = overflow(mode, keys, capacity, policy)
+if full > 0 then
+    return -1 - full
+end
+for i = 1, n do
+    push(mode, keys[i], sender, ARGV[n + i + 5], capacity, policy, ttl)
+end
+return 0
+"""
+
+# Broadcast one serialized message to all members (or all members of a subgroup) on the server side.
+# Queue keys are derived from the member ids in the script (see _queue_key, _inbox_key and _stream_key),
+# so the message is sent once and the receivers never travel to the client.
+#   KEYS[1]: global member set, KEYS[2]: subgroup set (or the global member set again)
+#   ARGV[1]: sender id, ARGV[2]: queue mode, ARGV[3]: '1' to exclude the sender, ARGV[4]: serialized message,
+#   ARGV[5]: queue capacity, ARGV[6]: overflow policy, ARGV[7]: queue ttl
+# Returns the number of receivers, -1 for an unknown sender or -2 if a receiver queue is full.
+_BROADCAST_LUA = _QUEUE_LUA + """
+local sender, mode, message = ARGV[1], ARGV[2], ARGV[4]
+local capacity, policy, ttl = tonumber(ARGV[5]), ARGV[6], tonumber(ARGV[7])
+if redis.call('SISMEMBER', KEYS[1], sender) == 0 then
+    return -1
+end
+local receivers
+if KEYS[1] == KEYS[2] then
+    receivers = redis.call('SMEMBERS', KEYS[1])
+else
+    receivers = redis.call('SINTER', KEYS[1], KEYS[2])
+end
+local keys = {}
+local element = message
+if mode == 'inbox' then
+    element = sender .. ' ' .. message
+end
+for _, receiver in ipairs(receivers) do
+    if ARGV[3] ~= '1' or receiver ~= sender then
+        if mode == 'inbox' then
+            keys[#keys + 1] = 'inbox:' .. receiver
+        elseif mode == 'stream' then
+            keys[#keys + 1] = 'stream:' .. receiver
+        else
+            keys[#keys + 1] = "['" .. sender .. "', '" .. receiver .. "']"
+        end
+    end
+end
+if overflow(mode, keys, capacity, policy) > 0 then
+    return -2
+end
+for _, key in ipairs(keys) do
+    push(mode, key, sender, element, capacity, policy, ttl)
+end
+return #keys
+"""
+
+# Pop up to ARGV[1] messages off the given queues, taking as many as possible from each queue in turn.
+#   KEYS: queue keys
+#   ARGV[1]: maximum number of messages
+# Returns a flat list of (1-based) key index and message pairs.
+_DRAIN_LUA = """
+local n = tonumber(ARGV[1])
+local result = {}
+for i = 1, #KEYS do
+    if n <= 0 then
+        break
+    end
+    local items = redis.call('LRANGE', KEYS[i], 0, n - 1)
+    if #items > 0 then
+        redis.call('LTRIM', KEYS[i], #items, -1)
+        for _, item in ipairs(items) do
+            result[#result + 1] = i
+            result[#result + 1] = item
+        end
+        n = n - #items
+    end
+end
+return result
+"""
+
+
+# Consumer group of the member streams (queue_mode 'stream')
+_STREAM_GROUP = 'vs2lab'
+
+# Process-wide connection pools shared by all channels: (address, parser, blocking) -> pool
+_pools: dict = {}
+_pools_lock = threading.Lock()
+
+
+def _parser_class(hiredis: bool):
+    """
+    Select the redis protocol parser.
+    :param hiredis: True for the hiredis (C) parser, False for the pure python parser
+    :return: parser class
+    """
+    try:
+        from redis._parsers import _HiredisParser as HiredisParser, _RESP2Parser as PythonParser
+    except ImportError:  # redis-py < 5
+        from redis.connection import HiredisParser, PythonParser
+    if not hiredis:
+        return PythonParser
+    from redis.utils import HIREDIS_AVAILABLE
+    if not HIREDIS_AVAILABLE:
+        raise ImportError('hiredis parsing requires the hiredis package')
+    return HiredisParser
+
+
+def _connection_pool(host_ip: str, port_no: int, unix_socket_path: str, hiredis: bool,
+                     blocking: bool) -> redis.ConnectionPool:
+    """
+    Get the shared connection pool for a redis server, creating it on first use.
+    Separate pools are kept for blocking receive operations and for all other commands.
+    :param host_ip: redis host (TCP)
+    :param port_no: redis port (TCP)
+    :param unix_socket_path: redis unix socket path (used instead of TCP if given)
+    :param hiredis: parser selection (None for the redis-py default, see _parser_class)
+    :param blocking: whether the pool is used for blocking operations
+    :return: connection pool
+    """
+    key: tuple = (host_ip, port_no, unix_socket_path, hiredis, blocking)
+    with _pools_lock:
+        if key not in _pools:
+            # no socket timeout, blocking operations may wait forever
+            kwargs: dict = {'db': 0, 'socket_timeout': None}
+            if hiredis is not None:
+                kwargs['parser_class'] = _parser_class(hiredis)
+            if unix_socket_path:
+                _pools[key] = redis.ConnectionPool(connection_class=redis.UnixDomainSocketConnection,
+                                                   path=unix_socket_path, **kwargs)
+            else:
+                _pools[key] = redis.ConnectionPool(host=host_ip, port=port_no, **kwargs)
+        return _pools[key]
+
+
+def _queue_key(sender: str, receiver: str) -> str:
+    """
+    Construct queue name from sender and receiver ids.
+    :param sender: member identifier
+    :param receiver: member identifier
+    :return: redis key
+    """
+    return str([sender, receiver])
+
+
+def _inbox_key(receiver: str) -> str:
+    """
+    Construct inbox name from receiver id.
+    :param receiver: member identifier
+    :return: redis key
+    """
+    return 'inbox:' + receiver
+
+
+def _stream_key(receiver: str) -> str:
+    """
+    Construct stream name from receiver id.
+    :param receiver: member identifier
+    :return: redis key
+    """
+    return 'stream:' + receiver
+
+
+def _shard_index(receiver: str, n_shards: int) -> int:
+    """
+    Map a receiver to the shard holding its incoming queues.
+    :param receiver: member identifier
+    :param n_shards: number of queue shards
+    :return: shard index
+    """
+    return zlib.crc32(receiver.encode()) % n_shards
+
+
+def _parse_queue_key(key: str) -> tuple:
+    """
+    Extract sender and receiver ids from a queue name.
+    :param key: redis key
+    :return: tuple of sender and receiver identifiers (sender is None for inboxes and streams)
+    """
+    for prefix in ('inbox:', 'stream:'):
+        if key.startswith(prefix):
+            return None, key[len(prefix):]
+    parts: list = key.split("'")
+    return parts[1], parts[3]
+
+
+def _open_envelope(element: bytes) -> tuple:
+    """
+    Split an inbox element into sender id and serialized message.
+    Member ids never contain blanks, so the first blank separates sender and message.
+    :param element: raw inbox element
+    :return: tuple of sender identifier and serialized message
+    """
+    raw_sender, data = element.split(b' ', 1)
+    return raw_sender.decode(), data
+
+
+class QueueFull(Exception):
+    """
+    Raised by send operations if a receiver queue is at its capacity (overflow policies 'block' and 'reject').
+    No message of the failed send operation has been delivered.
+    """
+    pass
 
 
 class Channel:
@@ -13,7 +322,7 @@ class Channel:
     Processes are associated with "subgroups" that can be queried to obtain a set of all members (e.g. all "servers").
 
     Members can use the channel to send/receive a message to/from a set of members or all other members.
-    Messages might be any serializable object.
+    Messages might be any serializable object (see lab_serializer).
 
     Internally, the channel manages a set of queues.
     A queue is associates with two channel members: a sender and a receiver.
@@ -21,7 +330,7 @@ class Channel:
     Send operations of a caller push messages to respective caller-receiver queues for a set of receivers.
     Receive operations of a caller pop messages from respective sender-caller queues for a set of senders.
 
-    Queues are implemented as redis lists.
+    Queues are implemented as redis lists (or one list or stream per receiver, see queue_mode).
     The key is a string representation of a list containing sender and receiver ids.
     That is, sender and receiver can always be identified by parsing the queue keys.
 
@@ -33,31 +342,282 @@ class Channel:
     Subgroup Member Sets
         Key: <subgroup>
         Value: redis set of member ID strings
-    Global Queue List (containing all possible queue keys)
+    Global Queue Registry (containing all possible queue keys)
         Key: "xchan"
-        Value: redis list of queue identifier objects
+        Value: redis set of queue keys
+    Member Queue Index (containing all incoming and outgoing queue keys of a member)
+        Key: "xchan:<member>"
+        Value: redis set of queue keys
     Queues
         Key: "['<member1>','<member2>']"
         Value: redis list of message objects send fom member1 to member2
+    Inboxes (queue_mode 'inbox' only)
+        Key: "inbox:<member>"
+        Value: redis list of "<sender> <message>" envelopes sent to member
+    Streams (queue_mode 'stream' only)
+        Key: "stream:<member>"
+        Value: redis stream of entries {s: <sender>, m: <message>} sent to member, consumer group "vs2lab"
+    Membership Notifications
+        Channel: "membership"
+        Value: redis pub/sub channel, join/leave publish the affected subgroup
     """
 
-    def __init__(self, n_bits: int = 5, host_ip: str = 'localhost', port_no: int = 6379):
-        # create redis client
-        self.channel = redis.StrictRedis(host=host_ip, port=port_no, db=0)
-        # create dict of local pid bindings
+    # Number of random id candidates tried per join round trip
+    JOIN_CANDIDATES: int = 16
+
+    def __init__(self, n_bits: int = 5, host_ip: str = 'localhost', port_no: int = 6379,
+                 cache_members: bool = False, queue_mode: str = 'pair',
+                 serializer: Serializer = None, compress_threshold: int = None, backend: str = 'redis',
+                 unix_socket_path: str = None, hiredis: bool = None, metrics: bool = False,
+                 capacity: int = None, overflow: str = 'block', block_timeout: float = None,
+                 shards: list = None, coalesce: float = None, coalesce_bytes: int = 65536,
+                 ttl: float = None, sweep_interval: float = None, record: str = None, allow_pickle: bool = None):
+        """
+        Connect to the backend. All members of a channel have to use the same queue mode and shard list.
+        :param n_bits: number of bits of member ids
+        :param host_ip: host of the (main) redis server or local broker
+        :param port_no: port of the (main) redis server or local broker
+        :param cache_members: cache the member and subgroup sets locally, invalidated by the membership
+            notifications (redis only, see cache_stats)
+        :param queue_mode: 'pair' (one queue per sender and receiver), 'inbox' (one queue per receiver,
+            see receive_from) or 'stream' (one redis stream per receiver, see ack and takeover)
+        :param serializer: message serializer (default: pickle, see lab_serializer)
+        :param compress_threshold: compress serialized messages of at least this size (None: never)
+        :param backend: 'redis' or 'local' (a local broker process with the same semantics, see lab_broker)
+        :param unix_socket_path: connect via unix socket instead of TCP
+        :param hiredis: select the redis protocol parser, hiredis or pure python (None: redis-py default)
+        :param metrics: stamp enqueue times and record counters and latency histograms (see metrics)
+        :param capacity: maximum number of messages per queue (None: unbounded)
+        :param overflow: policy for full queues, 'block' (retry, see block_timeout), 'reject' (raise QueueFull)
+            or 'drop_oldest'
+        :param block_timeout: seconds a blocked send retries before raising QueueFull (None: forever)
+        :param shards: additional servers ((host, port) tuples or unix socket paths) holding the queues,
+            placed by receiver id
+        :param coalesce: maximum delay (seconds) of buffered sends (None: send at once, see flush)
+        :param coalesce_bytes: maximum size of buffered sends per member
+        :param ttl: seconds queued messages are kept (None: forever)
+        :param sweep_interval: reclaim queues of departed members every sweep_interval seconds (see sweep)
+        :param record: path of a trace of all traffic (see lab_trace), may contain {pid} (os pid)
+        :param allow_pickle: accept pickled messages (default: only if pickle is the serializer)
+        """
+        # create redis client or client of a local broker process (see lab_broker)
+        assert backend in ('redis', 'local'), 'unknown backend'
+        self.backend: str = backend
+        self.channel, self.blocking = self.__connect(host_ip, port_no, unix_socket_path, hiredis)
+        assert not cache_members or hasattr(self.channel, 'pubsub'), 'membership cache requires pub/sub (redis)'
+        # queue shards: the main server and additional servers given by (host, port) or unix socket path
+        self.__shards: list = [(self.channel, self.blocking)]
+        for shard in shards or []:
+            if isinstance(shard, str):
+                self.__shards.append(self.__connect(host_ip, port_no, shard, hiredis))
+            else:
+                self.__shards.append(self.__connect(shard[0], shard[1], None, hiredis))
+        # create dict of local pid bindings and thread bindings (see bind and as_member)
         self.os_members = {}
+        self.__thread_member = threading.local()
         # Number of bits for pid addresses
         self.n_bits: int = n_bits
         # Maximum corresponding pid
         self.MAXPROC: int = pow(2, n_bits)
+        # Queue layout: 'pair' (one queue per sender and receiver), 'inbox' (one queue per receiver)
+        # or 'stream' (one stream per receiver)
+        assert queue_mode in ('pair', 'inbox', 'stream'), 'unknown queue mode'
+        assert queue_mode != 'stream' or backend == 'redis', 'stream mode requires the redis backend'
+        self.queue_mode: str = queue_mode
+        # Maximum number of messages per queue (None: unbounded) and overflow policy for full queues
+        assert capacity is None or capacity > 0, 'invalid capacity'
+        assert overflow in ('block', 'reject', 'drop_oldest'), 'unknown overflow policy'
+        self.capacity = capacity
+        self.overflow: str = overflow
+        self.block_timeout = block_timeout
+        # Time to live of queued messages in seconds (None: forever, see _QUEUE_LUA)
+        assert ttl is None or ttl > 0, 'invalid ttl'
+        self.ttl = ttl
+        # messages taken off an inbox by receive_from, but sent by other senders
+        # (receiver -> list of (sender, message, receipt, enqueue time) tuples, see __receive_inbox)
+        self.__stash: dict = {}
+        # received, but unacknowledged stream entries (receiver -> list of (stream key, entry id) receipts)
+        self.__unacked: dict = {}
+        # locks guarding the stash and unacknowledged receipts of each member (member -> condition, see __receiving)
+        # and the members whose inbox or stream is being read by one of their threads (see __start_read)
+        self.__receive_locks: dict = {}
+        self.__receive_locks_lock = threading.Lock()
+        self.__reading: set = set()
+        # message serialization (see lab_serializer.Codec), stamping enqueue times if metrics are recorded
+        self.codec = Codec(serializer, compress_threshold, timestamps=metrics, allow_pickle=allow_pickle)
+        # per-member counters and latency histograms (see lab_metrics.ChannelMetrics)
+        self.__metrics = ChannelMetrics() if metrics else None
+        # trace of all sends, receives, joins and leaves (see lab_trace), the path may contain {pid} (os pid)
+        self.__trace = None if record is None else lab_trace.TraceWriter(record.format(pid=os.getpid()))
+        # send coalescing: maximum delay (None: disabled) and size of buffered messages,
+        # buffers (sender -> list of (receiver, serialized message) tuples) and their flush timers
+        assert coalesce is None or coalesce > 0, 'invalid coalescing delay'
+        self.coalesce = coalesce
+        self.coalesce_bytes: int = coalesce_bytes
+        self.__outbox: dict = {}
+        self.__outbox_bytes: dict = {}
+        self.__outbox_timers: dict = {}
+        self.__outbox_lock = threading.Lock()
+        self.__outbox_senders: dict = {}  # caller -> lock keeping the pushes of its batches in order
+        # register server-side scripts for member id allocation and broadcasts (main server),
+        # batched sends and batched receives (every shard)
+        self.__join_script = self.__register_script(self.channel, 'join', _JOIN_LUA)
+        self.__broadcast_script = self.__register_script(self.channel, 'broadcast', _BROADCAST_LUA)
+        self.__send_scripts: list = [self.__register_script(client, 'send', _SEND_LUA) for client, _ in self.__shards]
+        self.__drain_scripts: list = [self.__register_script(client, 'drain', _DRAIN_LUA)
+                                      for client, _ in self.__shards]
+        # create local membership cache (key -> member set) and its statistics
+        self.cache_members: bool = cache_members
+        self.__cache: dict = {}
+        self.__cache_lock = threading.Lock()
+        self.__cache_generation: int = 0
+        self.__cache_stats: dict = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self.__listener = None
+        if cache_members:
+            # subscribe to membership notifications before anything gets cached
+            pubsub = self.channel.pubsub()
+            pubsub.subscribe(**{'membership': self.__invalidate})
+            pubsub.get_message(timeout=1.0)  # wait for subscription to be confirmed
+            self.__listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
         # create instance logger
         self.logger = logging.getLogger('vs2lab.channel.Channel')
         self.logger.debug('New Channel created.')
+        # reclaim queues of departed members every sweep_interval seconds (see sweep)
+        self.__sweep_stats: dict = {'sweeps': 0, 'queues': 0, 'bytes': 0}
+        self.__sweeper = None
+        if sweep_interval is not None:
+            self.__sweeper_stop = threading.Event()
+            self.__sweeper = threading.Thread(target=self.__sweep_loop, args=(sweep_interval,), daemon=True)
+            self.__sweeper.start()
+
+    def __connect(self, host_ip: str, port_no: int, unix_socket_path: str, hiredis: bool) -> tuple:
+        """
+        Create the clients for one server of the backend.
+        :return: tuple of client and client for blocking operations
+        """
+        if self.backend == 'local':
+            client = lab_broker.connect(host_ip, port_no, unix_socket_path)
+            return client, client
+        # clients share process-wide connection pools (see _connection_pool)
+        client = redis.StrictRedis(connection_pool=_connection_pool(
+            host_ip, port_no, unix_socket_path, hiredis, False))
+        # blocking receives use connections of their own, so they never hold up other commands
+        blocking = redis.StrictRedis(connection_pool=_connection_pool(
+            host_ip, port_no, unix_socket_path, hiredis, True))
+        return client, blocking
+
+    def __register_script(self, client, name: str, lua: str):
+        """
+        Register a server-side script with the backend.
+        :param client: client of the server running the script
+        :param name: script name (local broker)
+        :param lua: script source (redis)
+        :return: callable taking keys and args
+        """
+        if self.backend == 'local':
+            return client.script(name)
+        return client.register_script(lua)
+
+    def __shard(self, pid: str) -> int:
+        """
+        Lookup the shard holding the incoming queues of a member.
+        :param pid: member identifier
+        :return: shard index
+        """
+        return _shard_index(pid, len(self.__shards))
+
+    def close(self) -> None:
+        """
+        Flush all coalesced messages, stop the sweeper, close the trace and stop listening for membership notifications
+        (if the membership cache is enabled).
+        :return: None
+        """
+        for caller in list(self.__outbox):
+            self.__flush(caller)
+        if self.__sweeper is not None:
+            self.__sweeper_stop.set()
+            self.__sweeper.join()
+            self.__sweeper = None
+        if self.__trace is not None:
+            self.__trace.close()
+        if self.__listener is not None:
+            self.__listener.stop()
+            self.__listener = None
 
     @staticmethod
     def __decode_set(raw) -> set:
         return {i.decode() for i in raw}
 
+    def __invalidate(self, notification=None) -> None:
+        """
+        Drop all cached member sets (called on membership notifications and local join/leave).
+        :param notification: pub/sub message (unused)
+        :return: None
+        """
+        with self.__cache_lock:
+            self.__cache.clear()
+            self.__cache_generation += 1
+            self.__cache_stats['invalidations'] += 1
+
+    def __member_set(self, key: str = 'members') -> set:
+        """
+        Retrieve the global member set or a subgroup set, served from the local cache if enabled.
+        The returned set must not be modified.
+        :param key: 'members' or subgroup identifier
+        :return: set of member process identifiers
+        """
+        if not self.cache_members:
+            return self.__decode_set(self.channel.smembers(key))
+        with self.__cache_lock:
+            if key in self.__cache:
+                self.__cache_stats['hits'] += 1
+                return self.__cache[key]
+            generation: int = self.__cache_generation
+        members: set = self.__decode_set(self.channel.smembers(key))
+        with self.__cache_lock:
+            self.__cache_stats['misses'] += 1
+            # only cache the set if no invalidation happened while reading it
+            if generation == self.__cache_generation:
+                self.__cache[key] = members
+        return members
+
+    def __missing(self, pids: list) -> list:
+        """
+        Find the identifiers that are not members with a single SMISMEMBER (independent of the group size).
+        With the membership cache, only identifiers missing from the cached member set are looked up,
+        because the cache lags behind joins of other processes until their notification arrives.
+        Only confirmed members are added to the cache.
+        :param pids: member identifiers
+        :return: list of the identifiers that are not members
+        """
+        pids = list(dict.fromkeys(pids))
+        if not self.cache_members:
+            return [pid for pid, is_member in zip(pids, self.channel.smismember('members', pids)) if not is_member]
+        members: set = self.__member_set()
+        pids = [pid for pid in pids if pid not in members]
+        if len(pids) == 0:
+            return []
+        with self.__cache_lock:
+            generation: int = self.__cache_generation
+        found: list = self.channel.smismember('members', pids)
+        confirmed: set = {pid for pid, is_member in zip(pids, found) if is_member}
+        if confirmed:
+            with self.__cache_lock:
+                # extend a copy, callers may still hold the cached set
+                if generation == self.__cache_generation and 'members' in self.__cache:
+                    self.__cache['members'] = self.__cache['members'] | confirmed
+        return [pid for pid in pids if pid not in confirmed]
+
+    def cache_stats(self) -> dict:
+        """
+        Report membership cache statistics.
+        hits counts membership lookups answered locally (i.e. lookups saved), misses counts lookups
+        that had to be read from redis and invalidations counts cache flushes.
+        :return: dict with 'hits', 'misses' and 'invalidations' counters
+        """
+        with self.__cache_lock:
+            return dict(self.__cache_stats)
+
     def join(self, subgroup: str) -> str:
         """
         Join a process as a member to the global channel and associate it with a (sub)group. 
@@ -66,45 +626,68 @@ class Channel:
         :param subgroup: an identifier for the grouping
         :return: global member id of the process.
         """
-        # For concurrently assigning unique member ids, we need to use a transaction
-        # atomically reading and writing the member set. This can be implemented by
-        # means of the pipeline construct.
-        with self.channel.pipeline() as pipe:
-            while 1:
-                try:
-                    # Put a WATCH on the key that holds the member set
-                    pipe.watch('members')
-                    # After WATCHing, the pipeline is put into immediate execution
-                    # mode until we tell it to start buffering commands again.
-                    # This allows us to get the current value of the global member set
-                    raw_members = pipe.smembers('members')
-                    members = self.__decode_set(raw_members)
-                    # Now construct new/unused random member id
-                    remaining_ids = list(set([str(i) for i in range(self.MAXPROC)]) - members)
-                    new_pid = random.choice(remaining_ids)
-                    # Then we can put the pipeline back into buffered mode with MULTI
-                    pipe.multi()
-                    # Add new member id to global member set and subgroup
-                    pipe.sadd('members', new_pid)
-                    pipe.sadd(subgroup, new_pid)
-                    # and finally, execute the pipeline (the set command)
-                    pipe.execute()
-                    # if a WatchError wasn't raised during execution,
-                    # everything we just did happened atomically.
-                    break
-                except redis.WatchError:
-                    # another client must have changed 'members' between
-                    # the time we started WATCHing it and the pipeline's execution.
-                    # our best bet is to just retry.
-                    continue
+        # Claim a random unused id on the server side. The script tries a batch of random candidates
+        # and atomically takes the first free one, so the cost does not depend on MAXPROC and
+        # concurrent joins never need to retry because of each other. In stream mode, the script also
+        # deletes a stale stream of a former member with the new id, unless it lives on another shard
+        # (then entries older than the join are trimmed on the shard, see below).
+        prefix: str = _stream_key('') if self.queue_mode == 'stream' and len(self.__shards) == 1 else ''
+        shard_times: list = []
+        if self.queue_mode == 'stream' and len(self.__shards) > 1:
+            shard_times = [client.time() for client, _ in self.__shards]
+        while 1:
+            candidates: list = random.sample(range(self.MAXPROC), min(self.MAXPROC, self.JOIN_CANDIDATES))
+            result = self.__join_script(keys=['members', subgroup], args=[self.MAXPROC, prefix] + candidates)
+            if result == -1:
+                raise RuntimeError('no free member id')
+            if result is not None:
+                break
+            # all candidates were taken (dense id space), try another batch
+        new_pid: str = result[0].decode()
+        members: set = self.__decode_set(result[1])
+        if self.cache_members:
+            self.__invalidate()
         self.logger.info("Member {} joining {}.".format(new_pid, subgroup))
+        if self.__trace is not None:
+            self.__trace.record(lab_trace.JOIN, time.time(), new_pid, [subgroup])
 
-        # construct bidirectional queue names for new member and all existing members (if any)
-        if len(members) > 0:
-            xchan: list = [[new_pid, other] for other in members] + [[other, new_pid] for other in members]
-            # push queue names to global list of all possible transfer queues
-            for xc in xchan:
-                self.channel.rpush('xchan', pickle.dumps(xc))
+        # register the inbox of the new member
+        if self.queue_mode == 'inbox':
+            inbox: str = _inbox_key(new_pid)
+            with self.channel.pipeline(transaction=False) as pipe:
+                pipe.sadd('xchan', inbox)
+                pipe.sadd('xchan:' + new_pid, inbox)
+                pipe.execute()
+        # create and register the stream of the new member. Messages may have been sent to the member as soon
+        # as the script made it visible, so the consumer group starts at the first entry.
+        elif self.queue_mode == 'stream':
+            stream: str = _stream_key(new_pid)
+            shard: int = self.__shard(new_pid)
+            with self.__shards[shard][0].pipeline() as pipe:
+                if shard_times:
+                    # drop the entries (added before the join) and the group of a former member
+                    seconds, microseconds = shard_times[shard]
+                    pipe.xtrim(stream, minid='{}-0'.format(seconds * 1000 + microseconds // 1000), approximate=False)
+                    pipe.xgroup_destroy(stream, _STREAM_GROUP)
+                pipe.xgroup_create(stream, _STREAM_GROUP, id='0', mkstream=True)
+                created = pipe.execute(raise_on_error=False)[-1]  # (destroying fails without a stream)
+            if isinstance(created, Exception):
+                raise created
+            with self.channel.pipeline(transaction=False) as pipe:
+                pipe.sadd('xchan', stream)
+                pipe.sadd('xchan:' + new_pid, stream)
+                pipe.execute()
+        # register bidirectional queues for new member and all existing members (if any) in one round trip
+        elif len(members) > 0:
+            with self.channel.pipeline(transaction=False) as pipe:
+                xchan: list = []
+                for other in members:
+                    pair: list = [_queue_key(new_pid, other), _queue_key(other, new_pid)]
+                    pipe.sadd('xchan:' + other, *pair)
+                    xchan.extend(pair)
+                pipe.sadd('xchan', *xchan)
+                pipe.sadd('xchan:' + new_pid, *xchan)
+                pipe.execute()
         return new_pid
 
     def leave(self, subgroup: str):
@@ -113,133 +696,641 @@ class Channel:
         :param subgroup: subgroup identifier
         :return: None
         """
-        # retrieve member id via os pid and validate it
+        # retrieve member id of the caller and validate it
         os_pid: int = os.getpid()
-        pid: str = self.os_members[os_pid]
-        assert self.channel.sismember('members', pid), 'member unknown'
+        pid: str = self.__caller()
         self.logger.info("Member {} leaving {}".format(pid, subgroup))
+        self.__flush(pid)
+        if self.__trace is not None:
+            self.__trace.record(lab_trace.LEAVE, time.time(), pid, [subgroup])
 
-        # remove binding and global member element
-        del self.os_members[os_pid]
-        self.channel.srem('members', pid)
-
-        # decode member set binary elements to string list
-        raw_members: set = self.channel.smembers('members')
-        members: set = self.__decode_set(raw_members)
+        # atomically remove member id from global member set and subgroup set, notify membership caches
+        # and fetch the queues of the member from the index
+        with self.channel.pipeline() as pipe:
+            pipe.srem('members', pid)
+            pipe.srem(subgroup, pid)
+            pipe.publish('membership', subgroup)
+            pipe.smembers('xchan:' + pid)
+            removed, _, _, raw_queues = pipe.execute()
+        assert removed, 'member unknown'
 
-        # construct bidirectional queue names for new member and all existing members (if any)
-        if len(members) > 0:
-            xchan: list = [[pid, other] for other in members] + [[other, pid] for other in members]
-            # pop queue names from global list of all possible transfer queues
-            for xc in xchan:
-                self.channel.lrem('xchan', 0, pickle.dumps(xc))
+        # remove bindings
+        if self.os_members.get(os_pid) == pid:
+            del self.os_members[os_pid]
+        if getattr(self.__thread_member, 'pid', None) == pid:
+            self.__thread_member.pid = None
+        if self.cache_members:
+            self.__invalidate()
 
-        # remove member id from subgroup set
-        self.channel.srem(subgroup, pid)
+        # unregister all queues of the member from the registry and the index of the other members
+        xchan: set = self.__decode_set(raw_queues)
+        if len(xchan) > 0:
+            with self.channel.pipeline(transaction=False) as pipe:
+                pipe.srem('xchan', *xchan)
+                for queue in xchan:
+                    sender, receiver = _parse_queue_key(queue)
+                    if sender is not None:
+                        other: str = receiver if sender == pid else sender
+                        pipe.srem('xchan:' + other, queue)
+                pipe.delete('xchan:' + pid)
+                pipe.execute()
 
     def exists(self, pid: str) -> bool:
         """
-        Check if pid is in global member set
+        Check if pid is in global member set (with the membership cache, ids missing from the cache
+        are looked up on the server, see __missing)
         :param pid: process identifier
         :return: boolean value, true if pid is a member
         """
-        return self.channel.sismember('members', pid)
+        return len(self.__missing([pid])) == 0
 
-    def bind(self, pid: str) -> int:
+    def bind(self, pid: str, thread: bool = False) -> int:
         """
-        Associate os pid with channel member id.
+        Associate os pid (or only the current thread) with channel member id.
         Thus a caller does not need to provide its id for every subsequent call.
+        Thread bindings take precedence over the binding of the os process.
         :param pid: identifier of process member
+        :param thread: bind the current thread only, so threads of one process can act as different members
         :return: os pid value
         """
         # retrieve os pid and map to given member id
         os_pid: int = os.getpid()
-        self.os_members[os_pid] = pid
-        self.logger.debug("Member {} bound {}".format(pid, os_pid))
+        if thread:
+            self.__thread_member.pid = pid
+            self.logger.debug("Member %s bound to thread %s", pid, threading.get_ident())
+        else:
+            self.os_members[os_pid] = pid
+            self.logger.debug("Member %s bound %s", pid, os_pid)
         return os_pid
 
+    def __caller(self) -> str:
+        """
+        Lookup the member id bound to the current thread or else to the os process.
+        :return: member identifier
+        """
+        pid = getattr(self.__thread_member, 'pid', None)
+        return self.os_members[os.getpid()] if pid is None else pid
+
+    @contextlib.contextmanager
+    def as_member(self, pid: str):
+        """
+        Act as the given member within a with block (in the current thread only).
+        The previous thread binding is restored at the end of the block.
+        :param pid: member identifier
+        """
+        previous = getattr(self.__thread_member, 'pid', None)
+        self.__thread_member.pid = pid
+        try:
+            yield pid
+        finally:
+            self.__thread_member.pid = previous
+
+    def member(self, pid: str) -> 'Member':
+        """
+        Get an endpoint acting as the given member (see Member).
+        :param pid: member identifier
+        :return: member endpoint
+        """
+        return Member(self, pid)
+
     def subgroup(self, subgroup: str) -> set:
         """
         Retrieve members of a subgroup.
         :param subgroup: subgroup string identifier
         :return: set of member process identifiers
         """
-        return self.__decode_set(self.channel.smembers(subgroup))
+        return set(self.__member_set(subgroup))
 
-    @staticmethod
-    def __queue_key(sender: str, receiver: str) -> str:
+    def queues(self, pid: str = None) -> set:
+        """
+        Discover registered queues, either all of them or the incoming and outgoing queues of one member.
+        :param pid: optional member identifier
+        :return: set of (sender, receiver) tuples (sender is None for inboxes)
+        """
+        key: str = 'xchan' if pid is None else 'xchan:' + pid
+        return {_parse_queue_key(queue) for queue in self.__decode_set(self.channel.smembers(key))}
+
+    def queue_depths(self) -> list:
+        """
+        Read the lengths of all registered queues (lists or streams) in one round trip per shard
+        (see lib/channel_top.py).
+        :return: list of ((sender, receiver), depth) tuples (sender is None for inboxes and streams), deepest first
+        """
+        # group keys by the shard holding the queue
+        placement: dict = {}
+        for key in sorted(self.__decode_set(self.channel.smembers('xchan'))):
+            placement.setdefault(self.__shard(_parse_queue_key(key)[1]), []).append(key)
+
+        queues: list = []
+        for shard, keys in placement.items():
+            with self.__shards[shard][0].pipeline(transaction=False) as pipe:
+                for key in keys:
+                    if key.startswith(_stream_key('')):
+                        pipe.xlen(key)
+                    else:
+                        pipe.llen(key)
+                depths: list = pipe.execute()
+            queues += [(_parse_queue_key(key), depth) for key, depth in zip(keys, depths)]
+        return sorted(queues, key=lambda queue: queue[1], reverse=True)
+
+    def __envelope(self, caller: str, receiver: str, data: bytes) -> tuple:
+        """
+        Address a serialized message according to the queue mode.
+        :param caller: member identifier of the sender
+        :param receiver: member identifier of the receiver
+        :param data: serialized message
+        :return: tuple of queue key and queue element
+        """
+        if self.queue_mode == 'inbox':
+            # see _open_envelope
+            return _inbox_key(receiver), caller.encode() + b' ' + data
+        if self.queue_mode == 'stream':
+            # the sender is a field of the stream entry (see _QUEUE_LUA)
+            return _stream_key(receiver), data
+        return _queue_key(caller, receiver), data
+
+    def __push(self, caller: str, batch: list) -> None:
+        """
+        Push serialized messages to the queues from caller to the given receivers
+        in one round trip per shard holding any of the queues.
+        :param caller: member identifier of the sender
+        :param batch: list of (receiver, serialized message) tuples
+        :return: None
         """
-        Construct queue name from sender and receiver ids.
-        :param sender: member identifier
-        :param receiver: member identifier
-        :return: redis key
+        validated: bool = False
+        if self.cache_members or len(self.__shards) > 1:
+            # validate here (membership is kept on the main server only, so shards can't validate)
+            missing: list = self.__missing([caller] + [receiver for receiver, _ in batch])
+            assert caller not in missing, 'unknown sender'
+            assert len(missing) == 0, 'unknown receiver'
+            validated = True
+
+        # group messages by the shard holding the queue of the receiver
+        shards: dict = {}
+        for receiver, data in batch:
+            shards.setdefault(self.__shard(receiver), []).append((receiver, data))
+
+        if validated and self.capacity is None and self.ttl is None:
+            # push all messages in one pipelined round trip per shard
+            for shard, copies in shards.items():
+                with self.__shards[shard][0].pipeline(transaction=False) as pipe:
+                    for receiver, data in copies:
+                        key, element = self.__envelope(caller, receiver, data)
+                        if self.queue_mode == 'stream':
+                            pipe.xadd(key, {'s': caller, 'm': element})
+                        else:
+                            pipe.rpush(key, element)
+                    pipe.execute()
+            return
+
+        for shard, copies in shards.items():
+            envelopes: list = [self.__envelope(caller, receiver, data) for receiver, data in copies]
+            keys: list = ['' if validated else 'members'] + [key for key, _ in envelopes]
+            args: list = [caller, self.queue_mode] + self.__queue_args() + [receiver for receiver, _ in copies] \
+                + [data for _, data in envelopes]
+            status = self.__bounded(self.__send_scripts[shard], keys, args)
+            assert status != -1, 'unknown sender'
+            assert status <= 0, 'unknown receiver'
+            if status < -1:
+                raise QueueFull('queue of {} is full'.format(copies[-status - 2][0]))
+
+    def __queue_args(self) -> list:
         """
-        return str([sender, receiver])
+        Queue capacity, overflow policy and ttl arguments of the send scripts (see _QUEUE_LUA).
+        Blocking senders run the scripts with policy 'reject' and retry (see __bounded).
+        :return: list of capacity (0: unbounded), policy and ttl in milliseconds (0: none)
+        """
+        return [self.capacity or 0, 'drop_oldest' if self.overflow == 'drop_oldest' else 'reject',
+                int((self.ttl or 0) * 1000)]
+
+    def __bounded(self, script, keys: list, args: list) -> int:
+        """
+        Run a send script. With overflow policy 'block', retry while a receiver queue is full
+        (with exponential backoff) until the message fits or block_timeout expires.
+        :param script: send script
+        :param keys: script keys
+        :param args: script arguments
+        :return: script status (less than -1 if a queue is full)
+        """
+        deadline = None if self.block_timeout is None else time.time() + self.block_timeout
+        delay: float = 0.001
+        while True:
+            status: int = script(keys=keys, args=args)
+            if status >= -1 or self.overflow != 'block':
+                return status
+            if deadline is not None and time.time() >= deadline:
+                return status
+            time.sleep(delay)
+            delay = min(2 * delay, 0.05)
 
     def send_to(self, destination_set: set, message: object) -> None:
         """
         Sends an asynchronous, persistent multicast message.
+        The message is delivered to all receivers or to none, unless the queues are sharded or sends
+        are coalesced (see send_many).
         :param destination_set: a set of member identifiers
         :param message: the message object to be send (see 'message format' in class doc)
         :return: None
         """
-        # destination_set needs to contain string identifiers
-        assert all(type(k) is str for k in destination_set), 'type error'
+        self.send_many([(destination_set, message)])
+
+    def send_many(self, batch: list) -> None:
+        """
+        Sends a batch of asynchronous, persistent multicast messages at once (e.g. a whole protocol step).
+        Either all messages are delivered or none (if any sender or receiver is unknown or a queue is full).
+        With shards, this holds per shard only: messages to receivers on other shards may already be delivered.
+        With coalescing enabled, the messages are appended to the caller's buffer instead (see flush)
+        and errors only surface when the buffer is pushed.
+        :param batch: list of (destination_set, message) tuples
+        :return: None
+        """
+        # lookup member id by pid
+        caller: str = self.__caller()
+
+        # serialize each message once and pair it with all of its destinations
+        copies: list = []
+        for destination_set, message in batch:
+            # destination_set needs to contain string identifiers
+            assert all(type(k) is str for k in destination_set), 'type error'
+            self.logger.debug("%s sends %s to %s", caller, message, destination_set)
+            data: bytes = self.codec.dumps(message)
+            copies.extend((destination, data) for destination in destination_set)
+            if self.__trace is not None:
+                self.__trace.record(lab_trace.SEND, time.time(), caller, destination_set, len(data))
+
+        if self.coalesce is not None:
+            self.__buffer(caller, copies)
+        else:
+            self.__send(caller, copies)
+
+    def __send(self, caller: str, copies: list) -> None:
+        """
+        Validate sender and receivers and push messages to the incoming queues of their receivers.
+        :param caller: member identifier of the sender
+        :param copies: list of (receiver, serialized message) tuples
+        :return: None
+        """
+        self.__push(caller, copies)
+        if self.__metrics is not None:
+            self.__metrics.sent(caller, len(copies), sum(len(data) for _, data in copies))
+
+    def __buffer(self, caller: str, copies: list) -> None:
+        """
+        Append messages to the caller's coalescing buffer. The buffer is flushed once it holds
+        coalesce_bytes bytes, otherwise a timer flushes it after coalesce seconds.
+        :param caller: member identifier of the sender
+        :param copies: list of (receiver, serialized message) tuples
+        :return: None
+        """
+        with self.__outbox_lock:
+            self.__outbox.setdefault(caller, []).extend(copies)
+            self.__outbox_bytes[caller] = self.__outbox_bytes.get(caller, 0) + sum(len(data) for _, data in copies)
+            full: bool = self.__outbox_bytes[caller] >= self.coalesce_bytes
+            if not full:
+                self.__schedule(caller)
+        if full:
+            self.__send_buffered(caller)
 
-        # lookup member id by pid and validate it
-        caller: str = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', caller), 'unknown sender'
-        self.logger.debug("{} sends {} to {}".format(caller, message, destination_set))
+    def __schedule(self, caller: str) -> None:
+        """
+        Start the flush timer of the caller's buffer unless it is running (requires the outbox lock).
+        :param caller: member identifier of the sender
+        :return: None
+        """
+        if caller not in self.__outbox_timers:
+            timer = threading.Timer(self.coalesce, self.__expire, args=(caller,))
+            timer.daemon = True
+            self.__outbox_timers[caller] = timer
+            timer.start()
+
+    def __send_buffered(self, caller: str, requeue: bool = False) -> None:
+        """
+        Push all buffered messages of the caller as one batch. The buffer is taken out under the outbox lock
+        and pushed without holding it, so a push blocked on a full queue (overflow 'block') does not stall
+        the buffering and flushing of other members, e.g. of the receiver that would drain the queue.
+        The caller's sender lock keeps its batches in order.
+        :param caller: member identifier of the sender
+        :param requeue: on redis errors, put the batch back in front of the buffer and restart its timer
+        (messages pushed before the error, e.g. to other shards, are pushed again then)
+        :return: None
+        """
+        with self.__outbox_lock:
+            sender_lock = self.__outbox_senders.setdefault(caller, threading.Lock())
+        with sender_lock:
+            with self.__outbox_lock:
+                timer = self.__outbox_timers.pop(caller, None)
+                if timer is not None:
+                    timer.cancel()
+                copies: list = self.__outbox.pop(caller, [])
+                self.__outbox_bytes.pop(caller, None)
+            if len(copies) > 0 and self.__metrics is not None:
+                # messages are enqueued now, not when they were buffered (restamp each message once)
+                stamped: dict = {}
+                for _, data in copies:
+                    if id(data) not in stamped:
+                        stamped[id(data)] = self.codec.restamp(data)
+                copies = [(receiver, stamped[id(data)]) for receiver, data in copies]
+            if len(copies) > 0:
+                try:
+                    self.__send(caller, copies)
+                except redis.RedisError:
+                    if requeue:
+                        with self.__outbox_lock:
+                            self.__outbox[caller] = copies + self.__outbox.get(caller, [])
+                            self.__outbox_bytes[caller] = self.__outbox_bytes.get(caller, 0) \
+                                + sum(len(data) for _, data in copies)
+                            self.__schedule(caller)
+                    raise
 
-        # push message to incoming queues of all destinations
-        for destination in destination_set:
-            assert self.channel.sismember('members', destination), 'unknown receiver'
-            self.channel.rpush(self.__queue_key(caller, destination), pickle.dumps(message))
+    def __flush(self, caller: str) -> None:
+        """
+        Push all buffered messages of the caller (if coalescing is enabled).
+        :param caller: member identifier of the sender
+        :return: None
+        """
+        if self.coalesce is not None:
+            self.__send_buffered(caller)
+
+    def __expire(self, caller: str) -> None:
+        """
+        Flush the caller's buffer when its coalescing delay has passed (runs in the timer thread).
+        Batches failing on redis errors (e.g. a connection reset) stay buffered and are retried.
+        :param caller: member identifier of the sender
+        :return: None
+        """
+        try:
+            self.__send_buffered(caller, requeue=True)
+        except (AssertionError, QueueFull) as e:
+            self.logger.error("Dropping coalesced messages of %s: %s", caller, e)
+        except redis.RedisError as e:
+            self.logger.error("Pushing coalesced messages of %s failed, retrying: %s", caller, e)
+
+    def flush(self) -> None:
+        """
+        Push all messages buffered by the caller (see coalesce) to their queues in one batch.
+        :return: None
+        """
+        self.__flush(self.__caller())
 
-    def send_to_all(self, message: object) -> None:
+    def send_to_all(self, message: object, subgroup: str = None, exclude_self: bool = False) -> None:
         """
         Sends an asynchronous, persistent broadcast message.
-        The message is delivered to all queues of currently registered members.
+        The message is delivered to all queues of currently registered members (optionally restricted
+        to the members of a subgroup). The message is serialized once and fanned out on the server side.
         :param message: the message object to be send
+        :param subgroup: optional subgroup identifier to restrict the receivers
+        :param exclude_self: whether to skip the sender's own queue
+        :return: None
+        """
+        # lookup member id by pid
+        caller: str = self.__caller()
+        self.logger.debug("%s sends %s to all members%s",
+                          caller, message, '' if subgroup is None else ' of ' + subgroup)
+        self.__flush(caller)
+
+        data: bytes = self.codec.dumps(message)
+        if self.__trace is not None:
+            self.__trace.record(lab_trace.BROADCAST, time.time(), caller, [subgroup] if subgroup else [], len(data),
+                                lab_trace.EXCLUDE_SELF if exclude_self else 0)
+        if len(self.__shards) > 1:
+            # lookup receivers on the main server and push message to their shards
+            members: set = self.__member_set()
+            assert caller in members, 'unknown sender'
+            receivers: set = members if subgroup is None else members & self.__member_set(subgroup)
+            if exclude_self:
+                receivers = receivers - {caller}
+            self.__push(caller, [(receiver, data) for receiver in receivers])
+            status: int = len(receivers)
+        else:
+            # validate sender and push message to incoming queues of all (subgroup) members in one round trip
+            status = self.__bounded(self.__broadcast_script, ['members', subgroup or 'members'],
+                                    [caller, self.queue_mode, int(exclude_self), data] + self.__queue_args())
+            assert status != -1, 'unknown sender'
+            if status < -1:
+                raise QueueFull('queue of a receiver is full')
+        if self.__metrics is not None:
+            self.__metrics.sent(caller, status, status * len(data))
+
+    def pending(self, destination: str) -> int:
+        """
+        Query the number of messages waiting in the queue from the caller to destination
+        (in queue modes 'inbox' and 'stream': all messages waiting for destination) in one round trip.
+        :param destination: member identifier
+        :return: queue depth
+        """
+        caller: str = self.__caller()
+        self.__flush(caller)
+        key, _ = self.__envelope(caller, destination, b'')
+        client = self.__shards[self.__shard(destination)][0]
+        if self.queue_mode == 'stream':
+            return client.xlen(key)
+        return client.llen(key)
+
+    def __read_stream(self, caller: str, key: str, count: int, timeout) -> list:
+        """
+        Read up to count new entries off a stream as consumer caller.
+        :param caller: member identifier of the consumer
+        :param key: stream key
+        :param count: maximum number of entries
+        :param timeout: timeout for blocking read (0 blocks forever, None does not block)
+        :return: list of (sender, message, receipt, enqueue time) tuples, empty on timeout
+        """
+        # block is given in milliseconds (0 blocks forever)
+        block = None if timeout is None else (max(1, int(timeout * 1000)) if timeout else 0)
+        client, blocking = self.__shards[self.__shard(_parse_queue_key(key)[1])]
+        if timeout is not None:
+            client = blocking
+        result = client.xreadgroup(_STREAM_GROUP, caller, {key: '>'}, count=count, block=block)
+        if not result:
+            return []
+        return [self.__stream_entry(caller, key, entry) for entry in result[0][1]]
+
+    def __stream_entry(self, caller: str, key: str, entry: tuple) -> tuple:
+        """
+        Decode a stream entry.
+        :param caller: member identifier of the receiver
+        :param key: stream key
+        :param entry: tuple of entry id and fields
+        :return: tuple of sender id, message, receipt (stream key, entry id) and enqueue time
+        """
+        entry_id, fields = entry
+        sender: str = fields[b's'].decode()
+        message, stamp = self.__load(caller, sender, fields[b'm'])
+        return sender, message, (key, entry_id), stamp
+
+    def __load(self, caller: str, sender: str, data: bytes) -> tuple:
+        """
+        Deserialize a message taken off a queue and record its size and queue wait (if metrics are enabled)
+        and the receive (if traffic is recorded).
+        :param caller: member identifier of the receiver
+        :param sender: member identifier of the sender
+        :param data: serialized message
+        :return: tuple of message and enqueue time (None if unknown)
+        """
+        if self.__trace is not None:
+            self.__trace.record(lab_trace.RECEIVE, time.time(), sender, [caller], len(data))
+        stamp = None
+        if self.__metrics is not None:
+            stamp = self.codec.timestamp(data)
+            self.__metrics.received(caller, len(data), None if stamp is None else time.time() - stamp)
+        return self.codec.loads(data), stamp
+
+    def __pop_inbox(self, caller: str, timeout: int) -> tuple:
+        """
+        Block until the next message arrives in the caller's inbox or stream.
+        :param caller: member identifier of the receiver
+        :param timeout: timeout for blocking read (0 blocks forever)
+        :return: tuple of sender id, message, receipt (None for inboxes) and enqueue time or None on timeout
+        """
+        if self.queue_mode == 'stream':
+            entries: list = self.__read_stream(caller, _stream_key(caller), 1, timeout)
+            return entries[0] if entries else None
+        result = self.__shards[self.__shard(caller)][1].blpop(_inbox_key(caller), timeout)
+        if result is None:
+            return None
+        # extract sender id from envelope and deserialize msg content
+        sender, data = _open_envelope(result[1])
+        message, stamp = self.__load(caller, sender, data)
+        return sender, message, None, stamp
+
+    def __receiving(self, caller: str):
+        """
+        Lock guarding the stash and the unacknowledged receipts of a member, so several threads can use
+        the same member without losing or duplicating its stashed and unacknowledged messages.
+        The lock is never held while waiting for the server. Threads waiting for another thread reading
+        the member's inbox or stream are notified via the lock's condition (see __start_read).
+        :param caller: member identifier of the receiver
+        :return: condition of a re-entrant lock of the member
+        """
+        with self.__receive_locks_lock:
+            return self.__receive_locks.setdefault(caller, threading.Condition(threading.RLock()))
+
+    def __start_read(self, caller: str, remaining: float) -> bool:
+        """
+        Become the only thread reading the caller's inbox or stream (requires the member's receive lock).
+        If another thread is reading, wait until it stashes a message or finishes its read instead, so
+        messages it takes off for other threads are handed over at once (no thread blocks on the server
+        while messages for it are stashed).
+        :param caller: member identifier of the receiver
+        :param remaining: maximum time to wait (0 waits forever)
+        :return: True if the current thread reads now (see __end_read), False if it waited (check the stash again)
+        """
+        if caller not in self.__reading:
+            self.__reading.add(caller)
+            return True
+        self.__receiving(caller).wait(remaining or None)
+        return False
+
+    def __end_read(self, caller: str) -> None:
+        """
+        Finish reading the caller's inbox or stream (requires the member's receive lock) and wake the waiting threads.
+        :param caller: member identifier of the receiver
         :return: None
         """
-        # lookup member id by pid and validate it
-        caller: str = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', caller), 'unknown sender'
-        self.logger.debug("{} sends {} to all members".format(caller, message))
+        self.__reading.discard(caller)
+        self.__receiving(caller).notify_all()
+
+    def __take_stashed(self, caller: str, sender_set) -> tuple:
+        """
+        Take the first stashed message of the given senders (requires the member's receive lock).
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :return: tuple of sender id and message or None
+        """
+        stash: list = self.__stash.setdefault(caller, [])
+        for i, entry in enumerate(stash):
+            if sender_set is None or entry[0] in sender_set:
+                del stash[i]
+                return self.__deliver(caller, *entry)
+        return None
+
+    def __deliver(self, caller: str, sender: str, message: object, receipt=None, stamp: float = None) -> tuple:
+        """
+        Hand a message to the caller, remembering its receipt until it is acknowledged (see ack)
+        and recording its end-to-end latency (if metrics are enabled).
+        :return: tuple of sender id and message
+        """
+        if receipt is not None:
+            with self.__receiving(caller):
+                self.__unacked.setdefault(caller, []).append(receipt)
+        if stamp is not None:
+            self.__metrics.delivered(caller, time.time() - stamp)
+        self.logger.debug("%s received %s from %s", caller, message, sender)
+        return sender, message
 
-        members = self.__decode_set(self.channel.smembers('members'))
-        # push message to incoming queues of all members
-        for destination in members:
-            self.channel.rpush([self.__queue_key(caller, destination)], pickle.dumps(message))
+    def __receive_inbox(self, caller: str, sender_set, timeout: int) -> tuple:
+        """
+        Take the next message from the given senders (or any sender) off the caller's stash or inbox (or stream).
+        Messages of other senders are stashed locally in order of arrival.
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :param timeout: timeout for blocking read (0 blocks forever)
+        :return: tuple of sender id and message or None on timeout
+        """
+        lock = self.__receiving(caller)
+        deadline: float = time.time() + timeout
+        while True:
+            with lock:
+                # serve stashed messages first to keep FIFO order per sender
+                # (again after every read, other threads of the member may have stashed some)
+                stashed = self.__take_stashed(caller, sender_set)
+                if stashed is not None:
+                    return stashed
+                remaining: float = 0
+                if timeout:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                if not self.__start_read(caller, remaining):
+                    continue
+            # block until new msg appears in the inbox (without holding the lock)
+            result = None
+            wanted: bool = False
+            try:
+                result = self.__pop_inbox(caller, remaining)
+                wanted = result is not None and (sender_set is None or result[0] in sender_set)
+            finally:
+                with lock:
+                    # stash before waking the other threads, so they find it
+                    if result is not None and not wanted:
+                        self.__stash[caller].append(result)
+                    self.__end_read(caller)
+            if wanted:
+                return self.__deliver(caller, *result)
 
     def receive_from_any(self, timeout: int = 0) -> tuple:
         """
         Make a blocking request to take the next message off any of the callers' incoming queues.
         :param timeout: optional timeout for blocking read.
-        :return: list containing the queue name and message
+        :return: tuple of sender id and message or None on timeout
         """
-        # lookup member id by pid and validate it
-        caller = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', str(caller)), 'unknown receiver'
+        # lookup member id by pid, push its buffered messages and validate it
+        caller = self.__caller()
+        self.__flush(caller)
+
+        if self.queue_mode != 'pair':
+            # a single queue per receiver, only the caller is looked up
+            assert len(self.__missing([caller])) == 0, 'unknown receiver'
+            self.logger.debug("%s receives from its inbox", caller)
+            return self.__receive_inbox(caller, None, timeout)
+
+        members: set = self.__member_set()
+        assert str(caller) in members, 'unknown receiver'
 
-        # decode member set binary elements
-        members: set = self.__decode_set(self.channel.smembers('members'))
         # construct incoming message queues for all members
-        in_queues: set = {self.__queue_key(member, caller) for member in members}
-        self.logger.debug("{} receives from {}".format(caller, in_queues))
+        in_queues: set = {_queue_key(member, caller) for member in members}
+        self.logger.debug("%s receives from %s", caller, in_queues)
 
         # block until new msg appears on one of the incoming queues
-        result = self.channel.blpop(in_queues, timeout)
+        result = self.__shards[self.__shard(caller)][1].blpop(in_queues, timeout)
         if result is not None:
             # extract sender id from key part
             key: str = result[0].decode()
-            sender: str = key.split("'")[1]
+            sender, _ = _parse_queue_key(key)
             # deserialize msg content
-            message = pickle.loads(result[1])
+            message, stamp = self.__load(caller, sender, result[1])
             # log and return results
-            self.logger.debug("{} received {} from {}".format(caller, message, sender))
-            return sender, message
+            return self.__deliver(caller, sender, message, None, stamp)
 
     def receive_from(self, sender_set: set, timeout: int = 0) -> tuple:
         """
@@ -247,29 +1338,672 @@ class Channel:
         from the members specified in the sender_set attribute.
         :param sender_set: set of ids to watch respective incoming queues for a new message
         :param timeout: optional timeout for blocking call
-        :return:
+        :return: tuple of sender id and message or None on timeout
         """
         assert (type(k) is str for k in sender_set), 'Address type mismatch.'
 
-        # lookup member id by pid and validate it
-        caller: str = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', caller), 'unknown receiver'
-        self.logger.debug("{} receives from {}".format(caller, sender_set))
+        # lookup member id by pid, push its buffered messages and validate it
+        caller: str = self.__caller()
+        self.__flush(caller)
+        missing: list = self.__missing([caller] + list(sender_set))
+        assert caller not in missing, 'unknown receiver'
+        self.logger.debug("%s receives from %s", caller, sender_set)
 
         # validate all senders and construct incoming queues for them
-        in_queues: set = set()
-        for sender in sender_set:
-            assert self.channel.sismember('members', sender), 'unknown sender'
-            in_queues.add(self.__queue_key(sender, caller))
+        assert len(missing) == 0, 'unknown sender'
+        in_queues: set = {_queue_key(sender, caller) for sender in sender_set}
+
+        if self.queue_mode != 'pair':
+            return self.__receive_inbox(caller, set(sender_set), timeout)
 
         # block until new msg appears on one of the queues
-        result = self.channel.blpop(in_queues, timeout)
+        result = self.__shards[self.__shard(caller)][1].blpop(in_queues, timeout)
         if result is not None:
             # extract sender id from key part
             key: str = result[0].decode()
-            sender: str = key.split("'")[1]
+            sender, _ = _parse_queue_key(key)
             # deserialize msg content
-            message = pickle.loads(result[1])
+            message, stamp = self.__load(caller, sender, result[1])
             # log and return results
-            self.logger.debug("{} received {} from {}".format(caller, message, sender))
+            return self.__deliver(caller, sender, message, None, stamp)
+
+    def __drain(self, caller: str, keys: list, max_n: int) -> list:
+        """
+        Pop up to max_n messages off the given queues in one round trip (non-blocking).
+        Queues are visited in random order, so no queue is starved by another one.
+        :param caller: member identifier of the receiver
+        :param keys: queue keys
+        :param max_n: maximum number of messages
+        :return: list of (queue key, raw queue element) tuples in FIFO order per queue
+        """
+        keys = list(keys)
+        random.shuffle(keys)
+        raw: list = self.__drain_scripts[self.__shard(caller)](keys=keys, args=[max_n])
+        return [(keys[int(raw[i]) - 1], raw[i + 1]) for i in range(0, len(raw), 2)]
+
+    def __receive_many(self, caller: str, senders: set, max_n: int, timeout: int, filtered: bool) -> list:
+        """
+        Take up to max_n messages from the given senders off the caller's queues.
+        Blocks only if no message is available at all.
+        :param caller: member identifier of the receiver
+        :param senders: set of sender ids
+        :param max_n: maximum number of messages
+        :param timeout: timeout for blocking read (0 blocks forever)
+        :param filtered: whether to filter inbox messages by sender (otherwise accept any sender)
+        :return: list of (sender, message) tuples, empty on timeout
+        """
+        lock = self.__receiving(caller)
+        received: list = []
+        if self.queue_mode != 'pair':
+            keys: list = [_stream_key(caller) if self.queue_mode == 'stream' else _inbox_key(caller)]
+        else:
+            keys: list = [_queue_key(sender, caller) for sender in senders]
+
+        deadline: float = time.time() + timeout
+        while len(received) < max_n:
+            remaining: float = 0
+            if timeout:
+                remaining = deadline - time.time()
+                if remaining <= 0 and len(received) == 0:
+                    break
+            if self.queue_mode != 'pair':
+                with lock:
+                    # serve stashed messages first to keep FIFO order per sender
+                    # (again after every read, other threads of the member may have stashed some)
+                    while len(received) < max_n:
+                        stashed = self.__take_stashed(caller, senders if filtered else None)
+                        if stashed is None:
+                            break
+                        received.append(stashed)
+                    if len(received) == max_n or (received and caller in self.__reading):
+                        break
+                    if not self.__start_read(caller, remaining):
+                        continue
+            # reads only block if nothing was received yet (without holding the lock)
+            wait = None if received else remaining
+            entries: list = []
+            try:
+                if self.queue_mode == 'stream':
+                    # a single read takes all waiting entries
+                    entries = self.__read_stream(caller, keys[0], max_n - len(received), wait)
+                else:
+                    raw: list = self.__drain(caller, keys, max_n - len(received))
+                    if len(raw) == 0 and len(received) == 0:
+                        # block until new msg appears on one of the queues
+                        result = self.__shards[self.__shard(caller)][1].blpop(keys, wait)
+                        raw = [] if result is None else [(result[0].decode(), result[1])]
+                    for key, data in raw:
+                        if self.queue_mode == 'inbox':
+                            # extract sender id from envelope
+                            sender, data = _open_envelope(data)
+                        else:
+                            # extract sender id from key part
+                            sender, _ = _parse_queue_key(key)
+                        message, stamp = self.__load(caller, sender, data)
+                        entries.append((sender, message, None, stamp))
+            finally:
+                if self.queue_mode != 'pair':
+                    with lock:
+                        # stash before waking the other threads, so they find the messages
+                        for entry in entries:
+                            if filtered and entry[0] not in senders:
+                                self.__stash[caller].append(entry)
+                            else:
+                                received.append(self.__deliver(caller, *entry))
+                        self.__end_read(caller)
+            if self.queue_mode == 'pair':
+                received.extend(self.__deliver(caller, *entry) for entry in entries)
+            if len(entries) == 0:
+                break
+
+        self.logger.debug("%s received %d messages", caller, len(received))
+        return received
+
+    def receive_many(self, max_n: int, timeout: int = 0) -> list:
+        """
+        Make a blocking request to take up to max_n messages off any of the callers' incoming queues.
+        All messages already waiting (up to max_n) are taken in one round trip; the call only blocks
+        if there is no message at all.
+        :param max_n: maximum number of messages
+        :param timeout: optional timeout for blocking read.
+        :return: list of (sender, message) tuples in FIFO order per sender, empty on timeout
+        """
+        # lookup member id by pid, push its buffered messages and validate it
+        caller: str = self.__caller()
+        self.__flush(caller)
+        if self.queue_mode != 'pair':
+            # a single queue per receiver, only the caller is looked up
+            assert len(self.__missing([caller])) == 0, 'unknown receiver'
+            members: set = set()
+        else:
+            members: set = self.__member_set()
+            assert caller in members, 'unknown receiver'
+        self.logger.debug("%s receives up to %d messages from any member", caller, max_n)
+
+        return self.__receive_many(caller, members, max_n, timeout, False)
+
+    def receive_from_many(self, sender_set: set, max_n: int, timeout: int = 0) -> list:
+        """
+        Make a blocking call to take up to max_n messages off any of the callers' queues
+        from the members specified in the sender_set attribute (see receive_many).
+        :param sender_set: set of ids to watch respective incoming queues for new messages
+        :param max_n: maximum number of messages
+        :param timeout: optional timeout for blocking call
+        :return: list of (sender, message) tuples in FIFO order per sender, empty on timeout
+        """
+        # lookup member id by pid, push its buffered messages and validate it
+        caller: str = self.__caller()
+        self.__flush(caller)
+        missing: list = self.__missing([caller] + list(sender_set))
+        assert caller not in missing, 'unknown receiver'
+        assert len(missing) == 0, 'unknown sender'
+        self.logger.debug("%s receives up to %d messages from %s", caller, max_n, sender_set)
+
+        return self.__receive_many(caller, set(sender_set), max_n, timeout, True)
+
+    def ack(self) -> int:
+        """
+        Acknowledge all messages received by the caller so far (queue_mode 'stream' only).
+        Acknowledged messages are deleted from the streams. Unacknowledged messages stay pending,
+        so they can be re-read by another member (see takeover) if the caller crashes.
+        :return: number of acknowledged messages
+        """
+        assert self.queue_mode == 'stream', 'ack requires stream mode'
+        caller: str = self.__caller()
+        with self.__receiving(caller):
+            receipts: list = self.__unacked.pop(caller, [])
+        if len(receipts) == 0:
+            return 0
+
+        # group entry ids by stream (taken over messages are acknowledged on the stream of another member)
+        entry_ids: dict = {}
+        for key, entry_id in receipts:
+            entry_ids.setdefault(key, []).append(entry_id)
+        try:
+            for key, ids in entry_ids.items():
+                with self.__shards[self.__shard(_parse_queue_key(key)[1])][0].pipeline() as pipe:
+                    pipe.xack(key, _STREAM_GROUP, *ids)
+                    pipe.xdel(key, *ids)
+                    pipe.execute()
+        except redis.RedisError:
+            # keep the receipts for the next ack (acknowledging entries twice is harmless)
+            with self.__receiving(caller):
+                self.__unacked[caller] = receipts + self.__unacked.get(caller, [])
+            raise
+        self.logger.debug("%s acknowledged %d messages", caller, len(receipts))
+        return len(receipts)
+
+    def takeover(self, pid: str, min_idle: int = 0) -> list:
+        """
+        Take over the unacknowledged messages sent to another (e.g. crashed) member (queue_mode 'stream' only).
+        Messages the member received but did not acknowledge are claimed first, followed by messages
+        it has not received yet. Taken over messages count as received by the caller (see ack).
+        :param pid: member identifier
+        :param min_idle: only claim messages received at least min_idle milliseconds ago
+        :return: list of (sender, message) tuples in FIFO order
+        """
+        assert self.queue_mode == 'stream', 'takeover requires stream mode'
+        caller: str = self.__caller()
+        self.__flush(caller)
+        assert self.exists(caller), 'unknown receiver'
+        key: str = _stream_key(pid)
+        self.logger.info("%s takes over messages of %s", caller, pid)
+
+        # claim pending entries page by page (deleted entries are reported without fields)
+        entries: list = []
+        start = '0-0'
+        while True:
+            result: list = self.__shards[self.__shard(pid)][0].xautoclaim(key, _STREAM_GROUP, caller, min_idle, start)
+            start, claimed = result[0], result[1]
+            entries.extend(self.__stream_entry(caller, key, entry) for entry in claimed if entry[1])
+            if start in (b'0-0', '0-0'):
+                break
+        # read the entries not yet delivered to anyone
+        entries.extend(self.__read_stream(caller, key, None, None))
+        return [self.__deliver(caller, *entry) for entry in entries]
+
+    def sweep(self, batch: int = 100) -> dict:
+        """
+        Reclaim the queues of departed members, i.e. all queues (of any queue mode) whose receiver
+        is not in the global member set, e.g. left over by crashed members of earlier runs.
+        Queues from departed senders to live receivers are kept until they are received. Streams are kept
+        while they hold pending or unread entries, so they can still be taken over (see takeover).
+        The keys of every shard are scanned in batches; every batch takes one round trip to measure
+        and remove its dead queues. Ids are checked against the member set once more right before removal,
+        so queues of members joining meanwhile are kept. Keys not formed like queue keys are ignored.
+        :param batch: number of keys scanned per round trip
+        :return: dict with the number of reclaimed queues and their size in bytes
+        """
+        reclaimed: dict = {'queues': 0, 'bytes': 0}
+        for client, _ in self.__shards:
+            for pattern in ('[[]*', _inbox_key('*'), _stream_key('*')):
+                cursor = 0
+                while True:
+                    cursor, keys = client.scan(cursor, pattern, batch)
+                    dead: list = self.__dead_queues(client, keys)
+                    if len(dead) > 0:
+                        dead = self.__dead_queues(client, dead)  # check against the current member set again
+                    if len(dead) > 0:
+                        with client.pipeline(transaction=False) as pipe:
+                            for key in dead:
+                                pipe.memory_usage(key)
+                                pipe.unlink(key)
+                            sizes: list = pipe.execute()[::2]
+                        with self.channel.pipeline(transaction=False) as pipe:
+                            pipe.srem('xchan', *dead)
+                            pipe.execute()
+                        reclaimed['queues'] += len(dead)
+                        reclaimed['bytes'] += sum(size or 0 for size in sizes)
+                    if int(cursor) == 0:
+                        break
+
+        self.__sweep_stats['sweeps'] += 1
+        self.__sweep_stats['queues'] += reclaimed['queues']
+        self.__sweep_stats['bytes'] += reclaimed['bytes']
+        if reclaimed['queues'] > 0:
+            self.logger.info("Reclaimed %d queues (%d bytes)", reclaimed['queues'], reclaimed['bytes'])
+        return reclaimed
+
+    def __dead_queues(self, client, keys: list) -> list:
+        """
+        Select the queues of departed receivers (bypassing the membership cache), except for streams
+        still holding pending or unread entries.
+        :param client: client of the shard holding the queues
+        :param keys: keys matching the queue key patterns
+        :return: queue keys whose receiver is no member
+        """
+        members: set = self.__decode_set(self.channel.smembers('members'))
+        dead: list = []
+        for key in keys:
+            key = key.decode() if isinstance(key, bytes) else key
+            try:
+                sender, receiver = _parse_queue_key(key)
+            except IndexError:
+                continue  # not a queue key
+            if not receiver.isdigit() or (sender is not None and _queue_key(sender, receiver) != key):
+                continue
+            if receiver not in members:
+                dead.append(key)
+        busy: set = self.__busy_streams(client, [key for key in dead if key.startswith(_stream_key(''))])
+        return [key for key in dead if key not in busy]
+
+    @staticmethod
+    def __busy_streams(client, keys: list) -> set:
+        """
+        Find the streams holding entries pending in the consumer group or not yet delivered to it
+        (two round trips).
+        :param client: client of the shard holding the streams
+        :param keys: stream keys
+        :return: set of stream keys that must be kept
+        """
+        if len(keys) == 0:
+            return set()
+        with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.xinfo_groups(key)
+            infos: list = pipe.execute(raise_on_error=False)
+        busy: set = set()
+        unread: dict = {}  # stream key -> minimum id of unread entries
+        for key, groups in zip(keys, infos):
+            if isinstance(groups, Exception):
+                busy.add(key)  # keep what can't be inspected
+                continue
+            group = next((g for g in groups if g['name'] in (_STREAM_GROUP, _STREAM_GROUP.encode())), None)
+            if group is None:
+                unread[key] = '-'
+            elif group['pending'] > 0:
+                busy.add(key)
+            else:
+                last = group['last-delivered-id']
+                unread[key] = '(' + (last.decode() if isinstance(last, bytes) else last)
+        if len(unread) > 0:
+            with client.pipeline(transaction=False) as pipe:
+                for key, start in unread.items():
+                    pipe.xrange(key, min=start, count=1)
+                busy.update(key for key, entries in zip(unread, pipe.execute()) if entries)
+        return busy
+
+    def __sweep_loop(self, interval: float) -> None:
+        """
+        Sweep every interval seconds until the channel is closed (runs in the sweeper thread).
+        :param interval: sweep interval in seconds
+        :return: None
+        """
+        while not self.__sweeper_stop.wait(interval):
+            try:
+                self.sweep()
+            except redis.RedisError as e:
+                self.logger.error("Sweep failed: %s", e)
+
+    def sweep_stats(self) -> dict:
+        """
+        Totals of all sweeps of this channel (see sweep).
+        :return: dict with the number of sweeps, reclaimed queues and reclaimed bytes
+        """
+        return dict(self.__sweep_stats)
+
+    def metrics(self) -> dict:
+        """
+        Take a snapshot of the counters and latency histograms of all members bound to this channel
+        (requires metrics to be enabled, see lab_metrics.ChannelMetrics).
+        With coalescing, messages are stamped when the sender's buffer is pushed, so the latencies
+        do not include the time spent in the buffer.
+        :return: dict member id -> dict of counters and histogram snapshots
+        """
+        assert self.__metrics is not None, 'metrics not enabled'
+        return self.__metrics.snapshot()
+
+
+class Member:
+    """
+    Lightweight endpoint of one member of a Channel (see Channel.member).
+    Every operation acts as the member, independent of process and thread bindings, so a single process
+    can host many members sharing the clients and connection pools of one channel, e.g. in a thread pool.
+    The same endpoint may be used from several threads at once. A receive blocked in one thread holds up
+    neither sends, acks and takeovers nor the receives of other threads.
+    """
+
+    # Channel operations available on behalf of the member
+    OPERATIONS = ('send_to', 'send_many', 'send_to_all', 'pending', 'flush', 'leave',
+                  'receive_from_any', 'receive_from', 'receive_many', 'receive_from_many', 'ack', 'takeover')
+
+    def __init__(self, channel: Channel, pid: str):
+        self.channel: Channel = channel
+        self.pid: str = pid
+
+    def __getattr__(self, name: str):
+        if name not in Member.OPERATIONS:
+            raise AttributeError(name)
+        operation = getattr(self.channel, name)
+
+        def call(*args, **kwargs):
+            with self.channel.as_member(self.pid):
+                return operation(*args, **kwargs)
+        return call
+
+    def __repr__(self) -> str:
+        return 'Member({})'.format(self.pid)
+
+
+class AsyncChannel:
+    """
+    AsyncChannel is the asyncio counterpart of Channel, built on redis.asyncio.
+    It uses the same redis data structures, scripts and queue modes (see Channel), so members of a
+    Channel and an AsyncChannel can talk to each other.
+
+    Blocking receive operations are coroutines. Many receives and sends can be in flight at the same time
+    on one event loop without a thread per outstanding call. Each outstanding receive still holds a redis
+    connection of its own for the whole blocking pop (the connection pool grows on demand), so n members
+    waiting at the same time take n sockets. The number of waiting members per process is limited by the
+    open file limit of the process and by the maxclients setting of the redis server (10000 by default);
+    beyond that, receives fail with a redis ConnectionError.
+
+    Members are bound per task instead of per os process: bind stores the member id in a context variable.
+    So every task running a logical member calls bind once, and many members can live in one process.
+    Tasks created by a bound task inherit its binding.
+    """
+
+    def __init__(self, n_bits: int = 5, host_ip: str = 'localhost', port_no: int = 6379,
+                 queue_mode: str = 'pair', serializer: Serializer = None, compress_threshold: int = None,
+                 unix_socket_path: str = None, allow_pickle: bool = None):
+        # create asyncio redis client
+        if unix_socket_path:
+            self.channel = redis.asyncio.StrictRedis(unix_socket_path=unix_socket_path, db=0)
+        else:
+            self.channel = redis.asyncio.StrictRedis(host=host_ip, port=port_no, db=0)
+        # member id bound to the current task (context)
+        self.__member = contextvars.ContextVar('member')
+        # Number of bits for pid addresses
+        self.n_bits: int = n_bits
+        # Maximum corresponding pid
+        self.MAXPROC: int = pow(2, n_bits)
+        # Queue layout: 'pair' (one queue per sender and receiver) or 'inbox' (one queue per receiver)
+        assert queue_mode in ('pair', 'inbox'), 'unknown queue mode'
+        self.queue_mode: str = queue_mode
+        # messages taken off an inbox by receive_from, but sent by other senders (receiver -> list)
+        self.__stash: dict = {}
+        # message serialization (see lab_serializer.Codec)
+        self.codec = Codec(serializer, compress_threshold, allow_pickle=allow_pickle)
+        # register server-side scripts for member id allocation, batched sends and broadcasts
+        self.__join_script = self.channel.register_script(_JOIN_LUA)
+        self.__send_script = self.channel.register_script(_SEND_LUA)
+        self.__broadcast_script = self.channel.register_script(_BROADCAST_LUA)
+        # create instance logger
+        self.logger = logging.getLogger('vs2lab.channel.AsyncChannel')
+        self.logger.debug('New AsyncChannel created.')
+
+    async def close(self) -> None:
+        """
+        Close the redis connections of the channel.
+        :return: None
+        """
+        await self.channel.aclose()
+
+    @staticmethod
+    def __decode_set(raw) -> set:
+        return {i.decode() for i in raw}
+
+    async def __member_set(self, key: str = 'members') -> set:
+        return self.__decode_set(await self.channel.smembers(key))
+
+    async def __missing(self, pids: list) -> list:
+        """
+        Find the identifiers that are not members with a single SMISMEMBER (see Channel).
+        :param pids: member identifiers
+        :return: list of the identifiers that are not members
+        """
+        pids = list(dict.fromkeys(pids))
+        found: list = await self.channel.smismember('members', pids)
+        return [pid for pid, is_member in zip(pids, found) if not is_member]
+
+    def __caller(self) -> str:
+        """
+        Lookup the member id bound to the current task.
+        :return: member identifier
+        """
+        caller = self.__member.get(None)
+        assert caller is not None, 'task not bound to a member'
+        return caller
+
+    async def join(self, subgroup: str) -> str:
+        """
+        Join a process as a member to the global channel and associate it with a (sub)group (see Channel.join).
+        :param subgroup: an identifier for the grouping
+        :return: global member id of the process.
+        """
+        while 1:
+            candidates: list = random.sample(range(self.MAXPROC), min(self.MAXPROC, Channel.JOIN_CANDIDATES))
+            result = await self.__join_script(keys=['members', subgroup], args=[self.MAXPROC, ''] + candidates)
+            if result == -1:
+                raise RuntimeError('no free member id')
+            if result is not None:
+                break
+        new_pid: str = result[0].decode()
+        members: set = self.__decode_set(result[1])
+        self.logger.info("Member {} joining {}.".format(new_pid, subgroup))
+
+        # register the inbox of the new member or the bidirectional queues with all existing members
+        async with self.channel.pipeline(transaction=False) as pipe:
+            if self.queue_mode == 'inbox':
+                pipe.sadd('xchan', _inbox_key(new_pid))
+                pipe.sadd('xchan:' + new_pid, _inbox_key(new_pid))
+            elif len(members) > 0:
+                xchan: list = []
+                for other in members:
+                    pair: list = [_queue_key(new_pid, other), _queue_key(other, new_pid)]
+                    pipe.sadd('xchan:' + other, *pair)
+                    xchan.extend(pair)
+                pipe.sadd('xchan', *xchan)
+                pipe.sadd('xchan:' + new_pid, *xchan)
+            await pipe.execute()
+        return new_pid
+
+    async def leave(self, subgroup: str) -> None:
+        """
+        Unregister the member bound to the current task from the global channel (and subgroup).
+        :param subgroup: subgroup identifier
+        :return: None
+        """
+        pid: str = self.__caller()
+        self.logger.info("Member {} leaving {}".format(pid, subgroup))
+
+        async with self.channel.pipeline() as pipe:
+            pipe.srem('members', pid)
+            pipe.srem(subgroup, pid)
+            pipe.publish('membership', subgroup)
+            pipe.smembers('xchan:' + pid)
+            removed, _, _, raw_queues = await pipe.execute()
+        assert removed, 'member unknown'
+        self.__member.set(None)
+
+        xchan: set = self.__decode_set(raw_queues)
+        if len(xchan) > 0:
+            async with self.channel.pipeline(transaction=False) as pipe:
+                pipe.srem('xchan', *xchan)
+                for queue in xchan:
+                    sender, receiver = _parse_queue_key(queue)
+                    if sender is not None:
+                        pipe.srem('xchan:' + (receiver if sender == pid else sender), queue)
+                pipe.delete('xchan:' + pid)
+                await pipe.execute()
+
+    async def exists(self, pid: str) -> bool:
+        """
+        Check if pid is in global member set
+        :param pid: process identifier
+        :return: boolean value, true if pid is a member
+        """
+        return bool(await self.channel.sismember('members', pid))
+
+    def bind(self, pid: str) -> str:
+        """
+        Associate the current task (and tasks created by it later on) with a channel member id.
+        :param pid: identifier of process member
+        :return: member id
+        """
+        self.__member.set(pid)
+        self.logger.debug("Member %s bound to task", pid)
+        return pid
+
+    async def subgroup(self, subgroup: str) -> set:
+        """
+        Retrieve members of a subgroup.
+        :param subgroup: subgroup string identifier
+        :return: set of member process identifiers
+        """
+        return await self.__member_set(subgroup)
+
+    def __envelope(self, caller: str, receiver: str, data: bytes) -> tuple:
+        if self.queue_mode == 'inbox':
+            return _inbox_key(receiver), caller.encode() + b' ' + data
+        return _queue_key(caller, receiver), data
+
+    async def send_to(self, destination_set: set, message: object) -> None:
+        """
+        Sends an asynchronous, persistent multicast message.
+        :param destination_set: a set of member identifiers
+        :param message: the message object to be send
+        :return: None
+        """
+        await self.send_many([(destination_set, message)])
+
+    async def send_many(self, batch: list) -> None:
+        """
+        Sends a batch of asynchronous, persistent multicast messages in one round trip (see Channel.send_many).
+        :param batch: list of (destination_set, message) tuples
+        :return: None
+        """
+        caller: str = self.__caller()
+        envelopes: list = []
+        receivers: list = []
+        for destination_set, message in batch:
+            assert all(type(k) is str for k in destination_set), 'type error'
+            self.logger.debug("%s sends %s to %s", caller, message, destination_set)
+            data: bytes = self.codec.dumps(message)
+            for destination in destination_set:
+                receivers.append(destination)
+                envelopes.append(self.__envelope(caller, destination, data))
+        status = await self.__send_script(keys=['members'] + [key for key, _ in envelopes],
+                                          args=[caller, self.queue_mode, 0, 'reject', 0] + receivers
+                                          + [data for _, data in envelopes])
+        assert status != -1, 'unknown sender'
+        assert status == 0, 'unknown receiver'
+
+    async def send_to_all(self, message: object, subgroup: str = None, exclude_self: bool = False) -> None:
+        """
+        Sends an asynchronous, persistent broadcast message to all currently registered members
+        (see Channel.send_to_all).
+        :param message: the message object to be send
+        :param subgroup: optional subgroup identifier to restrict the receivers
+        :param exclude_self: whether to skip the sender's own queue
+        :return: None
+        """
+        caller: str = self.__caller()
+        self.logger.debug("%s sends %s to all members", caller, message)
+        status = await self.__broadcast_script(keys=['members', subgroup or 'members'],
+                                               args=[caller, self.queue_mode, int(exclude_self),
+                                                     self.codec.dumps(message), 0, 'reject', 0])
+        assert status != -1, 'unknown sender'
+
+    async def __receive_inbox(self, caller: str, sender_set, timeout: int) -> tuple:
+        # serve stashed messages first to keep FIFO order per sender (see Channel)
+        stash: list = self.__stash.setdefault(caller, [])
+        for i, (sender, message) in enumerate(stash):
+            if sender_set is None or sender in sender_set:
+                del stash[i]
+                return sender, message
+
+        deadline: float = time.time() + timeout
+        while True:
+            remaining: float = 0
+            if timeout:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+            result = await self.channel.blpop(_inbox_key(caller), remaining)
+            if result is None:
+                return None
+            sender, data = _open_envelope(result[1])
+            message = self.codec.loads(data)
+            if sender_set is None or sender in sender_set:
+                self.logger.debug("%s received %s from %s", caller, message, sender)
+                return sender, message
+            stash.append((sender, message))
+
+    async def __receive(self, caller: str, senders: set, timeout: int) -> tuple:
+        # block until new msg appears on one of the incoming queues
+        result = await self.channel.blpop([_queue_key(sender, caller) for sender in senders], timeout)
+        if result is not None:
+            sender, _ = _parse_queue_key(result[0].decode())
+            message = self.codec.loads(result[1])
+            self.logger.debug("%s received %s from %s", caller, message, sender)
             return sender, message
+
+    async def receive_from_any(self, timeout: int = 0) -> tuple:
+        """
+        Wait for the next message on any of the callers' incoming queues.
+        :param timeout: optional timeout for blocking read.
+        :return: tuple of sender id and message or None on timeout
+        """
+        caller: str = self.__caller()
+        if self.queue_mode == 'inbox':
+            assert len(await self.__missing([caller])) == 0, 'unknown receiver'
+            return await self.__receive_inbox(caller, None, timeout)
+        members: set = await self.__member_set()
+        assert caller in members, 'unknown receiver'
+        return await self.__receive(caller, members, timeout)
+
+    async def receive_from(self, sender_set: set, timeout: int = 0) -> tuple:
+        """
+        Wait for the next message from the members specified in the sender_set attribute.
+        :param sender_set: set of ids to watch respective incoming queues for a new message
+        :param timeout: optional timeout for blocking call
+        :return: tuple of sender id and message or None on timeout
+        """
+        caller: str = self.__caller()
+        missing: list = await self.__missing([caller] + list(sender_set))
+        assert caller not in missing, 'unknown receiver'
+        assert len(missing) == 0, 'unknown sender'
+        if self.queue_mode == 'inbox':
+            return await self.__receive_inbox(caller, set(sender_set), timeout)
+        return await self.__receive(caller, set(sender_set), timeout)
@@ -1,7 +1,66 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
 
+# background writers of the asynchronous mode (see setup)
+_listeners: list = []
 
-def setup(stream_level=logging.WARNING, file_level=logging.DEBUG, file_postfix=''):
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only every n-th DEBUG record of selected loggers (records of higher levels always pass).
+    Rates are looked up by the longest matching logger name prefix, e.g. {'vs2lab.channel': 0.01}
+    keeps one out of 100 debug records of the channel loggers.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates: dict = rates
+        self.__counts: dict = {}
+        self.__lock = threading.Lock()
+
+    def __rate(self, name: str) -> float:
+        matches: list = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + '.')]
+        return self.rates[max(matches, key=len)] if matches else 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate: float = self.__rate(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        with self.__lock:
+            count: int = self.__counts.get(record.name, 0)
+            self.__counts[record.name] = count + 1
+        return count % round(1 / rate) == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler enqueuing records unformatted, so message formatting (of lazy %-style arguments)
+    happens in the writer thread. Arguments must not be modified after logging.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup(stream_level=logging.WARNING, file_level=logging.DEBUG, file_postfix='', async_mode=False,
+          sample=None):
+    """
+    Configure the 'vs2lab' logger with a log file and console output.
+    In async_mode, protocol threads only enqueue log records, a background thread formats and writes them
+    (so DEBUG traces can stay on without slowing down the protocols). The writer is stopped at exit.
+    :param stream_level: console log level
+    :param file_level: log file level
+    :param file_postfix: log file name postfix (vs2lab<postfix>.log)
+    :param async_mode: move formatting and I/O to a background thread
+    :param sample: optional dict logger name prefix -> rate of DEBUG records to keep (see SamplingFilter)
+    """
     # create logger with 'vs2lab'
     logger = logging.getLogger('vs2lab')
     logger.setLevel(logging.DEBUG)
@@ -20,6 +79,33 @@ def setup(stream_level=logging.WARNING, file_level=logging.DEBUG, file_postfix='
     fh.setFormatter(formatter)
     ch.setFormatter(formatter)
 
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    if not async_mode:
+        # add the handlers to the logger
+        for handler in (fh, ch):
+            if sample:
+                handler.addFilter(SamplingFilter(sample))
+            logger.addHandler(handler)
+        return
+
+    # enqueue records (sampled before enqueuing) and let a background thread write them to the handlers
+    records = queue.SimpleQueue()
+    qh = DeferredQueueHandler(records)
+    qh.setLevel(min(stream_level, file_level))
+    if sample:
+        qh.addFilter(SamplingFilter(sample))
+    logger.addHandler(qh)
+    listener = logging.handlers.QueueListener(records, fh, ch, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def shutdown():
+    """
+    Stop the background writers of the asynchronous mode after they wrote all queued records
+    (called at exit).
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(shutdown)
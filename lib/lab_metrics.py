@@ -0,0 +1,122 @@
+import threading
+
+
+class Histogram:
+    """
+    Latency histogram with exponential buckets.
+    Bucket i counts latencies below 2^i microseconds (the last bucket also takes all larger ones).
+    """
+
+    def __init__(self, n_buckets: int = 32):
+        self.buckets: list = [0] * n_buckets
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def add(self, latency: float) -> None:
+        """
+        Record a latency.
+        :param latency: latency in seconds (negative values, e.g. caused by clock skew, count as 0)
+        :return: None
+        """
+        latency = max(0.0, latency)
+        self.buckets[min(len(self.buckets) - 1, int(latency * 1e6).bit_length())] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, p: float) -> float:
+        """
+        Estimate a percentile by the upper bound of the bucket containing it.
+        :param p: percentile (0..100)
+        :return: latency in seconds (0 if the histogram is empty)
+        """
+        rank: float = self.count * p / 100
+        seen: int = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n > 0 and seen >= rank:
+                return min(2 ** i / 1e6, self.max)
+        return 0.0
+
+    def snapshot(self) -> dict:
+        """
+        Summarize the histogram.
+        :return: dict with count, mean, p50, p99, max (seconds) and the non-empty buckets (upper bound in us -> count)
+        """
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max,
+                'buckets': {2 ** i: n for i, n in enumerate(self.buckets) if n > 0}}
+
+
+class ChannelMetrics:
+    """
+    Counters and latency histograms of the members using a channel (see lab_channel.Channel).
+    For every member the numbers of sent and received messages and bytes are counted.
+    Latencies are measured from the enqueue time stamped into a message by its sender:
+    queue_wait until the message is taken off the queue, end_to_end until it is handed to the receiver.
+    Latencies of members on different hosts include the clock offset between the hosts.
+    """
+
+    COUNTERS = ('sent', 'sent_bytes', 'received', 'received_bytes')
+
+    def __init__(self):
+        self.__members: dict = {}
+        self.__lock = threading.Lock()
+
+    def __member(self, member: str) -> dict:
+        if member not in self.__members:
+            self.__members[member] = dict({counter: 0 for counter in self.COUNTERS},
+                                          queue_wait=Histogram(), end_to_end=Histogram())
+        return self.__members[member]
+
+    def sent(self, member: str, n_messages: int, n_bytes: int) -> None:
+        """
+        Count sent messages (one per receiver).
+        :param member: sender id
+        :param n_messages: number of messages
+        :param n_bytes: total size of the messages
+        :return: None
+        """
+        with self.__lock:
+            stats: dict = self.__member(member)
+            stats['sent'] += n_messages
+            stats['sent_bytes'] += n_bytes
+
+    def received(self, member: str, n_bytes: int, queue_wait: float = None) -> None:
+        """
+        Count a message taken off a queue.
+        :param member: receiver id
+        :param n_bytes: size of the message
+        :param queue_wait: time spent in the queue (None if unknown)
+        :return: None
+        """
+        with self.__lock:
+            stats: dict = self.__member(member)
+            stats['received'] += 1
+            stats['received_bytes'] += n_bytes
+            if queue_wait is not None:
+                stats['queue_wait'].add(queue_wait)
+
+    def delivered(self, member: str, end_to_end: float) -> None:
+        """
+        Record the end-to-end latency of a message handed to the receiver.
+        :param member: receiver id
+        :param end_to_end: time since the message was enqueued
+        :return: None
+        """
+        with self.__lock:
+            self.__member(member)['end_to_end'].add(end_to_end)
+
+    def snapshot(self) -> dict:
+        """
+        Take a snapshot of all counters and histograms.
+        :return: dict member id -> dict of counters and histogram snapshots
+        """
+        with self.__lock:
+            return {member: {name: value.snapshot() if isinstance(value, Histogram) else value
+                             for name, value in stats.items()}
+                    for member, stats in self.__members.items()}
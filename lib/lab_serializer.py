@@ -0,0 +1,263 @@
+import abc
+import pickle
+import re
+import struct
+import time
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, only needed for MsgpackSerializer
+    msgpack = None
+
+
+class Serializer(abc.ABC):
+    """
+    Serializer converts message objects to bytes and back.
+    Each serializer has a unique codec id that is stored in the marker byte of every message (see Codec).
+    """
+
+    codec_id: int = 0
+
+    @abc.abstractmethod
+    def encode(self, message: object) -> bytes:
+        """
+        Serialize a message.
+        Raises ValueError if the message can't be represented by this serializer.
+        :param message: message object
+        :return: serialized message
+        """
+
+    def encode_parts(self, message: object) -> list:
+        """
+        Serialize a message into a list of buffers whose concatenation is the serialized message.
+        Serializers producing several buffers override this, so the buffers are copied only once,
+        into the channel element (see Codec.dumps).
+        :param message: message object
+        :return: list of bytes-like objects
+        """
+        return [self.encode(message)]
+
+    @abc.abstractmethod
+    def decode(self, data: memoryview) -> object:
+        """
+        Deserialize a message.
+        :param data: serialized message (without marker byte)
+        :return: message object
+        """
+
+
+class PickleSerializer(Serializer):
+    """
+    Pickle protocol 5 with out-of-band buffers.
+    Large binary buffers (e.g. bytearray or numpy arrays) are not copied into the pickle stream but appended
+    as raw frames. On decoding they are passed to pickle as slices of the received data without copying.
+
+    Frame: <n: uint32> <len_1: uint64> .. <len_n: uint64> <buffer_1> .. <buffer_n> <pickle stream>
+    """
+
+    codec_id: int = 1
+    __count = struct.Struct('!I')
+    __length = struct.Struct('!Q')
+
+    def encode(self, message: object) -> bytes:
+        return b''.join(self.encode_parts(message))
+
+    def encode_parts(self, message: object) -> list:
+        buffers: list = []
+        body: bytes = pickle.dumps(message, protocol=5, buffer_callback=buffers.append)
+        raw: list = [buffer.raw() for buffer in buffers]
+        header: list = [self.__count.pack(len(raw))] + [self.__length.pack(r.nbytes) for r in raw]
+        return header + raw + [body]
+
+    def decode(self, data: memoryview) -> object:
+        n: int = self.__count.unpack_from(data)[0]
+        offset: int = self.__count.size
+        lengths: list = []
+        for _ in range(n):
+            lengths.append(self.__length.unpack_from(data, offset)[0])
+            offset += self.__length.size
+        buffers: list = []
+        for length in lengths:
+            buffers.append(data[offset:offset + length])
+            offset += length
+        return pickle.loads(data[offset:], buffers=buffers)
+
+
+class MsgpackSerializer(Serializer):
+    """
+    MessagePack encoding (requires the msgpack package).
+    Only basic types are supported. Sequences are decoded as tuples.
+    """
+
+    codec_id: int = 2
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('MsgpackSerializer requires the msgpack package')
+
+    def encode(self, message: object) -> bytes:
+        try:
+            return msgpack.packb(message, use_bin_type=True)
+        except TypeError as e:
+            raise ValueError(e)
+
+    def decode(self, data: memoryview) -> object:
+        return msgpack.unpackb(data, raw=False, use_list=False)
+
+
+class StructSerializer(Serializer):
+    """
+    Compact encoding of small fixed tuples (e.g. lab5 mutex messages (clock, pid, type)) with a struct format.
+    String fields ('s' format codes) are utf-8 encoded and padded, other fields are packed as given.
+    Messages that would not decode to an equal tuple of the same types (e.g. a bool in an integer field,
+    a string ending with NUL bytes or a float losing precision) are refused with ValueError.
+    Sender and receiver have to use the same format.
+    """
+
+    codec_id: int = 3
+
+    def __init__(self, fmt: str):
+        self.struct = struct.Struct(fmt)
+        # sizes of string fields (None for other fields)
+        self.__fields: list = []
+        for count, code in re.findall(r'(\d*)([a-zA-Z?])', fmt):
+            if code == 's':
+                self.__fields.append(int(count or 1))
+            elif code != 'x':
+                self.__fields.extend([None] * int(count or 1))
+
+    def encode(self, message: object) -> bytes:
+        if not isinstance(message, tuple) or len(message) != len(self.__fields):
+            raise ValueError('message does not match struct format')
+        values: list = []
+        for size, value in zip(self.__fields, message):
+            if size is not None:
+                if not isinstance(value, str) or len(value.encode()) > size:
+                    raise ValueError('string field does not match struct format')
+                value = value.encode()
+            values.append(value)
+        try:
+            data: bytes = self.struct.pack(*values)
+        except struct.error as e:
+            raise ValueError(e)
+        decoded: tuple = self.decode(memoryview(data))
+        if decoded != message or any(type(a) is not type(b) for a, b in zip(decoded, message)):
+            raise ValueError('message does not survive the struct format unchanged')
+        return data
+
+    def decode(self, data: memoryview) -> object:
+        values = self.struct.unpack(data)
+        return tuple(value.rstrip(b'\0').decode() if size is not None else value
+                     for size, value in zip(self.__fields, values))
+
+
+class Codec:
+    """
+    Codec turns messages into channel elements and back.
+    Every element starts with a marker byte: the codec id of the serializer (lower 4 bits) and flags.
+    Receivers select the serializer by marker, so members using different serializers interoperate:
+    msgpack encoded elements can always be decoded, pickled elements if pickle is allowed (see below),
+    struct encoded elements need a receiver configured with the same StructSerializer.
+    Elements of at least compress_threshold bytes are compressed with zlib.
+    Unpickling data of other members runs arbitrary code, so pickle is only used if allowed: by default
+    only if pickle is the configured serializer. Then messages the configured serializer can't represent
+    are pickled instead, and plain pickles (as sent by earlier channel versions) are recognized by their
+    protocol byte. Otherwise pickled elements are refused on decoding (ValueError).
+    Optionally, the time of serialization (i.e. the enqueue time) is stamped into every element
+    right after the marker byte (see timestamp).
+    Marker, stamp and the buffers of the serializer (see Serializer.encode_parts) are joined once,
+    so out-of-band buffers of large messages are copied exactly once, into the element.
+    """
+
+    COMPRESSED: int = 0x10
+    TIMESTAMPED: int = 0x20
+    PICKLE_PROTOCOL: int = 0x80
+    __stamp = struct.Struct('!d')
+
+    def __init__(self, serializer: Serializer = None, compress_threshold: int = None, compress_level: int = 1,
+                 timestamps: bool = False, allow_pickle: bool = None):
+        self.serializer: Serializer = serializer or PickleSerializer()
+        if allow_pickle is None:
+            allow_pickle = isinstance(self.serializer, PickleSerializer)
+        self.allow_pickle: bool = allow_pickle
+        self.fallback: Serializer = PickleSerializer() if allow_pickle else None
+        self.compress_threshold = compress_threshold
+        self.compress_level: int = compress_level
+        self.timestamps: bool = timestamps
+        # serializers available for decoding by codec id
+        self.__decoders: dict = {self.serializer.codec_id: self.serializer}
+        if allow_pickle:
+            self.__decoders[self.fallback.codec_id] = self.fallback
+        elif isinstance(self.serializer, PickleSerializer):
+            raise ValueError('pickle serializer requires allow_pickle')
+        if msgpack is not None and MsgpackSerializer.codec_id not in self.__decoders:
+            self.__decoders[MsgpackSerializer.codec_id] = MsgpackSerializer()
+
+    def dumps(self, message: object) -> bytes:
+        """
+        Serialize a message and prepend the marker byte.
+        :param message: message object
+        :return: channel element
+        """
+        serializer: Serializer = self.serializer
+        try:
+            parts: list = serializer.encode_parts(message)
+        except ValueError:
+            if self.fallback is None:
+                raise
+            serializer = self.fallback
+            parts = serializer.encode_parts(message)
+        marker: int = serializer.codec_id
+        if self.compress_threshold is not None \
+                and sum(memoryview(part).nbytes for part in parts) >= self.compress_threshold:
+            compressor = zlib.compressobj(self.compress_level)
+            parts = [compressor.compress(part) for part in parts] + [compressor.flush()]
+            marker |= self.COMPRESSED
+        if self.timestamps:
+            marker |= self.TIMESTAMPED
+            return b''.join([bytes([marker]), self.__stamp.pack(time.time())] + parts)
+        return b''.join([bytes([marker])] + parts)
+
+    def timestamp(self, data: bytes):
+        """
+        Read the enqueue time of a channel element (without deserializing it).
+        :param data: channel element
+        :return: time in seconds since the epoch or None if the element is not stamped
+        """
+        if data[0] == self.PICKLE_PROTOCOL or not data[0] & self.TIMESTAMPED:
+            return None
+        return self.__stamp.unpack_from(data, 1)[0]
+
+    def restamp(self, data: bytes) -> bytes:
+        """
+        Replace the enqueue time of a stamped channel element by the current time.
+        :param data: channel element
+        :return: channel element (unchanged if it is not stamped)
+        """
+        if self.timestamp(data) is None:
+            return data
+        return b''.join((data[:1], self.__stamp.pack(time.time()), memoryview(data)[1 + self.__stamp.size:]))
+
+    def loads(self, data: bytes) -> object:
+        """
+        Deserialize a channel element.
+        Raises ValueError for pickled elements if pickle is not allowed.
+        :param data: channel element
+        :return: message object
+        """
+        marker: int = data[0]
+        if marker == self.PICKLE_PROTOCOL:
+            if not self.allow_pickle:
+                raise ValueError('pickled element refused')
+            return pickle.loads(data)
+        codec_id: int = marker & 0x0F
+        if codec_id == PickleSerializer.codec_id and not self.allow_pickle:
+            raise ValueError('pickled element refused')
+        assert codec_id in self.__decoders, 'unknown codec {}'.format(codec_id)
+        view = memoryview(data)[1:]
+        if marker & self.TIMESTAMPED:
+            view = view[self.__stamp.size:]
+        if marker & self.COMPRESSED:
+            view = memoryview(zlib.decompress(view))
+        return self.__decoders[codec_id].decode(view)
@@ -0,0 +1,122 @@
+"""
+Compact binary traces of channel traffic (see lab_channel.Channel, record) and their reader.
+
+A trace file starts with MAGIC followed by records. Every record has a fixed header
+(kind, flags, time, serialized size) followed by the sender id and the list of targets:
+
+    SEND       sender -> receivers
+    BROADCAST  sender -> [subgroup] (empty: all members), flags: EXCLUDE_SELF
+    RECEIVE    sender -> [receiver], taken off the receiver's queue
+    JOIN       member -> [subgroup]
+    LEAVE      member -> [subgroup]
+
+Ids are stored as utf-8 strings with a 16 bit length prefix (longer ids are truncated). Traces of several
+processes can be merged by time (see read_traces), e.g. for replaying them with lib/channel_replay.py.
+"""
+
+import collections
+import heapq
+import struct
+import threading
+
+MAGIC = b'VS2TRACE\x02'
+
+SEND, BROADCAST, RECEIVE, JOIN, LEAVE = range(5)
+KINDS = ('send', 'broadcast', 'receive', 'join', 'leave')
+
+# flags of BROADCAST records
+EXCLUDE_SELF = 0x01
+
+# kind, flags, time (seconds since the epoch), serialized size (bytes)
+_HEADER = struct.Struct('!BBdI')
+# length of ids and number of targets
+_LENGTH = struct.Struct('!H')
+
+TraceRecord = collections.namedtuple('TraceRecord', 'kind flags time size sender targets')
+
+
+def _pack_id(value: str) -> bytes:
+    data: bytes = value.encode()
+    if len(data) > 0xFFFF:
+        # cut at a character boundary
+        data = data[:0xFFFF].decode(errors='ignore').encode()
+    return _LENGTH.pack(len(data)) + data
+
+
+class TraceWriter:
+    """
+    Appends trace records to a file. Records are buffered, so the writer has to be closed.
+    Writers can be shared by all threads of a process.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.__file = open(path, 'wb')
+        self.__file.write(MAGIC)
+        self.__lock = threading.Lock()
+
+    def record(self, kind: int, time: float, sender: str, targets, size: int = 0, flags: int = 0) -> None:
+        """
+        Append a record.
+        :param kind: record kind (SEND, BROADCAST, ...)
+        :param time: time of the event (time.time)
+        :param sender: sender (or member) id
+        :param targets: receiver ids or subgroup
+        :param size: size of the serialized message in bytes
+        :param flags: record flags
+        :return: None
+        """
+        targets = list(targets)
+        data: bytes = _HEADER.pack(kind, flags, time, size) + _pack_id(sender) \
+            + _LENGTH.pack(len(targets)) + b''.join(_pack_id(target) for target in targets)
+        with self.__lock:
+            self.__file.write(data)
+
+    def close(self) -> None:
+        """
+        Flush all buffered records and close the file.
+        :return: None
+        """
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.close()
+
+
+def read_trace(path: str):
+    """
+    Read the records of a trace file.
+    :param path: trace file
+    :return: generator of TraceRecord tuples in order of writing
+    """
+    with open(path, 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC, 'not a channel trace'
+
+        def read_id() -> str:
+            n: int = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+            data: bytes = f.read(n)
+            if len(data) < n:
+                raise EOFError
+            return data.decode()
+
+        while True:
+            header: bytes = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return  # end of file (or header cut off by a crash)
+            kind, flags, time, size = _HEADER.unpack(header)
+            try:
+                sender: str = read_id()
+                n_targets: int = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+                targets: list = [read_id() for _ in range(n_targets)]
+            except (struct.error, EOFError):
+                return  # record cut off
+            yield TraceRecord(kind, flags, time, size, sender, targets)
+
+
+def read_traces(paths: list) -> list:
+    """
+    Read and merge the records of several trace files (e.g. one per process) by time.
+    :param paths: trace files
+    :return: list of TraceRecord tuples ordered by time
+    """
+    return list(heapq.merge(*(sorted(read_trace(path), key=lambda r: r.time) for path in paths),
+                            key=lambda r: r.time))
@@ -0,0 +1,1106 @@
+"""
+Channel unit tests
+
+Most tests run against a local broker (see lab_broker) and need no redis server.
+Stream mode requires redis, its tests are skipped if no server is running on localhost:6379.
+Run from the repository root:
+
+    python -m pytest lib
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import redis
+
+from lib import channel_replay, channel_top, lab_broker, lab_channel, lab_logging, lab_serializer, lab_trace
+
+BROKER_PORT = 6399  # port of the local broker started for these tests
+_broker = None
+
+
+def setUpModule():
+    global _broker
+    _broker = lab_broker.start(port_no=BROKER_PORT)
+
+
+def tearDownModule():
+    _broker.shutdown()
+
+
+def local_channel(**options) -> lab_channel.Channel:
+    """ Channel of the local test broker """
+    return lab_channel.Channel(n_bits=16, backend='local', port_no=BROKER_PORT, **options)
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    """ Poll a condition until it holds or timeout seconds have passed """
+    deadline: float = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestBroker(unittest.TestCase):
+    """Blocking pops and expiry of the broker data store (in process)"""
+
+    def setUp(self):
+        self.broker = lab_broker.Broker()
+
+    def test_blpop(self):
+        """Blocked pops return the element pushed to their key, pushes to other keys leave them waiting"""
+        results: dict = {}
+        waiters: list = [threading.Thread(target=lambda k=k: results.update({k: self.broker.blpop([k], 2)}))
+                         for k in ('a', 'b')]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.1)
+        self.broker.execute([('rpush', ('a', 'x'))])
+        waiters[0].join()
+        self.assertEqual(results, {'a': (b'a', b'x')})
+        self.broker.execute([('rpush', ('b', 'y'))])
+        waiters[1].join()
+        self.assertEqual(results['b'], (b'b', b'y'))
+        self.assertEqual(self.broker.waiters, {})
+
+    def test_expire(self):
+        """Keys expire at their latest deadline"""
+        self.broker.execute([('rpush', ('k', 'x')), ('pexpire', ('k', 50)), ('pexpire', ('k', 300))])
+        time.sleep(0.1)
+        self.assertEqual(self.broker.execute([('exists', ('k',))]), [1])
+        time.sleep(0.3)
+        self.assertEqual(self.broker.execute([('exists', ('k',))]), [0])
+        self.assertEqual(self.broker.deadlines, [])
+
+    def test_scan(self):
+        """Scans page through the matching keys, keys removed meanwhile do not make others be skipped"""
+        keys: list = ['q{}'.format(i) for i in range(25)]
+        self.broker.execute([('rpush', (key, 'x')) for key in keys] + [('rpush', ('other', 'x'))])
+        seen: list = []
+        cursor = 0
+        while True:
+            cursor, page = self.broker.execute([('scan', (cursor, 'q*', 10))])[0]
+            self.assertLessEqual(len(page), 10)
+            seen += [key.decode() for key in page]
+            self.broker.execute([('delete', tuple(page))])  # e.g. a sweep
+            if cursor == 0:
+                break
+        self.assertEqual(sorted(seen), sorted(keys))
+
+    def test_no_pubsub(self):
+        """Membership caches need pub/sub, which the local broker does not offer"""
+        client = lab_broker.LocalRedis(self.broker)
+        self.assertFalse(hasattr(client, 'pubsub'))
+        with self.assertRaises(AssertionError):
+            local_channel(cache_members=True)
+
+
+class TestMembership(unittest.TestCase):
+    """Join, leave, send and receive between members of one process (queue mode 'pair')"""
+    queue_mode = 'pair'
+
+    def setUp(self):
+        self.chan = local_channel(queue_mode=self.queue_mode)
+        self.a = self.chan.member(self.chan.join('client'))
+        self.b = self.chan.member(self.chan.join('server'))
+
+    def tearDown(self):
+        for member, subgroup in ((self.a, 'client'), (self.b, 'server')):
+            if self.chan.exists(member.pid):
+                member.leave(subgroup)
+        self.chan.close()
+
+    def test_join(self):
+        """Joined members are known and listed in their subgroup"""
+        self.assertNotEqual(self.a.pid, self.b.pid)
+        self.assertTrue(self.chan.exists(self.a.pid))
+        self.assertIn(self.a.pid, self.chan.subgroup('client'))
+        self.assertIn(self.b.pid, self.chan.subgroup('server'))
+        self.assertNotIn(self.b.pid, self.chan.subgroup('client'))
+
+    def test_leave(self):
+        """Departed members can neither send nor receive messages"""
+        self.b.leave('server')
+        self.assertFalse(self.chan.exists(self.b.pid))
+        self.assertNotIn(self.b.pid, self.chan.subgroup('server'))
+        with self.assertRaises(AssertionError):
+            self.a.send_to({self.b.pid}, 'lost')
+        with self.assertRaises(AssertionError):
+            self.b.send_to({self.a.pid}, 'lost')
+
+    def test_queues(self):
+        """Queues of members are registered on join and unregistered on leave"""
+        a, b = self.a.pid, self.b.pid
+        if self.queue_mode == 'pair':
+            mine: set = {(a, b), (b, a)}
+            self.assertLessEqual(mine, self.chan.queues(a))
+            self.assertLessEqual(mine, self.chan.queues(b))
+        else:
+            mine = {(None, b)}
+            self.assertEqual(self.chan.queues(b), mine)
+        self.assertLessEqual(mine, self.chan.queues())
+        self.b.leave('server')
+        self.assertEqual(self.chan.queues(b), set())
+        self.assertFalse(any(b in queue for queue in self.chan.queues(a)))
+        self.assertFalse(any(b in queue for queue in self.chan.queues()))
+
+    def test_send_receive(self):
+        """Messages of one sender arrive in order"""
+        for i in range(3):
+            self.a.send_to({self.b.pid}, ('request', i))
+        self.assertEqual(self.b.receive_from({self.a.pid}, 1), (self.a.pid, ('request', 0)))
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, ('request', 1)))
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, ('request', 2))])
+
+    def test_receive_from(self):
+        """receive_from only takes messages of the given senders, the others stay queued"""
+        c = self.chan.member(self.chan.join('client'))
+        self.a.send_to({self.b.pid}, 'from a')
+        c.send_to({self.b.pid}, 'from c')
+        self.assertEqual(self.b.receive_from({c.pid}, 1), (c.pid, 'from c'))
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'from a'))
+        c.leave('client')
+
+    def test_receive_many(self):
+        """Batch receives take messages of the given senders in order, the others (stashed in inboxes) stay"""
+        c = self.chan.member(self.chan.join('client'))
+        self.a.send_many([({self.b.pid}, 'a1'), ({self.b.pid}, 'a2')])
+        c.send_to({self.b.pid}, 'c1')
+        self.assertEqual(self.b.receive_from({c.pid}, 1), (c.pid, 'c1'))
+        self.assertEqual(self.b.receive_many(1, 1), [(self.a.pid, 'a1')])
+        self.a.send_to({self.b.pid}, 'a3')
+        c.send_many([({self.b.pid}, 'c2'), ({self.b.pid}, 'c3')])
+        self.assertEqual(self.b.receive_from_many({c.pid}, 10, 1), [(c.pid, 'c2'), (c.pid, 'c3')])
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, 'a2'), (self.a.pid, 'a3')])
+        c.leave('client')
+
+    def test_receive_timeout(self):
+        """Receives return None (batch receives an empty list) if no message arrives in time"""
+        self.assertIsNone(self.b.receive_from_any(1))
+        self.assertIsNone(self.b.receive_from({self.a.pid}, 1))
+        self.assertEqual(self.b.receive_many(10, 1), [])
+
+    def test_blocking_receive(self):
+        """A blocked receive returns as soon as the message is sent"""
+        received: list = []
+        receiver = threading.Thread(target=lambda: received.append(self.b.receive_from_any(5)))
+        receiver.start()
+        time.sleep(0.2)
+        self.a.send_to({self.b.pid}, 'wake up')
+        receiver.join()
+        self.assertEqual(received, [(self.a.pid, 'wake up')])
+
+    def test_unknown_receiver(self):
+        """Sends to unknown members are refused, and no copy is delivered to the others"""
+        with self.assertRaises(AssertionError):
+            self.a.send_to({self.b.pid, 'nobody'}, 'lost')
+        self.assertIsNone(self.b.receive_from_any(1))
+
+    def test_send_to_all(self):
+        """Broadcasts reach all members (of a subgroup), optionally excluding the sender"""
+        self.a.send_to_all('to all')
+        self.a.send_to_all('to servers', subgroup='server')
+        self.a.send_to_all('to others', exclude_self=True)
+        self.assertEqual(self.b.receive_many(10, 1),
+                         [(self.a.pid, 'to all'), (self.a.pid, 'to servers'), (self.a.pid, 'to others')])
+        self.assertEqual(self.a.receive_many(10, 1), [(self.a.pid, 'to all')])
+
+
+    def test_receive_lookups(self):
+        """Receives look up only the ids involved, not the whole member set (except for any sender in pair mode)"""
+        self.a.send_to({self.b.pid}, 1)
+        self.a.send_to({self.b.pid}, 2)
+        with mock.patch.object(self.chan.channel, 'smembers', side_effect=AssertionError('SMEMBERS')):
+            self.assertEqual(self.b.receive_from({self.a.pid}, 1), (self.a.pid, 1))
+            self.assertEqual(self.b.receive_from_many({self.a.pid}, 5, 1), [(self.a.pid, 2)])
+            with self.assertRaises(AssertionError):
+                self.b.receive_from({'unknown'}, 1)
+            if self.queue_mode != 'pair':
+                self.a.send_to({self.b.pid}, 3)
+                self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 3))
+                self.assertEqual(self.b.receive_many(5, 0.1), [])
+
+
+class TestInboxMembership(TestMembership):
+    """The same semantics in queue mode 'inbox'"""
+    queue_mode = 'inbox'
+
+
+class TestJoin(unittest.TestCase):
+    """Member id allocation in a small id space (on a broker of its own)"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.broker = lab_broker.start(port_no=BROKER_PORT + 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.broker.shutdown()
+
+    def test_allocate_all(self):
+        """All ids of the space are handed out once, then joins fail until a member leaves"""
+        chan = lab_channel.Channel(n_bits=2, backend='local', port_no=BROKER_PORT + 1)
+        pids: list = [chan.join('ids') for _ in range(4)]
+        self.assertEqual(sorted(pids), ['0', '1', '2', '3'])
+        with self.assertRaises(RuntimeError):
+            chan.join('ids')
+        chan.member(pids[2]).leave('ids')
+        self.assertEqual(chan.join('ids'), pids[2])
+        for pid in pids:
+            chan.member(pid).leave('ids')
+        chan.close()
+
+
+class TestShards(unittest.TestCase):
+    """Queues spread over the test broker and a second broker"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.broker = lab_broker.start(port_no=BROKER_PORT + 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.broker.shutdown()
+
+    def setUp(self):
+        self.chan = local_channel(shards=[('localhost', BROKER_PORT + 2)], capacity=1, overflow='reject')
+        self.servers: list = [self.chan.channel, lab_broker.connect(port_no=BROKER_PORT + 2)]
+        self.a = self.chan.member(self.chan.join('shards'))
+        # receivers by shard, two per shard
+        self.receivers: dict = {0: [], 1: []}
+        self.members: list = [self.a]
+        while min(len(r) for r in self.receivers.values()) < 2:
+            member = self.chan.member(self.chan.join('shards'))
+            self.members.append(member)
+            shard: list = self.receivers[lab_channel._shard_index(member.pid, 2)]
+            if len(shard) < 2:
+                shard.append(member)
+
+    def tearDown(self):
+        for member in self.members:
+            member.receive_many(10, 0.1)
+            member.leave('shards')
+        self.chan.close()
+
+    def depth(self, receiver) -> list:
+        """ depth of the queue from a to receiver on each server """
+        return [server.llen(lab_channel._queue_key(self.a.pid, receiver.pid)) for server in self.servers]
+
+    def test_placement(self):
+        """Queues live on the shard selected by their receiver and are received from there"""
+        for shard, receivers in self.receivers.items():
+            for receiver in receivers:
+                self.a.send_to({receiver.pid}, shard)
+                self.assertEqual(self.depth(receiver), [1 - shard, shard])
+                self.assertEqual(receiver.receive_from_any(1), (self.a.pid, shard))
+
+    def test_queue_depths(self):
+        """Queue depths are read from the shard holding each queue"""
+        for shard, receivers in self.receivers.items():
+            self.a.send_to({receivers[0].pid}, shard)
+        depths: dict = dict(self.chan.queue_depths())
+        for receivers in self.receivers.values():
+            self.assertEqual(depths[(self.a.pid, receivers[0].pid)], 1)
+            self.assertEqual(depths[(self.a.pid, receivers[1].pid)], 0)
+
+    def test_unknown_receiver(self):
+        """Members are validated before any shard is pushed to"""
+        with self.assertRaises(AssertionError):
+            self.a.send_to([self.receivers[0][0].pid, self.receivers[1][0].pid, 'nobody'], 'lost')
+        self.assertEqual(self.depth(self.receivers[0][0]) + self.depth(self.receivers[1][0]), [0, 0, 0, 0])
+
+    def test_all_or_none_per_shard(self):
+        """A full queue fails the copies on its shard only, copies on shards pushed before are delivered"""
+        (r0, _), (r1, r1_full) = self.receivers[0], self.receivers[1]
+        self.a.send_to({r1_full.pid}, 'first')
+        with self.assertRaises(lab_channel.QueueFull):
+            self.a.send_to([r0.pid, r1.pid, r1_full.pid], 'second')  # shard 0 is pushed first
+        self.assertEqual(self.depth(r0), [1, 0])
+        self.assertEqual(self.depth(r1), [0, 0])
+        self.assertEqual(self.depth(r1_full), [0, 1])
+
+
+class TestCoalesce(unittest.TestCase):
+    """Buffered sends pushed by flush, receives, size threshold or timer"""
+
+    def setUp(self):
+        self.plain = local_channel()
+        self.a = self.plain.member(self.plain.join('coalesce'))
+        self.b = self.plain.member(self.plain.join('coalesce'))
+
+    def tearDown(self):
+        self.a.leave('coalesce')
+        self.b.leave('coalesce')
+        self.plain.close()
+
+    def sender(self, **options) -> lab_channel.Member:
+        self.chan = local_channel(**options)
+        self.addCleanup(self.chan.close)
+        return self.chan.member(self.a.pid)
+
+    def test_flush_before_receive(self):
+        """Buffered requests are pushed before the sender waits for the reply, in order"""
+        a = self.sender(coalesce=10)
+        a.send_to({self.b.pid}, 1)
+        a.send_many([({self.b.pid}, 2), ({self.b.pid}, 3)])
+        self.assertEqual(self.b.receive_many(10, 0.1), [])
+        self.assertIsNone(a.receive_from_any(0.1))
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, 1), (self.a.pid, 2), (self.a.pid, 3)])
+
+    def test_size(self):
+        """Buffers are pushed as soon as they reach coalesce_bytes"""
+        a = self.sender(coalesce=10, coalesce_bytes=100)
+        a.send_to({self.b.pid}, b'x' * 100)
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, b'x' * 100))
+
+    def test_timer(self):
+        """Buffers are pushed by the timer after coalesce seconds"""
+        a = self.sender(coalesce=0.2)
+        a.send_to({self.b.pid}, 'late')
+        self.assertEqual(self.b.receive_many(10, 0.05), [])
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'late'))
+
+    def test_timer_redis_error(self):
+        """Batches failing on redis errors in the timer are logged and retried"""
+        a = self.sender(coalesce=0.1)
+        push = self.chan._Channel__push
+        failures: list = [redis.ConnectionError('reset')]
+
+        def flaky_push(*args):
+            if failures:
+                raise failures.pop()
+            return push(*args)
+        with mock.patch.object(self.chan, '_Channel__push', side_effect=flaky_push):
+            with self.assertLogs('vs2lab.channel.Channel', 'ERROR') as logs:
+                a.send_to({self.b.pid}, 'retried')
+                wait_until(lambda: logs.records)
+            self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'retried'))
+
+    def test_timer_unknown_receiver(self):
+        """Batches failing validation in the timer are logged and dropped"""
+        a = self.sender(coalesce=0.1)
+        with self.assertLogs('vs2lab.channel.Channel', 'ERROR') as logs:
+            a.send_to({'nobody'}, 'lost')
+            wait_until(lambda: logs.records)
+        a.send_to({self.b.pid}, 'next')
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'next'))
+
+
+class TestThreads(unittest.TestCase):
+    """Thread bindings and member endpoints shared by several threads"""
+    queue_mode = 'inbox'
+
+    def setUp(self):
+        self.chan = local_channel(queue_mode=self.queue_mode)
+        self.a = self.chan.member(self.chan.join('threads'))
+        self.b = self.chan.member(self.chan.join('threads'))
+        self.c = self.chan.member(self.chan.join('threads'))
+
+    def tearDown(self):
+        for member in (self.a, self.b, self.c):
+            member.leave('threads')
+        self.chan.close()
+
+    def test_bind(self):
+        """Thread bindings take precedence over the process binding, as_member restores the previous one"""
+        self.chan.bind(self.a.pid)
+        self.addCleanup(self.chan.os_members.clear)
+
+        def worker():
+            self.chan.bind(self.b.pid, thread=True)
+            self.chan.send_to({self.c.pid}, 'from b')
+            with self.chan.as_member(self.c.pid):
+                self.chan.send_to({self.a.pid}, 'from c')
+            self.chan.send_to({self.c.pid}, 'from b again')
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.chan.send_to({self.c.pid}, 'from a')
+        self.assertEqual(self.c.receive_many(10, 1),
+                         [(self.b.pid, 'from b'), (self.b.pid, 'from b again'), (self.a.pid, 'from a')])
+        self.assertEqual(self.chan.receive_from_any(1), (self.c.pid, 'from c'))
+
+    def test_blocked_endpoint(self):
+        """A receive blocked in one thread holds up neither sends nor receives of other threads"""
+        received: list = []
+        blocked = threading.Thread(target=lambda: received.append(self.b.receive_from({self.c.pid}, 5)))
+        blocked.start()
+        time.sleep(0.1)
+        start: float = time.time()
+        self.assertIsNone(self.b.receive_from_any(0.2))
+        self.assertLess(time.time() - start, 1)
+        self.b.send_to({self.a.pid}, 'sent meanwhile')
+        self.assertEqual(self.a.receive_from_any(1), (self.b.pid, 'sent meanwhile'))
+        self.c.send_to({self.b.pid}, 'wake up')
+        blocked.join()
+        self.assertEqual(received, [(self.c.pid, 'wake up')])
+
+    def test_stashed_by_other_thread(self):
+        """Messages stashed by one thread are delivered to another thread waiting for their sender"""
+        results: dict = {}
+        started = threading.Barrier(3)
+
+        def receive(sender: lab_channel.Member):
+            started.wait()
+            results[sender.pid] = self.b.receive_from({sender.pid}, 5)
+        workers: list = [threading.Thread(target=receive, args=(s,)) for s in (self.a, self.c)]
+        for worker in workers:
+            worker.start()
+        started.wait()
+        self.c.send_to({self.b.pid}, 'from c')
+        self.a.send_to({self.b.pid}, 'from a')
+        for worker in workers:
+            worker.join()
+        self.assertEqual(results, {self.a.pid: (self.a.pid, 'from a'), self.c.pid: (self.c.pid, 'from c')})
+
+    def test_handover(self):
+        """A thread waiting while another thread reads gets its message as soon as the reader takes it off"""
+        received: list = []
+        reader = threading.Thread(target=lambda: received.append(self.b.receive_from({self.a.pid}, 5)))
+        reader.start()
+        self.assertTrue(wait_until(lambda: self.b.pid in self.chan._Channel__reading))
+        sender = threading.Timer(0.1, self.c.send_to, args=({self.b.pid}, 'from c'))
+        sender.start()
+        start: float = time.time()
+        self.assertEqual(self.b.receive_from({self.c.pid}, 5), (self.c.pid, 'from c'))
+        self.assertLess(time.time() - start, 2)
+        self.a.send_to({self.b.pid}, 'from a')
+        reader.join()
+        sender.join()
+        self.assertEqual(received, [(self.a.pid, 'from a')])
+
+
+class TestSweep(unittest.TestCase):
+    """Queue expiry and reclaiming queues of departed members"""
+    queue_mode = 'pair'
+
+    def setUp(self):
+        self.chan = local_channel(queue_mode=self.queue_mode)
+        self.chan.sweep()  # reclaim queues left over by other tests
+        self.a = self.chan.member(self.chan.join('sweep'))
+        self.b = self.chan.member(self.chan.join('sweep'))
+
+    def tearDown(self):
+        for member in (self.a, self.b):
+            if self.chan.exists(member.pid):
+                member.leave('sweep')
+        self.chan.close()
+
+    def crash(self, member) -> None:
+        """ remove a member without leaving (like a crashed process) """
+        self.chan.channel.srem('members', member.pid)
+
+    def key(self, sender, receiver) -> str:
+        return lab_channel._inbox_key(receiver.pid) if self.queue_mode == 'inbox' \
+            else lab_channel._queue_key(sender.pid, receiver.pid)
+
+    def test_ttl(self):
+        """Queues expire ttl seconds after the last push"""
+        chan = local_channel(queue_mode=self.queue_mode, ttl=0.2)
+        a = chan.member(self.a.pid)
+        a.send_to({self.b.pid}, 1)
+        time.sleep(0.1)
+        a.send_to({self.b.pid}, 2)
+        time.sleep(0.15)
+        self.assertEqual(a.pending(self.b.pid), 2)
+        time.sleep(0.1)
+        self.assertEqual(a.pending(self.b.pid), 0)
+        chan.close()
+
+    def test_departed_receiver(self):
+        """Queues to departed receivers are reclaimed"""
+        self.a.send_to({self.b.pid}, 'lost')
+        self.crash(self.b)
+        self.assertEqual(self.chan.sweep()['queues'], 1)
+        self.assertEqual(self.chan.channel.exists(self.key(self.a, self.b)), 0)
+        self.assertEqual(self.chan.sweep_stats()['sweeps'], 2)
+
+    def test_departed_sender(self):
+        """Messages of departed senders stay queued for live receivers"""
+        self.b.send_to({self.a.pid}, 'last words')
+        self.b.leave('sweep')
+        self.chan.sweep()
+        self.assertEqual(self.chan.channel.exists(self.key(self.b, self.a)), 1)
+        if self.queue_mode == 'inbox':
+            self.assertEqual(self.a.receive_from_any(1), (self.b.pid, 'last words'))
+
+    def test_unrelated_keys(self):
+        """Keys not formed like queue keys are left alone"""
+        keys: list = ['[not a queue', "['x', 'y'] copy", 'inbox:config']
+        for key in keys:
+            self.chan.channel.rpush(key, 'data')
+        self.chan.sweep()
+        self.assertEqual(self.chan.channel.exists(*keys), len(keys))
+        self.chan.channel.delete(*keys)
+
+
+class TestInboxSweep(TestSweep):
+    """The same in queue mode 'inbox'"""
+    queue_mode = 'inbox'
+
+
+class TestMetrics(unittest.TestCase):
+    """Channel counters, latency histograms and queue depths"""
+
+    def setUp(self):
+        self.chan = local_channel(metrics=True)
+        self.a = self.chan.member(self.chan.join('metrics'))
+        self.b = self.chan.member(self.chan.join('metrics'))
+
+    def tearDown(self):
+        self.a.leave('metrics')
+        self.b.leave('metrics')
+        self.chan.close()
+
+    def test_counters(self):
+        """Sent and received messages and bytes are counted, every received message has its latencies"""
+        size: int = len(self.chan.codec.dumps('payload'))
+        self.a.send_to({self.b.pid}, 'payload')
+        self.a.send_to_all('payload', exclude_self=True)
+        self.assertEqual(len(self.b.receive_many(10, 1)), 2)
+        metrics: dict = self.chan.metrics()
+        self.assertEqual((metrics[self.a.pid]['sent'], metrics[self.a.pid]['sent_bytes']), (2, 2 * size))
+        self.assertEqual((metrics[self.b.pid]['received'], metrics[self.b.pid]['received_bytes']), (2, 2 * size))
+        for histogram in ('queue_wait', 'end_to_end'):
+            self.assertEqual(metrics[self.b.pid][histogram]['count'], 2)
+            self.assertLess(metrics[self.b.pid][histogram]['max'], 1)
+
+    def test_coalesced(self):
+        """Time spent in the sender's coalescing buffer does not count as queue wait"""
+        chan = local_channel(metrics=True, coalesce=10)
+        a = chan.member(self.a.pid)
+        a.send_to({self.b.pid}, 'buffered')
+        time.sleep(0.3)
+        a.flush()
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'buffered'))
+        self.assertLess(self.chan.metrics()[self.b.pid]['queue_wait']['max'], 0.3)
+        chan.close()
+
+    def test_queue_depths(self):
+        """channel_top lists the depth of every registered queue, deepest first"""
+        self.a.send_many([({self.b.pid}, 1), ({self.b.pid}, 2)])
+        self.b.send_to({self.a.pid}, 3)
+        queues: list = self.chan.queue_depths()
+        self.assertIn(((self.a.pid, self.b.pid), 2), queues)
+        self.assertIn(((self.b.pid, self.a.pid), 1), queues)
+        self.assertEqual([depth for _, depth in queues], sorted((depth for _, depth in queues), reverse=True))
+        self.assertIn(self.b.pid, channel_top.render(queues, 10))
+        self.b.receive_many(10, 1)
+        self.a.receive_many(10, 1)
+
+
+class TestOverflow(unittest.TestCase):
+    """Overflow policies of bounded queues"""
+
+    def channel(self, overflow: str, **options) -> lab_channel.Channel:
+        chan = local_channel(capacity=2, overflow=overflow, **options)
+        self.a = chan.member(chan.join('overflow'))
+        self.b = chan.member(chan.join('overflow'))
+        return chan
+
+    def tearDown(self):
+        self.a.leave('overflow')
+        self.b.leave('overflow')
+
+    def test_reject(self):
+        """Sends to a full queue raise QueueFull at once and leave the queue unchanged"""
+        self.channel('reject')
+        self.a.send_to({self.b.pid}, 1)
+        self.a.send_to({self.b.pid}, 2)
+        with self.assertRaises(lab_channel.QueueFull):
+            self.a.send_to({self.b.pid}, 3)
+        self.assertEqual(self.a.pending(self.b.pid), 2)
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, 1), (self.a.pid, 2)])
+
+    def test_drop_oldest(self):
+        """Sends to a full queue discard its oldest messages"""
+        self.channel('drop_oldest')
+        for i in range(1, 5):
+            self.a.send_to({self.b.pid}, i)
+        self.assertEqual(self.a.pending(self.b.pid), 2)
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, 3), (self.a.pid, 4)])
+
+    def test_block_timeout(self):
+        """Blocked sends raise QueueFull after block_timeout"""
+        self.channel('block', block_timeout=0.2)
+        self.a.send_to({self.b.pid}, 1)
+        self.a.send_to({self.b.pid}, 2)
+        start: float = time.time()
+        with self.assertRaises(lab_channel.QueueFull):
+            self.a.send_to({self.b.pid}, 3)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_block(self):
+        """Blocked sends complete once the receiver makes room"""
+        self.channel('block', block_timeout=5)
+        self.a.send_to({self.b.pid}, 1)
+        self.a.send_to({self.b.pid}, 2)
+        receiver = threading.Timer(0.2, self.b.receive_from_any)
+        receiver.start()
+        self.a.send_to({self.b.pid}, 3)
+        receiver.join()
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, 2), (self.a.pid, 3)])
+
+
+class RedisTestCase(unittest.TestCase):
+    """Tests of features requiring redis, skipped if no server is running on localhost:6379"""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            redis.StrictRedis().ping()
+        except redis.ConnectionError:
+            raise unittest.SkipTest('no redis server on localhost:6379')
+
+
+class TestMembershipCache(RedisTestCase):
+    """Membership cache invalidated via pub/sub notifications (redis only)"""
+
+    def setUp(self):
+        self.chan = lab_channel.Channel(n_bits=16, cache_members=True)
+        self.other = lab_channel.Channel(n_bits=16)  # channel of another process, without cache
+        self.a = self.chan.member(self.chan.join('cache'))
+        self.b = self.chan.member(self.chan.join('cache'))
+
+    def tearDown(self):
+        for member in (self.a, self.b):
+            if self.chan.exists(member.pid):
+                member.leave('cache')
+        self.chan.close()
+        self.other.close()
+
+    def test_hits(self):
+        """Repeated sends and receives are validated without membership round trips"""
+        self.a.send_to({self.b.pid}, 1)
+        self.assertEqual(self.b.receive_from({self.a.pid}, 1), (self.a.pid, 1))
+        before: dict = self.chan.cache_stats()
+        self.a.send_to({self.b.pid}, 2)
+        self.assertEqual(self.b.receive_from({self.a.pid}, 1), (self.a.pid, 2))
+        after: dict = self.chan.cache_stats()
+        self.assertEqual(after['misses'], before['misses'])
+        self.assertGreater(after['hits'], before['hits'])
+
+    def test_join_elsewhere(self):
+        """Members joined by other processes can be addressed before their notification arrives"""
+        self.chan.subgroup('cache')  # fill the cache
+        self.assertTrue(self.chan.exists(self.a.pid))
+        c: str = self.other.join('cache')
+        self.assertTrue(self.chan.exists(c))
+        self.a.send_to({c}, 'hello')
+        self.assertEqual(self.other.member(c).receive_from_any(1), (self.a.pid, 'hello'))
+        self.assertTrue(wait_until(lambda: c in self.chan.subgroup('cache')))
+        self.other.member(c).leave('cache')
+
+    def test_leave_elsewhere(self):
+        """Members leaving in other processes are dropped from the cache on notification"""
+        c: str = self.other.join('cache')
+        self.assertTrue(wait_until(lambda: self.chan.exists(c)))
+        invalidations: int = self.chan.cache_stats()['invalidations']
+        self.other.member(c).leave('cache')
+        self.assertTrue(wait_until(lambda: self.chan.cache_stats()['invalidations'] > invalidations))
+        self.assertFalse(self.chan.exists(c))
+        with self.assertRaises(AssertionError):
+            self.a.send_to({c}, 'lost')
+
+
+class TestConnectionPools(RedisTestCase):
+    """Connection pools shared by all channels of a process (redis only)"""
+
+    def test_shared(self):
+        """Channels of one server share pools, blocking receives use a pool of their own"""
+        chans: list = [lab_channel.Channel(n_bits=16) for _ in range(2)]
+        self.assertIs(chans[0].channel.connection_pool, chans[1].channel.connection_pool)
+        self.assertIs(chans[0].blocking.connection_pool, chans[1].blocking.connection_pool)
+        self.assertIsNot(chans[0].channel.connection_pool, chans[0].blocking.connection_pool)
+        python_parser = lab_channel.Channel(n_bits=16, hiredis=False)
+        self.assertIsNot(python_parser.channel.connection_pool, chans[0].channel.connection_pool)
+        for chan in chans + [python_parser]:
+            chan.close()
+
+    def test_blocked_receive(self):
+        """A thread blocked in a receive does not hold up sends of other threads"""
+        chan = lab_channel.Channel(n_bits=16)
+        a = chan.member(chan.join('pool'))
+        b = chan.member(chan.join('pool'))
+        received: list = []
+        receiver = threading.Thread(target=lambda: received.append(b.receive_from_any(5)))
+        receiver.start()
+        time.sleep(0.2)
+        start: float = time.time()
+        a.send_to({b.pid}, 'go')
+        self.assertLess(time.time() - start, 1)
+        receiver.join()
+        self.assertEqual(received, [(a.pid, 'go')])
+        a.leave('pool')
+        b.leave('pool')
+        chan.close()
+
+
+class TestStream(RedisTestCase):
+    """Acknowledgement and takeover in queue mode 'stream' (redis only)"""
+
+    def setUp(self):
+        self.chan = lab_channel.Channel(n_bits=16, queue_mode='stream')
+        self.a = self.chan.member(self.chan.join('stream'))
+        self.b = self.chan.member(self.chan.join('stream'))
+        self.c = self.chan.member(self.chan.join('stream'))
+
+    def tearDown(self):
+        for member in (self.a, self.b, self.c):
+            if self.chan.exists(member.pid):
+                member.leave('stream')
+
+    def test_ack(self):
+        """Acknowledged messages are gone, nothing is left to take over"""
+        self.a.send_to({self.b.pid}, 'job')
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'job'))
+        self.assertEqual(self.b.ack(), 1)
+        self.assertEqual(self.b.ack(), 0)
+        self.assertEqual(self.c.takeover(self.b.pid), [])
+
+    def test_ack_while_blocked(self):
+        """Acknowledging does not wait for a receive of the same member blocked in another thread"""
+        self.a.send_to({self.b.pid}, 'job')
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'job'))
+        blocked = threading.Thread(target=self.b.receive_from_any, args=(5,))
+        blocked.start()
+        time.sleep(0.1)
+        start: float = time.time()
+        self.assertEqual(self.b.ack(), 1)
+        self.assertLess(time.time() - start, 1)
+        self.a.send_to({self.b.pid}, 'wake up')
+        blocked.join()
+        self.b.ack()
+
+    def test_sweep(self):
+        """Streams of crashed members are kept until their messages are taken over"""
+        probe = redis.StrictRedis()  # client of its own, servers may drop the connection on unknown commands
+        try:
+            probe.memory_usage('members')
+        except redis.ResponseError:
+            self.skipTest('server does not support MEMORY USAGE')
+        finally:
+            probe.close()
+        self.a.send_to({self.b.pid}, 'pending')
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 'pending'))
+        self.a.send_to({self.b.pid}, 'unread')
+        self.chan.channel.srem('members', self.b.pid)  # b crashes
+        key: str = lab_channel._stream_key(self.b.pid)
+        self.chan.sweep()
+        self.assertEqual(self.chan.channel.exists(key), 1)
+        self.assertEqual(self.c.takeover(self.b.pid), [(self.a.pid, 'pending'), (self.a.pid, 'unread')])
+        self.chan.sweep()
+        self.assertEqual(self.chan.channel.exists(key), 1)  # taken over, but not acknowledged yet
+        self.c.ack()
+        self.chan.sweep()
+        self.assertEqual(self.chan.channel.exists(key), 0)
+
+    def test_rejoin(self):
+        """A member joining with the id of a former member gets a fresh stream"""
+        self.a.send_to({self.b.pid}, 'stale')
+        self.b.leave('stream')
+        with mock.patch.object(lab_channel.random, 'sample', return_value=[int(self.b.pid)]):
+            self.assertEqual(self.chan.join('stream'), self.b.pid)
+        self.a.send_to({self.b.pid}, 'fresh')
+        self.assertEqual(self.b.receive_many(10, 1), [(self.a.pid, 'fresh')])
+
+    def test_join_sharded(self):
+        """Messages sent to a member on another shard while its stream is replaced are kept"""
+        chan = lab_channel.Channel(n_bits=16, queue_mode='stream', shards=[('localhost', 6379)])
+        members: set = self.chan.subgroup('stream') | {self.a.pid, self.b.pid, self.c.pid}
+        pid: str = next(str(i) for i in range(1, 1 << 16)
+                        if lab_channel._shard_index(str(i), 2) == 1 and str(i) not in members)
+        key: str = lab_channel._stream_key(pid)
+        self.chan.channel.xadd(key, {'s': self.a.pid, 'm': self.chan.codec.dumps('stale')})
+        join = chan._Channel__join_script
+
+        def join_and_send(keys: list, args: list):
+            result = join(keys=keys, args=args)
+            self.a.send_to({pid}, 'early')  # sent as soon as the new member is visible
+            return result
+        with mock.patch.object(lab_channel.random, 'sample', return_value=[int(pid)]), \
+                mock.patch.object(chan, '_Channel__join_script', join_and_send):
+            self.assertEqual(chan.join('stream'), pid)
+        member = chan.member(pid)
+        self.assertEqual(member.receive_many(10, 1), [(self.a.pid, 'early')])
+        member.leave('stream')
+        chan.close()
+
+    def test_join_window(self):
+        """Messages sent to a new member right after its id became visible are delivered"""
+        join = self.chan._Channel__join_script
+
+        def join_and_send(keys: list, args: list):
+            result = join(keys=keys, args=args)
+            self.a.send_to({result[0].decode()}, 'early')
+            return result
+        with mock.patch.object(self.chan, '_Channel__join_script', join_and_send):
+            d = self.chan.member(self.chan.join('stream'))
+        self.assertEqual(d.receive_many(10, 1), [(self.a.pid, 'early')])
+        d.leave('stream')
+
+    def test_takeover(self):
+        """Unacknowledged and unread messages of a crashed member are taken over in order"""
+        for i in range(3):
+            self.a.send_to({self.b.pid}, i)
+        self.assertEqual(self.b.receive_from_any(1), (self.a.pid, 0))
+        # b crashes before acknowledging message 0
+        self.assertEqual(self.c.takeover(self.b.pid), [(self.a.pid, 0), (self.a.pid, 1), (self.a.pid, 2)])
+        self.assertEqual(self.c.ack(), 3)
+        self.assertEqual(self.c.takeover(self.b.pid), [])
+
+
+class TestAsyncChannel(RedisTestCase):
+    """asyncio channel with members bound per task (redis only)"""
+
+    def test_tasks(self):
+        """Members of concurrent tasks exchange messages, inbox messages of other senders are stashed"""
+        async def scenario() -> tuple:
+            chan = lab_channel.AsyncChannel(n_bits=16, queue_mode='inbox')
+            server: str = chan.bind(await chan.join('server'))
+            clients: list = [await chan.join('client') for _ in range(3)]
+
+            async def client(pid: str, i: int):
+                chan.bind(pid)
+                await chan.send_to({server}, i)
+                reply = await chan.receive_from({server}, 5)
+                await chan.leave('client')
+                return reply
+
+            tasks: list = [asyncio.create_task(client(pid, i)) for i, pid in enumerate(clients)]
+            requests: list = [await chan.receive_from({clients[2]}, 5)]  # the others are stashed meanwhile
+            requests += [await chan.receive_from_any(5) for _ in range(2)]
+            for sender, i in requests:
+                await chan.send_to({sender}, i * 10)
+            replies: list = await asyncio.gather(*tasks)
+            await chan.leave('server')
+            await chan.close()
+            return server, clients, requests, replies
+
+        server, clients, requests, replies = asyncio.run(scenario())
+        self.assertEqual(requests[0], (clients[2], 2))
+        self.assertEqual(sorted(requests[1:], key=lambda r: r[1]), [(clients[0], 0), (clients[1], 1)])
+        self.assertEqual(replies, [(server, 0), (server, 10), (server, 20)])
+
+    def test_interoperate(self):
+        """Members of a Channel and an AsyncChannel talk to each other"""
+        chan = lab_channel.Channel(n_bits=16, queue_mode='inbox')
+        a = chan.member(chan.join('sync'))
+
+        async def scenario():
+            achan = lab_channel.AsyncChannel(n_bits=16, queue_mode='inbox')
+            achan.bind(await achan.join('async'))
+            await achan.send_to({a.pid}, 'ping')
+            reply = await achan.receive_from({a.pid}, 5)
+            await achan.leave('async')
+            await achan.close()
+            return reply
+
+        receiver = threading.Thread(target=lambda: a.send_to({a.receive_from_any(5)[0]}, 'pong'))
+        receiver.start()
+        reply = asyncio.run(scenario())
+        receiver.join()
+        self.assertEqual(reply, (a.pid, 'pong'))
+        a.leave('sync')
+        chan.close()
+
+
+class TestCodec(unittest.TestCase):
+    """Message serialization (see lab_serializer)"""
+    message = ('update', 42, 3.5, 'Jürgen', [1, 2, 3], {'key': b'value'})
+
+    def test_pickle(self):
+        """Pickled messages round-trip unchanged, with compression and timestamps"""
+        codec = lab_serializer.Codec(compress_threshold=16, timestamps=True)
+        data: bytes = codec.dumps(self.message)
+        self.assertTrue(data[0] & codec.COMPRESSED)
+        self.assertAlmostEqual(codec.timestamp(data), time.time(), delta=5)
+        self.assertEqual(codec.loads(data), self.message)
+        self.assertEqual(codec.loads(pickle.dumps(self.message)), self.message)  # plain pickle
+
+    def test_out_of_band(self):
+        """Out-of-band pickle buffers round-trip, plain and compressed, with and without timestamps"""
+        payload = bytearray(range(256)) * 64
+        for codec in (lab_serializer.Codec(), lab_serializer.Codec(compress_threshold=16, timestamps=True)):
+            data: bytes = codec.dumps(('blob', pickle.PickleBuffer(payload)))
+            name, blob = codec.loads(data)
+            self.assertEqual((name, bytes(blob)), ('blob', bytes(payload)))
+
+    @unittest.skipIf(lab_serializer.msgpack is None, 'msgpack not installed')
+    def test_msgpack(self):
+        """msgpack encoded messages can be decoded by codecs of any serializer (sequences as tuples)"""
+        codec = lab_serializer.Codec(lab_serializer.MsgpackSerializer())
+        message: tuple = ('update', 42, 3.5, 'Jürgen', {'key': b'value'})
+        data: bytes = codec.dumps(message)
+        self.assertEqual(codec.loads(data), message)
+        self.assertEqual(lab_serializer.Codec().loads(data), message)
+
+    def test_struct(self):
+        """Struct encoded messages round-trip unchanged, lossy messages are refused"""
+        codec = lab_serializer.Codec(lab_serializer.StructSerializer('!qi8s'))
+        self.assertEqual(codec.loads(codec.dumps((7, -1, 'Jürgen'))), (7, -1, 'Jürgen'))
+        for message in ((True, 1, 'x'), (7, 1, 'x\0'), (7, 1, 'too long name'), (7, 1)):
+            with self.assertRaises(ValueError):
+                codec.dumps(message)
+
+    def test_struct_fallback(self):
+        """Codecs allowing pickle pickle messages the struct format can't represent"""
+        codec = lab_serializer.Codec(lab_serializer.StructSerializer('!qi'), allow_pickle=True)
+        self.assertEqual(codec.loads(codec.dumps(self.message)), self.message)
+
+    def test_refuse_pickle(self):
+        """Pickled elements are refused unless pickle is allowed"""
+        codec = lab_serializer.Codec(lab_serializer.StructSerializer('!qi'))
+        for data in (lab_serializer.Codec().dumps(self.message), pickle.dumps(self.message),
+                     lab_serializer.Codec(compress_threshold=1).dumps(self.message)):
+            with self.assertRaises(ValueError):
+                codec.loads(data)
+        with self.assertRaises(ValueError):
+            lab_serializer.Codec(allow_pickle=False)
+
+    @unittest.skipIf(lab_serializer.msgpack is None, 'msgpack not installed')
+    def test_refuse_pickle_channel(self):
+        """Channels not allowing pickle refuse pickled messages of other members"""
+        chan = local_channel(serializer=lab_serializer.MsgpackSerializer())
+        a = chan.member(chan.join('codec'))
+        b = chan.member(chan.join('codec'))
+        pickle_chan = local_channel()
+        p = pickle_chan.member(chan.join('codec'))  # member using pickle
+        a.send_to({b.pid}, 'fine')
+        self.assertEqual(b.receive_from_any(1), (a.pid, 'fine'))
+        p.send_to({b.pid}, 'pickled')
+        with self.assertRaises(ValueError):
+            b.receive_from_any(1)
+        for member in (a, b, p):
+            member.leave('codec')
+        pickle_chan.close()
+        chan.close()
+
+
+class TestTrace(unittest.TestCase):
+    """Recording and replaying channel traffic (see lab_trace and channel_replay)"""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'channel.trace')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def record(self) -> tuple:
+        chan = local_channel(record=self.path)
+        a = chan.member(chan.join('client'))
+        b = chan.member(chan.join('server'))
+        a.send_to({b.pid}, 'request')
+        b.receive_from_any(1)
+        b.send_to_all('reply', subgroup='client', exclude_self=True)
+        a.receive_from_any(1)
+        a.leave('client')
+        b.leave('server')
+        chan.close()
+        return a.pid, b.pid
+
+    def test_record(self):
+        """All joins, sends, receives and leaves are recorded in order"""
+        a, b = self.record()
+        records: list = list(lab_trace.read_trace(self.path))
+        self.assertEqual([(lab_trace.KINDS[r.kind], r.sender, r.targets) for r in records],
+                         [('join', a, ['client']), ('join', b, ['server']),
+                          ('send', a, [b]), ('receive', a, [b]),
+                          ('broadcast', b, ['client']), ('receive', b, [a]),
+                          ('leave', a, ['client']), ('leave', b, ['server'])])
+        self.assertEqual(records[4].flags, lab_trace.EXCLUDE_SELF)
+        self.assertEqual(records[2].size, len(lab_serializer.Codec().dumps('request')))
+        self.assertEqual([r.time for r in records], sorted(r.time for r in records))
+
+    def test_replay(self):
+        """Replaying a trace delivers as many messages as were received"""
+        self.record()
+        chan = local_channel()
+        result: dict = channel_replay.replay(chan, lab_trace.read_traces([self.path]), speed=0, timeout=1)
+        chan.close()
+        self.assertEqual(result['sent'], 2)
+        self.assertEqual(result['expected'], 2)
+        self.assertEqual(result['received'], 2)
+
+    def test_long_ids(self):
+        """Ids longer than 255 bytes are stored in full, ids beyond 64 KiB are truncated"""
+        writer = lab_trace.TraceWriter(self.path)
+        writer.record(lab_trace.JOIN, 1.0, 'p' * 300, ['g' * 70000])
+        writer.close()
+        record: lab_trace.TraceRecord = next(lab_trace.read_trace(self.path))
+        self.assertEqual(record.sender, 'p' * 300)
+        self.assertEqual(record.targets, ['g' * 0xFFFF])
+
+    def test_payload_size(self):
+        """Replayed messages have the traced serialized size where the envelope allows it"""
+        for codec in (lab_serializer.Codec(), lab_serializer.Codec(timestamps=True, compress_threshold=64)):
+            envelope: int = len(codec.dumps((0.0, b'')))
+            self.assertEqual(channel_replay.payload_size(codec, envelope - 1), 0)
+            for size in (envelope, 100, 1000, 100000):
+                n: int = channel_replay.payload_size(codec, size)
+                serialized: int = len(lab_serializer.Codec(timestamps=codec.timestamps).dumps((0.0, b'x' * n)))
+                self.assertLessEqual(serialized, size)
+                self.assertGreater(serialized, size - 4)
+
+
+
+class TestLogging(unittest.TestCase):
+    """Sampled and asynchronous logging (see lab_logging)"""
+
+    def setUp(self):
+        self.logger = logging.getLogger('vs2lab')
+        self.handlers: list = list(self.logger.handlers)
+        self.cwd: str = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+
+    def tearDown(self):
+        lab_logging.shutdown()
+        for handler in self.logger.handlers[len(self.handlers):]:
+            self.logger.removeHandler(handler)
+            handler.close()
+        path: str = os.getcwd()
+        os.chdir(self.cwd)
+        shutil.rmtree(path)
+
+    def test_sampling_filter(self):
+        """Every n-th DEBUG record of sampled loggers passes, other levels and loggers always pass"""
+        sampling = lab_logging.SamplingFilter({'vs2lab.channel': 0.25, 'vs2lab.channel.quiet': 0})
+
+        def passed(name: str, level: int) -> int:
+            return sum(sampling.filter(logging.LogRecord(name, level, __file__, 0, 'message', None, None))
+                       for _ in range(100))
+
+        self.assertEqual(passed('vs2lab.channel', logging.DEBUG), 25)
+        self.assertEqual(passed('vs2lab.channel.member', logging.DEBUG), 25)
+        self.assertEqual(passed('vs2lab.channel', logging.INFO), 100)
+        self.assertEqual(passed('vs2lab.channel.quiet', logging.DEBUG), 0)
+        self.assertEqual(passed('vs2lab.channels', logging.DEBUG), 100)
+
+    def test_async_mode(self):
+        """In async mode all records are formatted and written to the log file by shutdown"""
+        lab_logging.setup(stream_level=logging.CRITICAL, file_postfix='-test', async_mode=True,
+                          sample={'vs2lab.test': 0.5})
+        logger = logging.getLogger('vs2lab.test')
+        for i in range(10):
+            logger.debug('debug %d', i)
+        logger.info('info %s', 'done')
+        lab_logging.shutdown()
+        with open('vs2lab-test.log') as f:
+            lines: list = f.read().splitlines()
+        self.assertEqual([line.split(' - ', 3)[3] for line in lines],
+                         ['debug 0', 'debug 2', 'debug 4', 'debug 6', 'debug 8', 'info done'])
+        self.assertEqual(lines[-1].split(' - ')[1:3], ['vs2lab.test', 'INFO'])
+
+
+if __name__ == '__main__':
+    unittest.main()